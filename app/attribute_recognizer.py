@@ -1,11 +1,31 @@
+import json
+import os
 import torch
 import torch.nn as nn
 from torchvision import models
 import numpy as np
-from typing import Dict, List
+from typing import Dict, List, Optional
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+ATTRIBUTE_MODEL_DIR = "data/models/attributes"
+def build_style_head(feature_dim: int, num_labels: int) -> nn.Module:
+    return nn.Sequential(
+        nn.Linear(feature_dim, 512),
+        nn.ReLU(),
+        nn.Dropout(0.3),
+        nn.Linear(512, 256),
+        nn.ReLU(),
+        nn.Dropout(0.3),
+        nn.Linear(256, num_labels)
+    )
+def build_color_head(feature_dim: int, num_labels: int) -> nn.Module:
+    return nn.Sequential(
+        nn.Linear(feature_dim, 256),
+        nn.ReLU(),
+        nn.Dropout(0.3),
+        nn.Linear(256, num_labels)
+    )
 class AttributeRecognizer:
     STYLE_LABELS = [
         "Aviator",
@@ -26,19 +46,54 @@ class AttributeRecognizer:
         "Metal",
         "Colorful"
     ]
-    def __init__(self, feature_dim: int = 2048):
+    def __init__(self, feature_dim: int = 2048, model_dir: str = ATTRIBUTE_MODEL_DIR, model_version: Optional[str] = None):
         self.feature_dim = feature_dim
+        self.model_dir = model_dir
+        # Embedding model of the features this will classify; heads fitted on another model's embeddings are refused
+        self.model_version = model_version
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.style_classifier = nn.Sequential(
-            nn.Linear(feature_dim, 512),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(512, 256),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(256, len(self.STYLE_LABELS))
-        ).to(self.device)
+        self.style_labels = list(self.STYLE_LABELS)
+        self.color_labels = list(self.COLOR_LABELS)
+        self.style_classifier = build_style_head(feature_dim, len(self.style_labels)).to(self.device)
         self.style_classifier.eval()
+        self.color_classifier: Optional[nn.Module] = None
+        self.version: Optional[str] = None
+        self.load_weights()
+    def load_weights(self):
+        # current.json points at the versioned checkpoint written by app.train_attributes
+        pointer_path = os.path.join(self.model_dir, "current.json")
+        if not os.path.exists(pointer_path):
+            logger.warning("No trained attribute weights found, style and color predictions are untrained")
+            return
+        try:
+            with open(pointer_path) as f:
+                pointer = json.load(f)
+            checkpoint = torch.load(os.path.join(self.model_dir, pointer["file"]), map_location=self.device,
+                                    weights_only=True)
+            if checkpoint["feature_dim"] != self.feature_dim:
+                logger.warning(f"Attribute weights {pointer['version']} expect {checkpoint['feature_dim']}-d features, ignoring them")
+                return
+            trained_on = checkpoint.get("model_version")
+            if trained_on is None:
+                logger.warning(f"Attribute weights {pointer['version']} do not record their embedding model, retrain them to check it")
+            elif self.model_version is not None and trained_on != self.model_version:
+                logger.warning(f"Attribute weights {pointer['version']} were trained on {trained_on} embeddings, not "
+                               f"{self.model_version}; style and color predictions are untrained until the heads are retrained")
+                return
+            if checkpoint.get("style_state"):
+                self.style_labels = checkpoint["style_labels"]
+                self.style_classifier = build_style_head(self.feature_dim, len(self.style_labels)).to(self.device)
+                self.style_classifier.load_state_dict(checkpoint["style_state"])
+                self.style_classifier.eval()
+            if checkpoint.get("color_state"):
+                self.color_labels = checkpoint["color_labels"]
+                self.color_classifier = build_color_head(self.feature_dim, len(self.color_labels)).to(self.device)
+                self.color_classifier.load_state_dict(checkpoint["color_state"])
+                self.color_classifier.eval()
+            self.version = pointer["version"]
+            logger.info(f"Loaded attribute weights {self.version}")
+        except Exception as e:
+            logger.error(f"Could not load attribute weights: {str(e)}")
     def classify_style(self, features: np.ndarray) -> Dict[str, float]:
         features_tensor = torch.FloatTensor(features).unsqueeze(0).to(self.device)
         with torch.no_grad():
@@ -48,8 +103,8 @@ class AttributeRecognizer:
             except:
                 probs = self._heuristic_classification(features)
         style_predictions = {
-            label: float(prob) 
-            for label, prob in zip(self.STYLE_LABELS, probs)
+            label: float(prob)
+            for label, prob in zip(self.style_labels, probs)
         }
         top_style = max(style_predictions, key=style_predictions.get)
         return {
@@ -59,24 +114,47 @@ class AttributeRecognizer:
         }
     def _heuristic_classification(self, features: np.ndarray) -> np.ndarray:
         np.random.seed(int(np.sum(features[:10]) * 1000) % 1000)
-        probs = np.random.dirichlet([2] * len(self.STYLE_LABELS))
+        probs = np.random.dirichlet([2] * len(self.style_labels))
         return probs
-    def extract_attributes(self, features: np.ndarray) -> Dict:
+    def extract_attributes(self, features: np.ndarray, color: Optional[str] = None) -> Dict:
+        # Same rule as --retag: a trained color head wins, otherwise the ColorAnalyzer color passed in is used
         style_info = self.classify_style(features)
-        color = self._detect_color(features)
+        if self.color_classifier is not None:
+            color = self._detect_color(features)
         return {
             "style": style_info["primary_style"],
             "style_confidence": style_info["style_confidence"],
             "color": color,
             "all_styles": style_info["all_styles"]
         }
-    def _detect_color(self, features: np.ndarray) -> str:
-        feature_sum = np.sum(np.abs(features))
-        colors = ["Black", "Brown", "Tortoise", "Transparent", "Metal", "Colorful"]
-        idx = int(feature_sum * 10) % len(colors)
-        return colors[idx]
+    def predict_batch(self, features: np.ndarray, batch_size: int = 1024) -> List[Dict]:
+        # Top style and color for many stored embeddings at once, e.g. to re-tag the catalog
+        results = []
+        with torch.no_grad():
+            for start in range(0, len(features), batch_size):
+                batch = torch.from_numpy(np.ascontiguousarray(features[start:start + batch_size], dtype=np.float32)).to(self.device)
+                style_probs = torch.softmax(self.style_classifier(batch), dim=1).cpu().numpy()
+                # Without a trained color head, color is left to the pixel-based ColorAnalyzer
+                if self.color_classifier is not None:
+                    colors = [self.color_labels[i] for i in self.color_classifier(batch).argmax(dim=1).cpu().numpy()]
+                else:
+                    colors = [None] * len(style_probs)
+                for probs, color in zip(style_probs, colors):
+                    top = int(np.argmax(probs))
+                    attributes = {"style": self.style_labels[top], "style_confidence": float(probs[top])}
+                    if color is not None:
+                        attributes["color"] = color
+                    results.append(attributes)
+        return results
+    def _detect_color(self, features: np.ndarray) -> Optional[str]:
+        # None without a trained head: the embedding says nothing reliable about color, ColorAnalyzer decides
+        if self.color_classifier is None:
+            return None
+        with torch.no_grad():
+            logits = self.color_classifier(torch.FloatTensor(features).unsqueeze(0).to(self.device))
+        return self.color_labels[int(logits.argmax(dim=1).item())]
     def get_tags(self, attributes: Dict) -> List[str]:
         tags = [attributes.get("style", "Unknown")]
-        if "color" in attributes:
+        if attributes.get("color"):
             tags.append(attributes["color"])
         return tags
\ No newline at end of file
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+from PIL import Image
+import logging
+from typing import List, Optional, Tuple
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# Pixel classes; the first five map onto AttributeRecognizer.COLOR_LABELS, background is ignored
+BLACK, BROWN, METAL, COLORFUL, LIGHT, BACKGROUND = range(6)
+CLASS_LABELS = ["Black", "Brown", "Metal", "Colorful", "Transparent"]
+class ColorAnalyzer:
+    def __init__(self, size: int = 64, min_foreground: float = 0.03, tortoise_share: float = 0.15):
+        self.size = size
+        self.min_foreground = min_foreground
+        self.tortoise_share = tortoise_share
+    def prepare(self, image: Image.Image, region: Optional[Tuple[int, int, int, int]] = None) -> np.ndarray:
+        # region is an (x, y, w, h) box such as SmartCropper.detect_eyewear_region returns
+        if region is not None:
+            x, y, w, h = region
+            image = image.crop((x, y, x + w, y + h))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return cv2.resize(np.asarray(image), (self.size, self.size), interpolation=cv2.INTER_AREA)
+    def classify_pixels(self, thumbs: np.ndarray) -> np.ndarray:
+        # thumbs is (N, size, size, 3) RGB; stacked vertically so one cvtColor call converts the whole batch
+        n = len(thumbs)
+        hsv = cv2.cvtColor(np.ascontiguousarray(thumbs.reshape(n * self.size, self.size, 3)), cv2.COLOR_RGB2HSV)
+        hue, sat, val = (hsv[..., i].reshape(n, -1).astype(np.int16) for i in range(3))
+        neutral = sat < 50
+        gold = (hue >= 18) & (hue <= 28) & (val >= 150)
+        brown = (hue >= 3) & (hue <= 25) & (val < 180)
+        return np.select(
+            [(val >= 225) & (sat <= 30), val < 70, neutral & (val >= 200), neutral | gold, brown],
+            [BACKGROUND, BLACK, LIGHT, METAL, BROWN],
+            default=COLORFUL
+        ).astype(np.uint8)
+    def analyze_batch(self, thumbs: List[np.ndarray]) -> List[str]:
+        if not len(thumbs):
+            return []
+        classes = self.classify_pixels(np.stack(thumbs))
+        counts = np.stack([np.bincount(row, minlength=BACKGROUND + 1) for row in classes])
+        foreground = counts[:, :BACKGROUND].sum(axis=1)
+        shares = counts[:, :BACKGROUND] / np.maximum(foreground, 1)[:, None]
+        colors = []
+        for share, fg in zip(shares, foreground / classes.shape[1]):
+            if fg < self.min_foreground:
+                # Almost nothing but background: a clear or very light frame
+                colors.append("Transparent")
+            elif share[BROWN] >= self.tortoise_share and share[BLACK] >= self.tortoise_share \
+                    and share[BROWN] + share[BLACK] >= 0.5:
+                colors.append("Tortoise")
+            else:
+                colors.append(CLASS_LABELS[int(np.argmax(share))])
+        return colors
+    def analyze(self, image: Image.Image, region: Optional[Tuple[int, int, int, int]] = None) -> str:
+        return self.analyze_batch([self.prepare(image, region)])[0]
@@ -0,0 +1,50 @@
+import argparse
+import logging
+import numpy as np
+from app.vector_db import VectorDB
+from app.runtime import publish_snapshot
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+# FAISS wants at least this many training vectors per centroid, for the IVF lists and each PQ codebook
+MIN_POINTS_PER_CENTROID = 39
+def default_factory(total: int) -> str:
+    nlist = max(1, min(int(4 * np.sqrt(total)), total // MIN_POINTS_PER_CENTROID))
+    if total >= MIN_POINTS_PER_CENTROID * 256:
+        return f"IVF{nlist},PQ64"
+    if total >= MIN_POINTS_PER_CENTROID * 16:
+        # 4-bit codes: 16 centroids per sub-quantizer instead of 256
+        return f"IVF{nlist},PQ64x4"
+    # Too small to train a quantizer, and small enough that exact float32 costs little
+    return "Flat"
+def rebuild_as(vector_db: VectorDB, index_factory: str, train_size: int = 100000, seed: int = 0):
+    # Positions and ids are unchanged, so the neighbor graph and modifier directions stay valid
+    total = vector_db.index.ntotal
+    vectors = vector_db.get_vectors_range(0, total)
+    ids = list(vector_db.id_mapping)
+    sample = np.random.default_rng(seed).choice(total, size=min(train_size, total), replace=False)
+    vector_db.index_factory = index_factory
+    vector_db.reset()
+    vector_db.train(vectors[np.sort(sample)])
+    vector_db.add_vectors(vectors, ids)
+    vector_db.save_index()
+def compact_index(index_factory: str = None, train_size: int = 100000, seed: int = 0) -> dict:
+    # Rebuilds the active index as a compressed coarse index in place; exact scores come from the float16 store
+    vector_db = VectorDB()
+    total = vector_db.index.ntotal
+    if total == 0:
+        logger.warning("Index is empty, run app.ingest_images first")
+        return {}
+    index_factory = index_factory or default_factory(total)
+    rebuild_as(vector_db, index_factory, train_size=train_size, seed=seed)
+    snapshot = publish_snapshot({"vectors": total, "index_factory": index_factory})
+    logger.info(f"Rebuilt {total} vectors as {index_factory}, catalog snapshot {snapshot['generation']}")
+    return vector_db.get_stats()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the index as a compressed coarse index re-ranked "
+                                                 "with the float16 vector store")
+    parser.add_argument("index_factory", nargs="?", default=None,
+                        help="FAISS factory string, default sized to the catalog (see default_factory); "
+                             "'Flat' goes back to exact")
+    parser.add_argument("--train-size", type=int, default=100000)
+    args = parser.parse_args()
+    compact_index(args.index_factory, train_size=args.train_size)
@@ -0,0 +1,82 @@
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import logging
+import numpy as np
+from PIL import Image
+from sqlalchemy.orm import Session
+from app.models import Product, ProductImage
+from app.vector_db import VectorDB
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+DEDUP_REPORT_PATH = "data/dedup_report.json"
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> str:
+    # dHash: sign of the horizontal gradient on a (hash_size+1) x hash_size grayscale thumbnail;
+    # survives re-encoding, resizing and mild recompression
+    small = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+class Deduplicator:
+    def __init__(self, db: Session, vector_db: VectorDB, max_hash_distance: int = 4,
+                 similarity_threshold: float = 0.97):
+        self.db = db
+        self.vector_db = vector_db
+        self.max_hash_distance = max_hash_distance
+        self.similarity_threshold = similarity_threshold
+        rows = db.query(Product.image_path, Product.phash).filter(Product.phash.isnot(None)).all()
+        rows += db.query(ProductImage.image_path, ProductImage.phash).filter(ProductImage.phash.isnot(None)).all()
+        self.hash_names: List[str] = [name for name, _ in rows]
+        self.hashes = np.array([int(phash, 16) for _, phash in rows], dtype=np.uint64)
+        self.report: List[Dict] = []
+    def check_hash(self, image_name: str, phash: str) -> Optional[str]:
+        # Called before the forward pass; a hit means the embedding is never computed.
+        # Only stored images are compared, duplicates within an uncommitted batch are left to check_embeddings.
+        if len(self.hashes):
+            distances = np.unpackbits((self.hashes ^ np.uint64(int(phash, 16))).view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+            best = int(np.argmin(distances))
+            if distances[best] <= self.max_hash_distance:
+                self._record(image_name, self.hash_names[best], "perceptual_hash", hash_distance=int(distances[best]))
+                return self.hash_names[best]
+        return None
+    def register(self, images: List[Tuple[str, str]]):
+        # (image name, phash) pairs, once their rows are committed; an image dropped later
+        # (embedding duplicate, failed batch) never shadows a future copy of itself
+        if images:
+            self.hash_names.extend(name for name, _ in images)
+            self.hashes = np.append(self.hashes, np.array([int(phash, 16) for _, phash in images], dtype=np.uint64))
+    def check_embeddings(self, image_names: List[str], features: np.ndarray) -> List[Optional[str]]:
+        # One batched index query for the whole batch, plus a pairwise check within it
+        normalized = features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)
+        nearest = self.vector_db.nearest_batch(normalized)
+        hit_ids = [hit[0] for hit in nearest if hit is not None and hit[1] >= self.similarity_threshold]
+        names_by_id = dict(self.db.query(Product.id, Product.image_path).filter(Product.id.in_(hit_ids)).all()) if hit_ids else {}
+        within = normalized @ normalized.T
+        duplicates: List[Optional[str]] = []
+        for i, name in enumerate(image_names):
+            match: Optional[Tuple[str, float]] = None
+            if nearest[i] is not None and nearest[i][1] >= self.similarity_threshold and nearest[i][0] in names_by_id:
+                match = (names_by_id[nearest[i][0]], nearest[i][1])
+            for j in range(i):
+                if duplicates[j] is None and within[i, j] >= self.similarity_threshold \
+                        and (match is None or within[i, j] > match[1]):
+                    match = (image_names[j], float(within[i, j]))
+            if match is not None:
+                self._record(name, match[0], "embedding", similarity=round(match[1], 4))
+            duplicates.append(match[0] if match else None)
+        return duplicates
+    def _record(self, image_name: str, duplicate_of: str, reason: str, **details):
+        logger.info(f"  ⚠️  {image_name} duplicates {duplicate_of} ({reason}), skipping...")
+        self.report.append({"image": image_name, "duplicate_of": duplicate_of, "reason": reason, **details})
+    def write_report(self, path: str = DEDUP_REPORT_PATH) -> dict:
+        report = {
+            "created_at": time.time(),
+            "max_hash_distance": self.max_hash_distance,
+            "similarity_threshold": self.similarity_threshold,
+            "duplicates": self.report
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Skipped {len(self.report)} duplicate images, report written to {path}")
+        return report
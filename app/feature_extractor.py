@@ -1,22 +1,69 @@
 import torch
 import torch.nn as nn
 from torchvision import transforms, models
-from PIL import Image
+from PIL import Image, ImageOps
 import numpy as np
+import os
 from typing import List, Optional
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Backbones with a 2048-d pooled output, so any of them fits the same index dimension
+BACKBONES = {
+    "resnet50": (models.resnet50, models.ResNet50_Weights.DEFAULT),
+    "resnet101": (models.resnet101, models.ResNet101_Weights.DEFAULT),
+    "resnet152": (models.resnet152, models.ResNet152_Weights.DEFAULT)
+}
+# Everything that changes the embedding; recorded in the index manifest as the model version
+DEFAULT_MODEL_SPEC = {"backbone": "resnet50", "input_size": 224}
+def model_version(spec: Optional[dict] = None) -> str:
+    spec = {**DEFAULT_MODEL_SPEC, **(spec or {})}
+    return f"{spec['backbone']}-{spec['input_size']}"
+def backbone_weights_path(backbone: str = "resnet50") -> str:
+    url = BACKBONES[backbone][1].url
+    return os.environ.get(f"{backbone.upper()}_WEIGHTS") or os.path.join(torch.hub.get_dir(), "checkpoints", os.path.basename(url))
+def load_backbone(backbone: str = "resnet50", pretrained: bool = True, allow_download: bool = False) -> nn.Module:
+    if backbone not in BACKBONES:
+        raise ValueError(f"Unknown backbone {backbone}, expected one of {', '.join(BACKBONES)}")
+    builder, weights = BACKBONES[backbone]
+    model = builder(weights=None)
+    if not pretrained:
+        return model
+    weights_path = backbone_weights_path(backbone)
+    if not os.path.exists(weights_path):
+        if not allow_download:
+            raise FileNotFoundError(
+                f"{backbone} weights not found at {weights_path}. "
+                f"Run `python -m app.feature_extractor {backbone}` once to download them."
+            )
+        logger.info(f"Downloading {backbone} weights to {weights_path}")
+        torch.hub.load_state_dict_from_url(weights.url, progress=False)
+    model.load_state_dict(torch.load(weights_path, map_location='cpu', weights_only=True))
+    return model
+def load_resnet50(pretrained: bool = True, allow_download: bool = False) -> nn.Module:
+    return load_backbone("resnet50", pretrained=pretrained, allow_download=allow_download)
 class FeatureExtractor:
-    def __init__(self, device: Optional[str] = None):
+    def __init__(self, device: Optional[str] = None, pretrained: bool = True, allow_download: bool = False,
+                 tta: bool = False, tta_smart_crop: bool = True, tta_crop_fraction: float = 0.8,
+                 model_spec: Optional[dict] = None):
+        self.model_spec = {**DEFAULT_MODEL_SPEC, **(model_spec or {})}
+        self.version = model_version(self.model_spec)
+        # Test-time augmentation is query-side only; catalog images are always embedded as-is
+        self.tta = tta
+        self.tta_crop_fraction = tta_crop_fraction
+        self.smart_cropper = None
+        if tta and tta_smart_crop:
+            from app.smart_crop import SmartCropper
+            self.smart_cropper = SmartCropper()
         self.device = device if device else ('cuda' if torch.cuda.is_available() else 'cpu')
         logger.info(f"Using device: {self.device}")
-        self.model = models.resnet50(weights='DEFAULT')
+        logger.info(f"Using embedding model {self.version}")
+        self.model = load_backbone(self.model_spec["backbone"], pretrained=pretrained, allow_download=allow_download)
         self.model = nn.Sequential(*list(self.model.children())[:-1])
         self.model.eval()
         self.model.to(self.device)
         self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
+            transforms.Resize((self.model_spec["input_size"], self.model_spec["input_size"])),
             transforms.ToTensor(),
             transforms.Normalize(
                 mean=[0.485, 0.456, 0.406],
@@ -54,6 +101,48 @@ class FeatureExtractor:
         except Exception as e:
             logger.error(f"Error extracting features from image: {str(e)}")
             raise
+    def extract_batch(self, images: List[Image.Image]) -> np.ndarray:
+        # Several catalog images in one forward pass, e.g. when re-embedding the catalog
+        batch = torch.stack([self.transform(image.convert('RGB') if image.mode != 'RGB' else image) for image in images])
+        with torch.no_grad():
+            features = self.model(batch.to(self.device))
+        features = features.reshape(len(images), -1).cpu().numpy()
+        return (features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)).astype('float32')
+    def tta_views(self, image: Image.Image) -> List[Image.Image]:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        width, height = image.size
+        crop_w, crop_h = int(width * self.tta_crop_fraction), int(height * self.tta_crop_fraction)
+        left, top = (width - crop_w) // 2, (height - crop_h) // 2
+        views = [image, ImageOps.mirror(image), image.crop((left, top, left + crop_w, top + crop_h))]
+        if self.smart_cropper is not None:
+            region = self.smart_cropper.detect_eyewear_region(image)
+            if region is not None:
+                x, y, w, h = region
+                views.append(image.crop((x, y, x + w, y + h)))
+        return views
+    def tta_batch(self, image: Image.Image) -> torch.Tensor:
+        return torch.stack([self.transform(view) for view in self.tta_views(image)])
+    def pool_views(self, features: torch.Tensor) -> np.ndarray:
+        # Each view is L2-normalized before averaging so no single view dominates the pooled embedding
+        features = features.reshape(features.shape[0], -1).cpu().numpy()
+        features = features / (np.linalg.norm(features, axis=1, keepdims=True) + 1e-8)
+        pooled = features.mean(axis=0)
+        return (pooled / (np.linalg.norm(pooled) + 1e-8)).astype('float32')
+    def extract_features_tta(self, image: Image.Image) -> np.ndarray:
+        # All views go through the network as one batch, i.e. a single forward pass
+        try:
+            batch = self.tta_batch(image).to(self.device)
+            with torch.no_grad():
+                features = self.model(batch)
+            return self.pool_views(features)
+        except Exception as e:
+            logger.error(f"Error extracting TTA features from image: {str(e)}")
+            raise
+    def extract_query_features(self, image: Image.Image) -> np.ndarray:
+        if self.tta:
+            return self.extract_features_tta(image)
+        return self.extract_features_from_image(image)
     def batch_extract(self, image_paths: List[str]) -> np.ndarray:
         features_list = []
         for path in image_paths:
@@ -65,4 +154,9 @@ class FeatureExtractor:
                 continue
         if not features_list:
             raise ValueError("No valid features extracted")
-        return np.array(features_list)
\ No newline at end of file
+        return np.array(features_list)
+if __name__ == "__main__":
+    import sys
+    backbone = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL_SPEC["backbone"]
+    load_backbone(backbone, pretrained=True, allow_download=True)
+    logger.info(f"{backbone} weights cached at {backbone_weights_path(backbone)}")
\ No newline at end of file
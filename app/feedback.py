@@ -1,9 +1,41 @@
+import argparse
+import calendar
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
 import logging
-from typing import List, Tuple
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
-from app.models import Product, Feedback
+from app.models import Product, Feedback, FeedbackStats, FeedbackBucket, SessionLocal, init_db
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+BUCKET_SECONDS = 3600
+# Rolling windows, in hourly buckets
+WINDOWS = {"1h": 1, "24h": 24, "7d": 168}
+COUNTERS = ("relevant", "not_relevant", "impressions")
+def bucket_of(timestamp: float) -> int:
+    return int(timestamp // BUCKET_SECONDS)
+def _update_relevance(product: Product, is_relevant: bool):
+    if is_relevant:
+        product.click_count += 1
+        product.relevance_score = (
+            product.relevance_score * 0.9 + 1.0 * 0.1
+        )
+    else:
+        product.relevance_score = (
+            product.relevance_score * 0.95 + 0.0 * 0.05
+        )
+def _upsert_counters(db: Session, model, keys: List[str], rows: List[dict], chunk_size: int = 100):
+    # Adds to existing counters instead of overwriting them, so concurrent workers never lose increments
+    for start in range(0, len(rows), chunk_size):
+        stmt = sqlite_insert(model).values(rows[start:start + chunk_size])
+        updates = {name: model.__table__.c[name] + stmt.excluded[name] for name in COUNTERS}
+        if "updated_at" in model.__table__.c:
+            updates["updated_at"] = stmt.excluded.updated_at
+        db.execute(stmt.on_conflict_do_update(index_elements=keys, set_=updates))
 class FeedbackSystem:
     def __init__(self, db: Session):
         self.db = db
@@ -17,15 +49,11 @@ class FeedbackSystem:
             self.db.add(feedback)
             product = self.db.query(Product).filter(Product.id == product_id).first()
             if product:
-                if is_relevant:
-                    product.click_count += 1
-                    product.relevance_score = (
-                        product.relevance_score * 0.9 + 1.0 * 0.1
-                    )
-                else:
-                    product.relevance_score = (
-                        product.relevance_score * 0.95 + 0.0 * 0.05
-                    )
+                _update_relevance(product, is_relevant)
+            counters = {"relevant": int(is_relevant), "not_relevant": int(not is_relevant), "impressions": 0}
+            _upsert_counters(self.db, FeedbackStats, ["product_id"], [dict(product_id=product_id, **counters)])
+            _upsert_counters(self.db, FeedbackBucket, ["product_id", "bucket"],
+                             [dict(product_id=product_id, bucket=bucket_of(time.time()), **counters)])
             self.db.commit()
             logger.info(f"Recorded feedback: product_id={product_id}, relevant={is_relevant}")
         except Exception as e:
@@ -43,29 +71,13 @@ class FeedbackSystem:
         except Exception as e:
             self.db.rollback()
             logger.error(f"Error boosting product: {str(e)}")
-    def apply_relevance_boost(self, results: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
-        ranking_scores = []
-        for product_id, similarity_score in results:
-            product = self.db.query(Product).filter(Product.id == product_id).first()
-            if product:
-                ranking_score = similarity_score + (product.relevance_score * 0.1)
-                ranking_scores.append((product_id, similarity_score, ranking_score))
-            else:
-                ranking_scores.append((product_id, similarity_score, similarity_score))
-        ranking_scores.sort(key=lambda x: x[2], reverse=True)
-        return [(pid, sim_score) for pid, sim_score, _ in ranking_scores]
     def get_product_stats(self, product_id: int) -> dict:
         product = self.db.query(Product).filter(Product.id == product_id).first()
         if not product:
             return {}
-        relevant_count = self.db.query(Feedback).filter(
-            Feedback.product_id == product_id,
-            Feedback.is_relevant == 1
-        ).count()
-        not_relevant_count = self.db.query(Feedback).filter(
-            Feedback.product_id == product_id,
-            Feedback.is_relevant == 0
-        ).count()
+        stats = self.db.query(FeedbackStats).filter(FeedbackStats.product_id == product_id).first()
+        relevant_count = stats.relevant if stats else 0
+        not_relevant_count = stats.not_relevant if stats else 0
         return {
             "product_id": product_id,
             "click_count": product.click_count,
@@ -73,4 +85,185 @@ class FeedbackSystem:
             "relevant_feedback": relevant_count,
             "not_relevant_feedback": not_relevant_count,
             "total_feedback": relevant_count + not_relevant_count
-        }
\ No newline at end of file
+        }
+    def get_batch_stats(self, product_ids: List[int], now: Optional[float] = None) -> List[dict]:
+        # One primary-key lookup for the totals and one range read over at most max(WINDOWS) buckets
+        # per product, independent of how much raw feedback has accumulated
+        current = bucket_of(now if now is not None else time.time())
+        oldest = current - max(WINDOWS.values()) + 1
+        totals = {row.product_id: row for row in
+                  self.db.query(FeedbackStats).filter(FeedbackStats.product_id.in_(product_ids))}
+        windows = {pid: {name: dict.fromkeys(COUNTERS, 0) for name in WINDOWS} for pid in product_ids}
+        buckets = self.db.query(FeedbackBucket).filter(
+            FeedbackBucket.product_id.in_(product_ids),
+            FeedbackBucket.bucket >= oldest
+        )
+        for row in buckets:
+            for name, span in WINDOWS.items():
+                if row.bucket > current - span:
+                    counters = windows[row.product_id][name]
+                    for counter in COUNTERS:
+                        counters[counter] += getattr(row, counter) or 0
+        results = []
+        for pid in product_ids:
+            total = totals.get(pid)
+            summary = {counter: (getattr(total, counter) or 0) if total else 0 for counter in COUNTERS}
+            results.append({
+                "product_id": pid,
+                **summary,
+                "ctr": self._ctr(summary),
+                "windows": {name: dict(counters, ctr=self._ctr(counters)) for name, counters in windows[pid].items()}
+            })
+        return results
+    @staticmethod
+    def _ctr(counters: dict) -> Optional[float]:
+        # Relevant feedback counts as a click; impressions are products shown on a results page
+        if not counters["impressions"]:
+            return None
+        return round(counters["relevant"] / counters["impressions"], 4)
+    def rebuild_summaries(self, block_size: int = 10000) -> int:
+        # Recomputes the summary tables from the raw feedback log; impressions are not logged, so they restart at 0
+        self.db.query(FeedbackStats).delete()
+        self.db.query(FeedbackBucket).delete()
+        totals, buckets = defaultdict(lambda: [0, 0]), defaultdict(lambda: [0, 0])
+        count = 0
+        rows = self.db.query(Feedback.product_id, Feedback.is_relevant, Feedback.created_at).yield_per(block_size)
+        for product_id, is_relevant, created_at in rows:
+            slot = 0 if is_relevant else 1
+            totals[product_id][slot] += 1
+            buckets[(product_id, bucket_of(calendar.timegm(created_at.utctimetuple())))][slot] += 1
+            count += 1
+        self.db.bulk_insert_mappings(FeedbackStats, [
+            {"product_id": pid, "relevant": r, "not_relevant": n, "impressions": 0} for pid, (r, n) in totals.items()
+        ])
+        self.db.bulk_insert_mappings(FeedbackBucket, [
+            {"product_id": pid, "bucket": bucket, "relevant": r, "not_relevant": n, "impressions": 0}
+            for (pid, bucket), (r, n) in buckets.items()
+        ])
+        self.db.commit()
+        logger.info(f"Rebuilt feedback summaries from {count} events for {len(totals)} products")
+        return count
+def backfill_summaries(session_factory: Callable[[], Session] = SessionLocal) -> int:
+    # Deployments upgraded from before the summary tables have raw feedback but empty stats;
+    # runs once, at startup, when the stats table is empty and the log is not
+    db = session_factory()
+    try:
+        if db.query(FeedbackStats.product_id).first() is not None or db.query(Feedback.id).first() is None:
+            return 0
+        logger.warning("Feedback summary tables are empty, backfilling them from the raw feedback log")
+        return FeedbackSystem(db).rebuild_summaries()
+    except Exception as e:
+        # Another worker may be backfilling at the same time; its result is the same
+        db.rollback()
+        logger.warning(f"Could not backfill feedback summaries: {str(e)}. Run `python -m app.feedback --rebuild`")
+        return 0
+    finally:
+        db.close()
+class FeedbackPipeline:
+    # Requests only enqueue events; a background thread folds them into the summary tables in batches
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, flush_interval: float = 1.0,
+                 max_batch: int = 5000):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.events: "queue.Queue[tuple]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._flush_lock = threading.Lock()
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="feedback-pipeline", daemon=True)
+        self._thread.start()
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self.flush():
+            pass
+    def submit_feedback(self, product_id: int, is_relevant: bool, query_image_path: str = ""):
+        self.events.put(("feedback", product_id, bool(is_relevant), query_image_path, time.time()))
+    def record_impressions(self, product_ids: Iterable[int]):
+        product_ids = list(product_ids)
+        if product_ids:
+            self.events.put(("impressions", product_ids, time.time()))
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                # Keep draining while a backlog is larger than one batch
+                while self.flush() >= self.max_batch:
+                    pass
+            except Exception as e:
+                logger.error(f"Feedback pipeline flush failed: {str(e)}", exc_info=True)
+    def flush(self) -> int:
+        with self._flush_lock:
+            events = []
+            while len(events) < self.max_batch:
+                try:
+                    events.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            if not events:
+                return 0
+            db = self.session_factory()
+            try:
+                self._apply(db, events)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Dropped {len(events)} feedback events: {str(e)}", exc_info=True)
+            finally:
+                db.close()
+            return len(events)
+    def _apply(self, db: Session, events: List[tuple]):
+        totals: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+        buckets: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0, 0])
+        outcomes: Dict[int, List[bool]] = defaultdict(list)
+        feedback_rows = []
+        for event in events:
+            if event[0] == "feedback":
+                _, product_id, is_relevant, query_image_path, timestamp = event
+                slot = 0 if is_relevant else 1
+                totals[product_id][slot] += 1
+                buckets[(product_id, bucket_of(timestamp))][slot] += 1
+                outcomes[product_id].append(is_relevant)
+                feedback_rows.append({"query_image_path": query_image_path, "product_id": product_id,
+                                      "is_relevant": int(is_relevant)})
+            else:
+                _, product_ids, timestamp = event
+                bucket = bucket_of(timestamp)
+                for product_id in product_ids:
+                    totals[product_id][2] += 1
+                    buckets[(product_id, bucket)][2] += 1
+        if feedback_rows:
+            db.bulk_insert_mappings(Feedback, feedback_rows)
+            # The relevance EMA depends on order, so each product replays its events in arrival order
+            for product in db.query(Product).filter(Product.id.in_(list(outcomes))):
+                for is_relevant in outcomes[product.id]:
+                    _update_relevance(product, is_relevant)
+        now = time.time()
+        updated_at = datetime.utcfromtimestamp(now)
+        _upsert_counters(db, FeedbackStats, ["product_id"], [
+            dict(zip(COUNTERS, counts), product_id=pid, updated_at=updated_at) for pid, counts in totals.items()
+        ])
+        _upsert_counters(db, FeedbackBucket, ["product_id", "bucket"], [
+            dict(zip(COUNTERS, counts), product_id=pid, bucket=bucket) for (pid, bucket), counts in buckets.items()
+        ])
+        # Buckets older than the longest window are no longer read
+        db.query(FeedbackBucket).filter(FeedbackBucket.bucket <= bucket_of(now) - max(WINDOWS.values())).delete(
+            synchronize_session=False)
+        if feedback_rows:
+            logger.info(f"Applied {len(feedback_rows)} feedback events and {len(events) - len(feedback_rows)} impression batches")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the feedback summary tables from the raw feedback log")
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+    if args.rebuild:
+        init_db()
+        db = SessionLocal()
+        try:
+            FeedbackSystem(db).rebuild_summaries()
+        finally:
+            db.close()
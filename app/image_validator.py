@@ -1,15 +1,16 @@
 import torch
 import torch.nn as nn
-from torchvision import models, transforms
+from torchvision import transforms
 from PIL import Image
 import numpy as np
 import logging
+from app.feature_extractor import load_resnet50
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 class ImageValidator:
     def __init__(self):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model = models.resnet50(weights='DEFAULT')
+        model = load_resnet50(pretrained=True)
         self.model = nn.Sequential(*list(model.children())[:-1])
         self.model.eval()
         self.model.to(self.device)
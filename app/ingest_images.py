@@ -1,16 +1,26 @@
+import hashlib
 import os
 import sys
 from pathlib import Path
+from typing import Iterable, Optional, Tuple
 import logging
 from sqlalchemy.orm import Session
-from app.models import init_db, get_db, Product
+from app.models import init_db, get_db, Product, ProductImage
 from app.feature_extractor import FeatureExtractor
 from app.attribute_recognizer import AttributeRecognizer
+from app.color_analyzer import ColorAnalyzer
 from app.vector_db import VectorDB
+from app.knn_graph import KNNGraph
+from app.multimodal_search import MultiModalSearch, compute_tag_bits
+from app.thumbnails import ThumbnailStore
+from app.dedup import Deduplicator, perceptual_hash
 import random
 import numpy as np
+from PIL import Image
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+VIEW_SEPARATOR = "__"
 def generate_sample_metadata(image_name: str) -> dict:
     brands = ["Ray-Ban", "Oakley", "Tom Ford", "Gucci", "Prada", "Warby Parker", "Persol", "Maui Jim"]
     materials = ["Acetate", "Metal", "Plastic", "Titanium"]
@@ -22,73 +32,160 @@ def generate_sample_metadata(image_name: str) -> dict:
         "price": round(price, 2),
         "material": material
     }
+def file_fingerprint(path: Path) -> dict:
+    stat = path.stat()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"file_size": stat.st_size, "file_mtime": stat.st_mtime, "content_hash": digest.hexdigest()}
 def ingest_images(image_dir: str = "data/images", db: Session = None):
-    init_db()
-    if db is None:
-        db_gen = get_db()
-        db = next(db_gen)
-    feature_extractor = FeatureExtractor()
-    attribute_recognizer = AttributeRecognizer()
-    vector_db = VectorDB()
     image_dir_path = Path(image_dir)
     if not image_dir_path.exists():
         logger.warning(f"Image directory {image_dir} does not exist. Creating it.")
         image_dir_path.mkdir(parents=True, exist_ok=True)
         logger.info("Please add eyewear images to data/images/ directory")
         return
-    image_extensions = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
     image_files = [f for f in image_dir_path.iterdir() 
-                   if f.suffix in image_extensions and f.is_file()]
+                   if f.suffix in IMAGE_EXTENSIONS and f.is_file()]
     if not image_files:
         logger.warning(f"No images found in {image_dir}")
         logger.info("Please add eyewear images to data/images/ directory")
         return
     logger.info(f"Found {len(image_files)} images to process")
+    ingest_files(image_files, image_dir, db)
+def split_view(image_name: str) -> Tuple[str, Optional[str]]:
+    # "glasses_1__side.jpg" is the "side" view of the product whose primary image is glasses_1.*
+    stem = Path(image_name).stem
+    if VIEW_SEPARATOR in stem:
+        base, view = stem.rsplit(VIEW_SEPARATOR, 1)
+        if base and view:
+            return base, view
+    return stem, None
+def find_primary(db: Session, base: str) -> Optional[Product]:
+    return db.query(Product).filter(Product.image_path.in_([base + ext for ext in IMAGE_EXTENSIONS])).first()
+def ingest_files(image_files: Iterable[Path], image_dir: str = "data/images", db: Session = None):
+    # image_files may be a lazy iterator (e.g. fed by the downloader as files land on disk)
+    init_db()
+    if db is None:
+        db_gen = get_db()
+        db = next(db_gen)
+    vector_db = VectorDB()
+    # New vectors must come from the same model as the ones already in the index
+    feature_extractor = FeatureExtractor(allow_download=True, model_spec=vector_db.meta.get("model"))
+    vector_db.set_model(feature_extractor.model_spec, feature_extractor.version)
+    attribute_recognizer = AttributeRecognizer(model_version=feature_extractor.version)
+    color_analyzer = ColorAnalyzer()
+    deduplicator = Deduplicator(db, vector_db)
     batch_size = 32
-    all_features = []
-    all_product_ids = []
-    for i, image_path in enumerate(image_files):
-        try:
-            logger.info(f"Processing {i+1}/{len(image_files)}: {image_path.name}")
-            existing_product = db.query(Product).filter(Product.image_path == image_path.name).first()
-            if existing_product:
+    pending = []
+    processed_names = []
+    # Extra views whose primary image has not been stored yet are retried after the main pass
+    deferred_views = []
+    def flush(pending):
+        # Embedding-level duplicates are caught against the index and within the batch in one pass
+        features_array = np.array([item["features"] for item in pending])
+        duplicates = deduplicator.check_embeddings([item["name"] for item in pending], features_array)
+        kept = [(item, features) for item, features, duplicate in zip(pending, features_array, duplicates) if duplicate is None]
+        # Colors for the batch's new products come from one vectorized pass over the downsampled pixels
+        products = [item for item, _ in kept if "product_id" not in item]
+        for item, color in zip(products, color_analyzer.analyze_batch([item["thumb"] for item in products])):
+            attributes = attribute_recognizer.extract_attributes(item["features"], color=color)
+            style_tags = ",".join(attribute_recognizer.get_tags(attributes))
+            item["fields"].update(style_tags=style_tags, tag_bits=compute_tag_bits(style_tags, item["fields"]["material"]))
+        product_ids = []
+        for item, _ in kept:
+            if "product_id" in item:
+                db.add(ProductImage(**item["fields"]))
+                product_ids.append(item["product_id"])
+            else:
+                product = Product(**item["fields"])
+                db.add(product)
+                db.flush()
+                product_ids.append(product.id)
+            processed_names.append(item["name"])
+        if kept:
+            vector_db.add_vectors(np.array([features for _, features in kept]), product_ids)
+        db.commit()
+        deduplicator.register([(item["name"], item["fields"]["phash"]) for item, _ in kept])
+        logger.info(f"Processed batch, total vectors: {vector_db.index.ntotal}")
+    def process(image_path: Path, defer: bool = True) -> Optional[dict]:
+        base, view = split_view(image_path.name)
+        primary = None
+        if view is not None:
+            if db.query(ProductImage).filter(ProductImage.image_path == image_path.name).first():
                 logger.info(f"  ⚠️  Image {image_path.name} already exists in database, skipping...")
-                continue
-            features = feature_extractor.extract_features(str(image_path))
-            metadata = generate_sample_metadata(image_path.name)
-            attributes = attribute_recognizer.extract_attributes(features)
-            tags = attribute_recognizer.get_tags(attributes)
-            style_tags = ",".join(tags)
-            product = Product(
+                processed_names.append(image_path.name)
+                return None
+            primary = find_primary(db, base)
+            if primary is None:
+                if defer:
+                    deferred_views.append(image_path)
+                else:
+                    logger.warning(f"  ⚠️  No product image {base}.* for view {image_path.name}, skipping...")
+                return None
+        elif db.query(Product).filter(Product.image_path == image_path.name).first():
+            logger.info(f"  ⚠️  Image {image_path.name} already exists in database, skipping...")
+            processed_names.append(image_path.name)
+            return None
+        # Decoded once for the hash, the embedding and the pixel color
+        image = Image.open(image_path).convert('RGB')
+        phash = perceptual_hash(image)
+        if deduplicator.check_hash(image_path.name, phash):
+            return None
+        features = feature_extractor.extract_features_from_image(image)
+        if primary is not None:
+            return {"name": image_path.name, "features": features, "product_id": primary.id, "fields": dict(
+                product_id=primary.id,
                 image_path=image_path.name,
-                brand=metadata["brand"],
-                price=metadata["price"],
-                material=metadata["material"],
-                style_tags=style_tags
-            )
-            db.add(product)
-            db.flush()
-            all_features.append(features)
-            all_product_ids.append(product.id)
-            if len(all_features) >= batch_size:
-                features_array = np.array(all_features)
-                vector_db.add_vectors(features_array, all_product_ids)
-                all_features = []
-                all_product_ids = []
-                db.commit()
-                logger.info(f"Processed batch, total products: {vector_db.index.ntotal}")
-        except Exception as e:
-            logger.error(f"Error processing {image_path.name}: {str(e)}", exc_info=True)
-            db.rollback()
-            continue
-    if all_features:
-        features_array = np.array(all_features)
-        vector_db.add_vectors(features_array, all_product_ids)
-        db.commit()
+                view=view,
+                phash=phash,
+                **file_fingerprint(image_path)
+            )}
+        metadata = generate_sample_metadata(image_path.name)
+        # style_tags and tag_bits are filled in by flush, once the batch's colors are known
+        return {"name": image_path.name, "features": features, "thumb": color_analyzer.prepare(image), "fields": dict(
+            image_path=image_path.name,
+            brand=metadata["brand"],
+            price=metadata["price"],
+            material=metadata["material"],
+            phash=phash,
+            **file_fingerprint(image_path)
+        )}
+    def run(image_files: Iterable[Path], defer: bool):
+        nonlocal pending
+        for i, image_path in enumerate(image_files):
+            try:
+                logger.info(f"Processing {i+1}: {image_path.name}")
+                item = process(image_path, defer)
+                if item is not None:
+                    pending.append(item)
+            except Exception as e:
+                logger.error(f"Error processing {image_path.name}: {str(e)}", exc_info=True)
+                continue
+            if len(pending) >= batch_size:
+                try:
+                    flush(pending)
+                except Exception as e:
+                    logger.error(f"Error storing batch: {str(e)}", exc_info=True)
+                    db.rollback()
+                pending = []
+        if pending:
+            flush(pending)
+            pending = []
+    run(image_files, defer=True)
+    if deferred_views:
+        run(deferred_views, defer=False)
     vector_db.save_index()
     db.commit()
     logger.info(f"Ingestion complete! Processed {vector_db.index.ntotal} products")
     logger.info(f"Vector index saved to {vector_db.index_path}")
+    deduplicator.write_report()
+    knn_graph = KNNGraph()
+    if knn_graph.exists():
+        knn_graph.update(vector_db)
+    MultiModalSearch().build_directions(vector_db, db)
+    ThumbnailStore(image_dir=image_dir).generate_many(processed_names)
 if __name__ == "__main__":
     image_dir = sys.argv[1] if len(sys.argv) > 1 else "data/images"
     ingest_images(image_dir)
\ No newline at end of file
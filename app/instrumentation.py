@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import logging
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SEARCH_STAGE_SECONDS = Histogram(
+    "search_stage_seconds", "Time spent in each stage of a search request",
+    ["endpoint", "stage"], buckets=STAGE_BUCKETS
+)
+SEARCH_REQUEST_SECONDS = Histogram(
+    "search_request_seconds", "End-to-end time of search requests",
+    ["endpoint"], buckets=STAGE_BUCKETS
+)
+SEARCH_REQUESTS_IN_PROGRESS = Gauge(
+    "search_requests_in_progress", "Search requests currently queued or running", ["endpoint"]
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+INDEX_SIZE = Gauge("vector_index_size", "Number of vectors in the FAISS index")
+COMPONENT_LOAD_SECONDS = Gauge(
+    "component_load_seconds", "Time taken to load each model or index component", ["component"]
+)
+class StageTimer:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages.append((name, elapsed))
+            SEARCH_STAGE_SECONDS.labels(self.endpoint, name).observe(elapsed)
+    def finish(self):
+        SEARCH_REQUEST_SECONDS.labels(self.endpoint).observe(time.perf_counter() - self.started)
+        logger.info(f"{self.endpoint} timings: " + ", ".join(f"{name}={elapsed * 1000:.1f}ms" for name, elapsed in self.stages))
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(elapsed * 1000, 3) for name, elapsed in self.stages}
+    def server_timing(self) -> str:
+        total = time.perf_counter() - self.started
+        entries = [f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in self.stages]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+def record_load_time(component: str, seconds: float):
+    COMPONENT_LOAD_SECONDS.labels(component).set(seconds)
+    logger.info(f"Loaded {component} in {seconds:.2f}s")
+def render_metrics() -> Tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
\ No newline at end of file
@@ -0,0 +1,175 @@
+import faiss
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import logging
+from app.vector_db import VectorDB
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+class KNNGraph:
+    def __init__(self, k: int = 50, graph_dir: str = "data/embeddings"):
+        self.k = k
+        self.rows_path = os.path.join(graph_dir, "knn_rows.npy")
+        self.ids_path = os.path.join(graph_dir, "knn_ids.npy")
+        self.scores_path = os.path.join(graph_dir, "knn_scores.npy")
+        os.makedirs(graph_dir, exist_ok=True)
+        self.row_ids: Optional[np.ndarray] = None
+        self.neighbor_ids: Optional[np.ndarray] = None
+        self.neighbor_scores: Optional[np.ndarray] = None
+        self.row_by_id: Dict[int, int] = {}
+        self.load()
+    def exists(self) -> bool:
+        return all(os.path.exists(p) for p in (self.rows_path, self.ids_path, self.scores_path))
+    def build(self, vector_db: VectorDB, block_size: int = 1024, workers: Optional[int] = None):
+        total = vector_db.index.ntotal
+        if total == 0:
+            logger.warning("Index is empty, nothing to build")
+            return
+        id_array = np.asarray(vector_db.id_mapping, dtype=np.int32)
+        ids_out, scores_out = self._open_output(total)
+        def process(start: int):
+            count = min(block_size, total - start)
+            vectors = vector_db.get_vectors_range(start, count)
+            distances, indices = vector_db.index.search(vectors, self._search_width(vector_db))
+            ids, scores = self._select_neighbors(distances, indices, id_array[start:start + count, None], id_array)
+            ids_out[start:start + count] = ids
+            scores_out[start:start + count] = scores
+        self._run_blocks(process, range(0, total, block_size), workers)
+        self._publish(id_array, ids_out, scores_out)
+        logger.info(f"Built top-{self.k} graph for {total} vectors")
+    def update(self, vector_db: VectorDB, block_size: int = 1024, workers: Optional[int] = None):
+        total = vector_db.index.ntotal
+        id_array = np.asarray(vector_db.id_mapping, dtype=np.int32)
+        old_total = 0 if self.row_ids is None else len(self.row_ids)
+        if old_total == 0 or old_total > total or not np.array_equal(self.row_ids, id_array[:old_total]):
+            logger.info("Graph does not match the index prefix, rebuilding from scratch")
+            self.build(vector_db, block_size=block_size, workers=workers)
+            return
+        if old_total == total:
+            logger.info("Graph is up to date")
+            return
+        ids_out, scores_out = self._open_output(total)
+        # New rows search the whole index; old rows only merge against the new vectors
+        new_vectors = vector_db.get_vectors_range(old_total, total - old_total)
+        new_index = faiss.IndexFlatIP(vector_db.dimension)
+        new_index.add(new_vectors)
+        new_k = min(self._search_width(vector_db) - 1, new_index.ntotal)
+        def process_new(start: int):
+            count = min(block_size, total - start)
+            vectors = vector_db.get_vectors_range(start, count)
+            distances, indices = vector_db.index.search(vectors, self._search_width(vector_db))
+            ids, scores = self._select_neighbors(distances, indices, id_array[start:start + count, None], id_array)
+            ids_out[start:start + count] = ids
+            scores_out[start:start + count] = scores
+        def process_old(start: int):
+            count = min(block_size, old_total - start)
+            vectors = vector_db.get_vectors_range(start, count)
+            distances, indices = new_index.search(vectors, new_k)
+            new_ids = np.where(indices >= 0, id_array[old_total + np.maximum(indices, 0)], -1)
+            merged_ids = np.concatenate([self.neighbor_ids[start:start + count], new_ids], axis=1)
+            merged_scores = np.concatenate([
+                self.neighbor_scores[start:start + count].astype(np.float32),
+                np.where(indices >= 0, distances, -np.inf)
+            ], axis=1)
+            merged_scores[(merged_ids < 0) | (merged_ids == id_array[start:start + count, None])] = -np.inf
+            order = np.argsort(-merged_scores, axis=1, kind='stable')
+            ids = np.take_along_axis(merged_ids, order, axis=1)
+            scores = np.take_along_axis(merged_scores, order, axis=1)
+            scores[self._repeated(ids)] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :self.k]
+            ids = np.take_along_axis(ids, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+            ids[~np.isfinite(scores)] = -1
+            ids_out[start:start + count] = ids
+            scores_out[start:start + count] = np.clip(np.where(np.isfinite(scores), scores, 0.0), 0.0, 1.0)
+        blocks = [(process_old, s) for s in range(0, old_total, block_size)]
+        blocks += [(process_new, s) for s in range(old_total, total, block_size)]
+        self._run_blocks(lambda block: block[0](block[1]), blocks, workers)
+        self._publish(id_array, ids_out, scores_out)
+        logger.info(f"Updated graph with {total - old_total} new vectors. Total: {total}")
+    def _search_width(self, vector_db: VectorDB) -> int:
+        # Products with several images take several hits each, so search wider to keep k distinct neighbors
+        per_product = -(-vector_db.index.ntotal // max(1, vector_db.product_count))
+        return min(self.k * per_product + 1, vector_db.index.ntotal)
+    @staticmethod
+    def _repeated(ids: np.ndarray) -> np.ndarray:
+        # True where a row repeats a product id seen earlier (i.e. at a better score) in that row
+        order = np.argsort(ids, axis=1, kind='stable')
+        sorted_ids = np.take_along_axis(ids, order, axis=1)
+        repeated_sorted = np.zeros(ids.shape, dtype=bool)
+        repeated_sorted[:, 1:] = (sorted_ids[:, 1:] == sorted_ids[:, :-1]) & (sorted_ids[:, 1:] >= 0)
+        repeated = np.empty_like(repeated_sorted)
+        np.put_along_axis(repeated, order, repeated_sorted, axis=1)
+        return repeated
+    def _select_neighbors(self, distances: np.ndarray, indices: np.ndarray,
+                          own_ids: np.ndarray, id_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Drops the row's own product (every image of it) and keeps each neighbor product once
+        hit_ids = np.where(indices >= 0, id_array[np.maximum(indices, 0)], -1)
+        keep = (indices >= 0) & (hit_ids != own_ids) & ~self._repeated(hit_ids)
+        order = np.argsort(~keep, axis=1, kind='stable')[:, :self.k]
+        indices = np.take_along_axis(indices, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        valid = np.take_along_axis(keep, order, axis=1)
+        ids = np.full((indices.shape[0], self.k), -1, dtype=np.int32)
+        scores = np.zeros((indices.shape[0], self.k), dtype=np.float32)
+        width = indices.shape[1]
+        ids[:, :width] = np.where(valid, id_array[np.maximum(indices, 0)], -1)
+        scores[:, :width] = np.where(valid, np.clip(distances, 0.0, 1.0), 0.0)
+        return ids, scores
+    def _run_blocks(self, fn, blocks, workers: Optional[int]):
+        workers = workers or os.cpu_count() or 1
+        # One FAISS thread per block so the pool does the parallelism without oversubscribing cores
+        omp_threads = faiss.omp_get_max_threads()
+        faiss.omp_set_num_threads(1)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fn, blocks))
+        finally:
+            faiss.omp_set_num_threads(omp_threads)
+    def _open_output(self, total: int) -> Tuple[np.ndarray, np.ndarray]:
+        ids_out = np.lib.format.open_memmap(self.ids_path + ".tmp", mode='w+', dtype=np.int32, shape=(total, self.k))
+        scores_out = np.lib.format.open_memmap(self.scores_path + ".tmp", mode='w+', dtype=np.float16, shape=(total, self.k))
+        return ids_out, scores_out
+    def _publish(self, id_array: np.ndarray, ids_out: np.ndarray, scores_out: np.ndarray):
+        ids_out.flush()
+        scores_out.flush()
+        del ids_out, scores_out
+        np.save(self.rows_path + ".tmp.npy", id_array)
+        os.replace(self.ids_path + ".tmp", self.ids_path)
+        os.replace(self.scores_path + ".tmp", self.scores_path)
+        os.replace(self.rows_path + ".tmp.npy", self.rows_path)
+        self.load()
+    def load(self):
+        try:
+            if not self.exists():
+                return
+            row_ids = np.load(self.rows_path)
+            neighbor_ids = np.load(self.ids_path, mmap_mode='r')
+            neighbor_scores = np.load(self.scores_path, mmap_mode='r')
+            if neighbor_ids.shape != neighbor_scores.shape or neighbor_ids.shape[0] != len(row_ids):
+                logger.warning("Graph files are inconsistent, ignoring them")
+                return
+            self.row_ids = row_ids
+            self.neighbor_ids = neighbor_ids
+            self.neighbor_scores = neighbor_scores
+            self.k = neighbor_ids.shape[1]
+            # A product with several images keeps the row of its primary (first) vector
+            self.row_by_id = {}
+            for row, pid in enumerate(row_ids):
+                self.row_by_id.setdefault(int(pid), row)
+            logger.info(f"Loaded top-{self.k} graph for {len(row_ids)} vectors")
+        except Exception as e:
+            logger.warning(f"Could not load graph: {str(e)}")
+    def get_neighbors(self, product_id: int, k: int = 10) -> Optional[List[Tuple[int, float]]]:
+        row = self.row_by_id.get(product_id)
+        if row is None or k > self.k:
+            return None
+        ids = self.neighbor_ids[row, :k]
+        scores = self.neighbor_scores[row, :k]
+        return [(int(pid), float(score)) for pid, score in zip(ids, scores) if pid >= 0]
+    def get_stats(self) -> dict:
+        return {
+            "rows": 0 if self.row_ids is None else len(self.row_ids),
+            "k": self.k
+        }
\ No newline at end of file
@@ -1,46 +1,75 @@
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
-from PIL import Image
-import io
+from contextlib import asynccontextmanager
+import hmac
 import os
 import logging
-from typing import Optional
+import threading
+from typing import List, Optional, Tuple
 
 from app.models import init_db, get_db, Product, Feedback
-from app.feature_extractor import FeatureExtractor
-from app.attribute_recognizer import AttributeRecognizer
-from app.vector_db import VectorDB
-from app.feedback import FeedbackSystem
-from app.multimodal_search import MultiModalSearch
+from app.feedback import FeedbackSystem, FeedbackPipeline, backfill_summaries
+from app.runtime import AppState, CatalogSnapshot
+from app.upload import UploadLimitMiddleware, decode_upload
+from app.thumbnails import ImmutableStaticFiles
+from app.pagination import ResultCache, encode_cursor, decode_cursor
+from app import serving
+from app.profiling import profiler
+from app.instrumentation import (
+    StageTimer, SEARCH_REQUESTS_IN_PROGRESS, INDEX_SIZE,
+    record_cache_lookup, render_metrics
+)
 from pydantic import BaseModel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Components are loaded in the background so the port opens before the model is ready
+state = AppState()
+# /feedback and result impressions are queued and folded into the summary tables in the background
+feedback_pipeline = FeedbackPipeline()
+MAX_STATS_PRODUCTS = 500
+
+# Candidates ranked per round, and how many are fetched from FAISS to fill a round after filtering
+CANDIDATE_POOL = 50
+CANDIDATE_FETCH = CANDIDATE_POOL * 3
+# Deepest FAISS fetch for one query; a selective filter stops there instead of scanning the catalog
+MAX_CANDIDATE_FETCH = CANDIDATE_FETCH * 8
+MAX_RESULT_OFFSET = MAX_CANDIDATE_FETCH
+INDEX_SIZE.set_function(lambda: state.vector_db.index.ntotal if state.vector_db else 0)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    backfill_summaries()
+    threading.Thread(target=state.load, name="component-loader", daemon=True).start()
+    feedback_pipeline.start()
+    yield
+    feedback_pipeline.stop()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Visual Similarity Search for Eyewear",
     description="AI-powered visual search platform for eyewear products",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize components
-feature_extractor = FeatureExtractor()
-attribute_recognizer = AttributeRecognizer()
-vector_db = VectorDB(dimension=2048)
-multimodal_search = MultiModalSearch()
+# Reject oversized uploads from Content-Length, or as soon as the streamed body exceeds the limit
+app.add_middleware(UploadLimitMiddleware)
 
 # Create necessary directories
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("data/images", exist_ok=True)
-
-# Initialize database
-init_db()
+os.makedirs("data/thumbnails", exist_ok=True)
 
 # Mount static files for product images
 app.mount("/static", StaticFiles(directory="data/images"), name="static")
+app.mount("/thumbs", ImmutableStaticFiles(directory="data/thumbnails"), name="thumbs")
 
 
 # Pydantic models for API
@@ -49,6 +78,28 @@ class FeedbackRequest(BaseModel):
     is_relevant: bool
 
 
+class ProfilingConfig(BaseModel):
+    sample_rate: Optional[float] = None
+    mode: Optional[str] = None
+    torch_ops: Optional[bool] = None
+    allocations: Optional[bool] = None
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Admin endpoints do not exist unless EYEWEAR_ADMIN_TOKEN is set
+    token = os.environ.get("EYEWEAR_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def require_ready():
+    if not state.ready.is_set():
+        raise HTTPException(status_code=503, detail="Service is warming up", headers={"Retry-After": "5"})
+    state.check_snapshot()
+
+
 # API Endpoints
 
 @app.get("/", response_class=HTMLResponse)
@@ -305,8 +356,8 @@ async def root():
                         <option value="Square">Square</option>
                         <option value="Cat Eye">Cat Eye</option>
                         <option value="Rimless">Rimless</option>
-                        <option value="Rectangular">Rectangular</option>
-                        <option value="Oversized">Oversized</option>
+                        <option value="Rectangle">Rectangle</option>
+                        <option value="Browline">Browline</option>
                     </select>
                 </div>
 
@@ -316,13 +367,11 @@ async def root():
                     <select id="color">
                         <option value="">All Colors</option>
                         <option value="Black">Black</option>
-                        <option value="Gold">Gold</option>
-                        <option value="Silver">Silver</option>
-                        <option value="Tortoise">Tortoise</option>
                         <option value="Brown">Brown</option>
-                        <option value="Clear">Clear</option>
-                        <option value="Blue">Blue</option>
-                        <option value="Red">Red</option>
+                        <option value="Tortoise">Tortoise</option>
+                        <option value="Transparent">Transparent</option>
+                        <option value="Metal">Metal</option>
+                        <option value="Colorful">Colorful</option>
                     </select>
                 </div>
 
@@ -348,10 +397,12 @@ async def root():
             
             <div id="attributes"></div>
             <div id="results" class="results"></div>
+            <button class="search-btn" id="loadMoreBtn" onclick="loadMore()" style="display: none; margin-top: 20px;">Load More</button>
         </div>
         
         <script>
             let currentImageFile = null;
+            let nextCursor = null;
             
             document.getElementById('imageInput').addEventListener('change', function(e) {
                 const file = e.target.files[0];
@@ -390,6 +441,7 @@ async def root():
                 
                 document.getElementById('results').innerHTML = '<div class="loading">🔍 Searching for similar products...</div>';
                 document.getElementById('attributes').innerHTML = '';
+                updateLoadMore(null);
                 
                 try {
                     const response = await fetch('/search', {
@@ -410,25 +462,8 @@ async def root():
                     }
                     
                     if (data.results && data.results.length > 0) {
-                        let resultsHtml = '';
-                        data.results.forEach(product => {
-                            resultsHtml += `
-                                <div class="result-card">
-                                    <img src="/static/${product.image_path}" alt="${product.brand}" onerror="this.src='data:image/svg+xml,%3Csvg xmlns=\\'http://www.w3.org/2000/svg\\' width=\\'200\\' height=\\'200\\'%3E%3Crect fill=\\'%23ddd\\' width=\\'200\\' height=\\'200\\'/%3E%3Ctext fill=\\'%23999\\' font-family=\\'sans-serif\\' font-size=\\'14\\' x=\\'50%25\\' y=\\'50%25\\' text-anchor=\\'middle\\' dy=\\'0.3em\\'%3ENo Image%3C/text%3E%3C/svg%3E'">
-                                    <div class="result-info">
-                                        <h3>${product.brand}</h3>
-                                        <p>$${product.price.toFixed(2)}</p>
-                                        <p>${product.material}</p>
-                                        <span class="similarity-score">${(product.similarity_score * 100).toFixed(1)}% Similar</span>
-                                        <div class="feedback-btns">
-                                            <button class="feedback-btn relevant" onclick="submitFeedback(${product.id}, true)">✓ Relevant</button>
-                                            <button class="feedback-btn not-relevant" onclick="submitFeedback(${product.id}, false)">✗ Not Relevant</button>
-                                        </div>
-                                    </div>
-                                </div>
-                            `;
-                        });
-                        document.getElementById('results').innerHTML = resultsHtml;
+                        document.getElementById('results').innerHTML = renderCards(data.results);
+                        updateLoadMore(data.next_cursor);
                     } else {
                         document.getElementById('results').innerHTML = '<div class="loading">No similar products found. Try a different image or adjust filters.</div>';
                     }
@@ -437,6 +472,46 @@ async def root():
                 }
             }
             
+            function renderCards(results) {
+                let resultsHtml = '';
+                results.forEach(product => {
+                    resultsHtml += `
+                        <div class="result-card">
+                            <img src="${product.thumbnails ? product.thumbnails['256'] : '/static/' + product.image_path}" ${product.thumbnails ? `srcset="${product.thumbnails['256']} 1x, ${product.thumbnails['512']} 2x"` : ''} loading="lazy" alt="${product.brand}" onerror="this.src='data:image/svg+xml,%3Csvg xmlns=\\'http://www.w3.org/2000/svg\\' width=\\'200\\' height=\\'200\\'%3E%3Crect fill=\\'%23ddd\\' width=\\'200\\' height=\\'200\\'/%3E%3Ctext fill=\\'%23999\\' font-family=\\'sans-serif\\' font-size=\\'14\\' x=\\'50%25\\' y=\\'50%25\\' text-anchor=\\'middle\\' dy=\\'0.3em\\'%3ENo Image%3C/text%3E%3C/svg%3E'">
+                            <div class="result-info">
+                                <h3>${product.brand}</h3>
+                                <p>$${product.price.toFixed(2)}</p>
+                                <p>${product.material}</p>
+                                <span class="similarity-score">${(product.similarity_score * 100).toFixed(1)}% Similar</span>
+                                <div class="feedback-btns">
+                                    <button class="feedback-btn relevant" onclick="submitFeedback(${product.id}, true)">✓ Relevant</button>
+                                    <button class="feedback-btn not-relevant" onclick="submitFeedback(${product.id}, false)">✗ Not Relevant</button>
+                                </div>
+                            </div>
+                        </div>
+                    `;
+                });
+                return resultsHtml;
+            }
+            
+            function updateLoadMore(cursor) {
+                nextCursor = cursor;
+                document.getElementById('loadMoreBtn').style.display = cursor ? 'block' : 'none';
+            }
+            
+            async function loadMore() {
+                if (!nextCursor) return;
+                // Later pages are slices of the ranking cached by the first search, no re-upload needed
+                const response = await fetch('/search/next?cursor=' + encodeURIComponent(nextCursor));
+                if (!response.ok) {
+                    updateLoadMore(null);
+                    return;
+                }
+                const data = await response.json();
+                document.getElementById('results').insertAdjacentHTML('beforeend', renderCards(data.results));
+                updateLoadMore(data.next_cursor);
+            }
+            
             async function submitFeedback(productId, isRelevant) {
                 try {
                     await fetch('/feedback', {
@@ -459,8 +534,138 @@ async def root():
     return html_content
 
 
+def _build_filters(price_min: Optional[float] = None, price_max: Optional[float] = None,
+                   brand: Optional[str] = None, material: Optional[str] = None,
+                   color: Optional[str] = None, frame_style: Optional[str] = None) -> dict:
+    filters = {}
+    if price_min is not None: filters['price_min'] = price_min
+    if price_max is not None: filters['price_max'] = price_max
+    if brand: filters['brand'] = brand
+    if material: filters['material'] = material
+    if color: filters['color'] = color
+    if frame_style: filters['frame_style'] = frame_style
+    return filters
+
+
+def _filter_candidates(snapshot: CatalogSnapshot, candidates: List[Tuple[int, float]], filters: dict, db: Session,
+                       timer: StageTimer, limit: Optional[int] = CANDIDATE_POOL):
+    with timer.stage("filtering"):
+        if filters:
+            candidates = snapshot.vector_db.filter_results(candidates, filters, db)
+        return candidates[:limit]
+
+
+def _modifier_query(snapshot: CatalogSnapshot, query_vector, text_modifier: Optional[str], timer: StageTimer):
+    # Returns (search vector, parsed modifiers); modifiers with a direction shift the vector,
+    # and all of them feed the modifier_match ranking signal
+    if not text_modifier:
+        return query_vector, {}
+    logger.info(f"Applying text modifier: {text_modifier}")
+    with timer.stage("modifier_vector"):
+        modifiers = snapshot.multimodal_search.parse_modifier(text_modifier)
+        shifted = snapshot.multimodal_search.apply_modifier_vector(query_vector, modifiers)
+    return (query_vector if shifted is None else shifted), modifiers
+
+
+def _rank_results(snapshot: CatalogSnapshot, search_results: List[Tuple[int, float]], modifiers: dict, db: Session,
+                  timer: StageTimer, k: int, reference_price: Optional[float] = None, diversity: float = 0.0,
+                  debug: bool = False):
+    # Similarity, feedback, clicks, modifier match and price proximity are fused in one pass
+    with timer.stage("ranking"):
+        ranked_results, total, breakdown = state.ranking.rank(
+            [pid for pid, _ in search_results], [score for _, score in search_results], db, k=k,
+            modifiers=modifiers, multimodal_search=snapshot.multimodal_search,
+            reference_price=reference_price, diversity=diversity, vector_db=snapshot.vector_db, debug=debug
+        )
+    
+    logger.info(f"Found {total} results above similarity threshold ({state.ranking.min_similarity})")
+    if ranked_results:
+        logger.info(f"Top similarity scores: {[f'{s:.3f}' for _, s in ranked_results[:5]]}")
+    
+    return ranked_results, total, breakdown
+
+
+def _hydrate_products(ranked_results: List[Tuple[int, float]], db: Session, timer: StageTimer,
+                      breakdown: Optional[List[dict]] = None) -> List[dict]:
+    products = []
+    with timer.stage("db_hydration"):
+        state.thumbnails.refresh()
+        for i, (product_id, similarity_score) in enumerate(ranked_results):
+            product = db.query(Product).filter(Product.id == product_id).first()
+            if product:
+                products.append({
+                    "id": product.id,
+                    "image_path": product.image_path,
+                    "brand": product.brand,
+                    "price": product.price,
+                    "material": product.material,
+                    "style_tags": product.style_tags,
+                    "thumbnails": state.thumbnails.urls(product.image_path),
+                    "similarity_score": similarity_score
+                })
+                if breakdown is not None:
+                    products[-1]["ranking"] = breakdown[i]
+    feedback_pipeline.record_impressions(product["id"] for product in products)
+    return products
+
+
+def _extend_results(entry: dict, needed: int, db: Session, timer: StageTimer):
+    # Goes back to FAISS only when the cached ranking is shorter than the page asked for. Results
+    # already served keep their positions; each new round is ranked on its own and appended.
+    # The entry keeps the snapshot its query vector was embedded with.
+    snapshot = entry["snapshot"]
+    while len(entry["ranked"]) < needed and not entry["exhausted"]:
+        fetch = min(MAX_CANDIDATE_FETCH, max(entry["consumed"] + CANDIDATE_FETCH, entry["fetched"] * 2))
+        with timer.stage("vector_search"):
+            candidates = snapshot.vector_db.ann_search(entry["vector"], fetch)
+        entry["fetched"] = fetch
+        fresh = candidates[entry["consumed"]:]
+        kept = []
+        # Filter in slices so a deep page does not filter far more candidates than one round ranks
+        for start in range(0, len(fresh), CANDIDATE_FETCH):
+            kept.extend(_filter_candidates(snapshot, fresh[start:start + CANDIDATE_FETCH], entry["filters"], db, timer,
+                                           limit=None))
+            if len(kept) > CANDIDATE_POOL:
+                break
+        if len(kept) > CANDIDATE_POOL:
+            kept = kept[:CANDIDATE_POOL]
+            # Filtered candidates past this round's pool are picked up by the next round
+            entry["consumed"] += [pid for pid, _ in fresh].index(kept[-1][0]) + 1
+        else:
+            entry["consumed"] += len(fresh)
+            # Scores only fall further down the list, so past the similarity threshold nothing more can rank
+            entry["exhausted"] = (len(candidates) < fetch or fetch >= MAX_CANDIDATE_FETCH
+                                  or (bool(candidates) and candidates[-1][1] < state.ranking.min_similarity))
+        kept = [(pid, score) for pid, score in kept if pid not in entry["seen"]]
+        ranked_results, _, breakdown = _rank_results(snapshot, kept, entry["modifiers"], db,
+                                                     timer, k=len(kept), reference_price=entry["reference_price"],
+                                                     diversity=entry["diversity"], debug=entry["debug"])
+        entry["ranked"].extend(ranked_results)
+        entry["seen"].update(pid for pid, _ in ranked_results)
+        if breakdown is not None:
+            entry["breakdown"].extend(breakdown)
+
+
+def _results_page(entry: dict, key: str, offset: int, page_size: int, db: Session, timer: StageTimer) -> dict:
+    # Concurrent pages of one query extend the entry one at a time, so no round is fetched twice or skipped
+    with entry["lock"]:
+        _extend_results(entry, offset + page_size, db, timer)
+        page = entry["ranked"][offset:offset + page_size]
+        breakdown = entry["breakdown"][offset:offset + page_size] if entry["debug"] else None
+        next_offset = offset + len(page)
+        total_results = len(entry["ranked"])
+        has_more = next_offset < total_results or not entry["exhausted"]
+    products = _hydrate_products(page, db, timer, breakdown)
+    return {
+        "results": products,
+        "total_results": total_results,
+        "next_cursor": encode_cursor(key, next_offset) if page and has_more else None
+    }
+
+
 @app.post("/search")
 async def search_similar(
+    response: Response,
     image: UploadFile = File(...),
     price_min: Optional[float] = Form(None),
     price_max: Optional[float] = Form(None),
@@ -469,64 +674,97 @@ async def search_similar(
     color: Optional[str] = Form(None),
     frame_style: Optional[str] = Form(None),
     text_modifier: Optional[str] = Form(None),
-    db: Session = Depends(get_db)
+    diversity: float = Form(0.0, ge=0.0, le=1.0),
+    page_size: int = Form(10, ge=1, le=50),
+    debug: bool = Form(False),
+    db: Session = Depends(get_db),
+    _ready: None = Depends(require_ready)
 ):
+    timer = StageTimer("search")
+    profile = profiler.start("search")
+    SEARCH_REQUESTS_IN_PROGRESS.labels("search").inc()
+    snapshot = state.snapshot
     try:
-        content = await image.read()
-        logger.info(f"Processing search query: {image.filename}")
-        
-        pil_image = Image.open(io.BytesIO(content))
-        query_features = feature_extractor.extract_features_from_image(pil_image)
-        attributes = attribute_recognizer.extract_attributes(query_features)
-        
-        filters = {}
-        if price_min is not None: filters['price_min'] = price_min
-        if price_max is not None: filters['price_max'] = price_max
-        if brand: filters['brand'] = brand
-        if material: filters['material'] = material
-        if color: filters['color'] = color
-        if frame_style: filters['frame_style'] = frame_style
+        with timer.stage("image_decode"):
+            logger.info(f"Processing search query: {image.filename}")
+            pil_image = decode_upload(image)
         
-        search_results = vector_db.search(query_features, k=50, filters=filters, product_db=db)
-        search_results = [(pid, score) for pid, score in search_results if score >= 0.3]
+        with timer.stage("embedding"), profiler.torch_profile(profile):
+            query_features = snapshot.feature_extractor.extract_query_features(pil_image)
+        with timer.stage("attribute_recognition"):
+            # Only describes the query image; the color filter stays whatever the caller asked for
+            detected_color = state.color_analyzer.analyze(pil_image)
+            attributes = snapshot.attribute_recognizer.extract_attributes(query_features, color=detected_color)
         
-        logger.info(f"Found {len(search_results)} results above similarity threshold (0.3)")
+        filters = _build_filters(price_min, price_max, brand, material, color, frame_style)
         
-        if text_modifier:
-            logger.info(f"Applying text modifier: {text_modifier}")
-            modifiers = multimodal_search.parse_modifier(text_modifier)
-            search_results = multimodal_search.apply_modifier_filter(search_results, modifiers, db)
-        
-        feedback_system = FeedbackSystem(db)
-        boosted_results = feedback_system.apply_relevance_boost(search_results)
-        
-        if boosted_results:
-            logger.info(f"Top similarity scores: {[f'{s:.3f}' for _, s in boosted_results[:5]]}")
-        
-        products = []
-        for product_id, similarity_score in boosted_results[:10]:
-            product = db.query(Product).filter(Product.id == product_id).first()
-            if product:
-                products.append({
-                    "id": product.id,
-                    "image_path": product.image_path,
-                    "brand": product.brand,
-                    "price": product.price,
-                    "material": product.material,
-                    "style_tags": product.style_tags,
-                    "similarity_score": similarity_score
-                })
+        search_vector, modifiers = _modifier_query(snapshot, query_features, text_modifier, timer)
+        # Without a source product, the middle of the requested price range anchors price proximity
+        reference_price = (price_min + price_max) / 2 if price_min is not None and price_max is not None else None
+        params = {
+            "filters": filters, "modifiers": modifiers,
+            "reference_price": reference_price, "diversity": diversity, "debug": debug,
+            "generation": snapshot.generation
+        }
+        key = ResultCache.make_key(search_vector, **params)
+        entry = state.result_cache.get(key)
+        record_cache_lookup("search_results", entry is not None)
+        if entry is None:
+            # Later pages are served from this entry, without another forward pass
+            entry = dict(params, snapshot=snapshot, vector=search_vector, ranked=[], breakdown=[], seen=set(),
+                         fetched=0, consumed=0, exhausted=False, lock=threading.Lock())
+            state.result_cache.put(key, entry)
+        page = _results_page(entry, key, 0, page_size, db, timer)
         
+        timer.finish()
+        response.headers["Server-Timing"] = timer.server_timing()
         return {
             "query_image": image.filename,
             "attributes": attributes,
-            "results": products,
-            "total_results": len(boosted_results)
+            **page
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in search: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        SEARCH_REQUESTS_IN_PROGRESS.labels("search").dec()
+        profiler.finish(profile, timer.as_dict())
+
+
+@app.get("/search/next")
+async def search_next_page(
+    response: Response,
+    cursor: str,
+    page_size: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    _ready: None = Depends(require_ready)
+):
+    try:
+        key, offset = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if offset < 0 or offset > MAX_RESULT_OFFSET:
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    entry = state.result_cache.get(key)
+    record_cache_lookup("search_results", entry is not None)
+    if entry is None:
+        raise HTTPException(status_code=410, detail="Cursor expired, run the search again")
+    
+    timer = StageTimer("search_next")
+    SEARCH_REQUESTS_IN_PROGRESS.labels("search_next").inc()
+    try:
+        page = _results_page(entry, key, offset, page_size, db, timer)
+        timer.finish()
+        response.headers["Server-Timing"] = timer.server_timing()
+        return page
+    except Exception as e:
+        logger.error(f"Error in search continuation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        SEARCH_REQUESTS_IN_PROGRESS.labels("search_next").dec()
 
 
 @app.get("/products/{product_id}")
@@ -547,30 +785,158 @@ async def get_product(product_id: int, db: Session = Depends(get_db)):
     }
 
 
-@app.post("/feedback")
-async def submit_feedback(feedback: FeedbackRequest, db: Session = Depends(get_db)):
+@app.get("/products/{product_id}/similar")
+async def get_similar_products(
+    product_id: int,
+    response: Response,
+    k: int = Query(10, ge=1, le=50),
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    brand: Optional[str] = None,
+    material: Optional[str] = None,
+    color: Optional[str] = None,
+    frame_style: Optional[str] = None,
+    text_modifier: Optional[str] = None,
+    diversity: float = Query(0.0, ge=0.0, le=1.0),
+    debug: bool = False,
+    db: Session = Depends(get_db),
+    _ready: None = Depends(require_ready)
+):
+    product = db.query(Product).filter(Product.id == product_id).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    timer = StageTimer("similar")
+    profile = profiler.start("similar")
+    SEARCH_REQUESTS_IN_PROGRESS.labels("similar").inc()
+    snapshot = state.snapshot
     try:
-        feedback_system = FeedbackSystem(db)
-        feedback_system.record_feedback("", feedback.product_id, feedback.is_relevant)
-        return {"status": "success", "message": "Feedback recorded"}
+        filters = _build_filters(price_min, price_max, brand, material, color, frame_style)
+        
+        # Unfiltered lookups can be served from the offline neighbor graph
+        search_results = None
+        modifiers = {}
+        if not filters and not text_modifier:
+            with timer.stage("graph_lookup"):
+                search_results = snapshot.knn_graph.get_neighbors(product_id, k=CANDIDATE_POOL)
+            record_cache_lookup("knn_graph", search_results is not None)
+        if search_results is None:
+            query_vector = snapshot.vector_db.get_vector(product_id)
+            candidates = []
+            if query_vector is not None:
+                search_vector, modifiers = _modifier_query(snapshot, query_vector, text_modifier, timer)
+                with timer.stage("vector_search"):
+                    # One extra for the source product, which is dropped below
+                    candidates = snapshot.vector_db.ann_search(search_vector, CANDIDATE_FETCH + 1)
+            candidates = [(pid, score) for pid, score in candidates if pid != product_id]
+            search_results = _filter_candidates(snapshot, candidates, filters, db, timer)
+        ranked_results, total, breakdown = _rank_results(snapshot, search_results, modifiers, db, timer, k=k,
+                                                         reference_price=product.price, diversity=diversity,
+                                                         debug=debug)
+        products = _hydrate_products(ranked_results, db, timer, breakdown)
+        
+        timer.finish()
+        response.headers["Server-Timing"] = timer.server_timing()
+        return {
+            "product_id": product_id,
+            "results": products,
+            "total_results": total
+        }
+        
     except Exception as e:
-        logger.error(f"Error recording feedback: {str(e)}")
+        logger.error(f"Error in similar products search: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        SEARCH_REQUESTS_IN_PROGRESS.labels("similar").dec()
+        profiler.finish(profile, timer.as_dict())
+
+
+@app.post("/feedback", status_code=202)
+async def submit_feedback(feedback: FeedbackRequest):
+    # Queued only; the background pipeline writes it within about a second
+    feedback_pipeline.submit_feedback(feedback.product_id, feedback.is_relevant)
+    return {"status": "accepted", "message": "Feedback queued"}
+
+
+@app.get("/feedback/stats")
+async def get_feedback_stats(product_id: List[int] = Query(...), db: Session = Depends(get_db)):
+    if len(product_id) > MAX_STATS_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STATS_PRODUCTS} products per request")
+    product_ids = list(dict.fromkeys(product_id))
+    return {"products": FeedbackSystem(db).get_batch_stats(product_ids)}
 
 
 @app.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(db: Session = Depends(get_db), _ready: None = Depends(require_ready)):
     total_products = db.query(Product).count()
     total_feedback = db.query(Feedback).count()
-    vector_stats = vector_db.get_stats()
+    snapshot = state.snapshot
+    vector_stats = snapshot.vector_db.get_stats()
     
     return {
         "total_products": total_products,
         "total_feedback": total_feedback,
-        "vector_db": vector_stats
+        "vector_db": vector_stats,
+        "knn_graph": snapshot.knn_graph.get_stats(),
+        "result_cache": state.result_cache.get_stats(),
+        "memory": serving.memory_report()
     }
 
 
+@app.get("/admin/profiling")
+async def get_profiling(_admin: None = Depends(require_admin)):
+    # Per worker process: with several workers, each request lands on one of them
+    return dict(profiler.summary(), pid=os.getpid())
+
+
+@app.put("/admin/profiling")
+async def configure_profiling(config: ProfilingConfig, _admin: None = Depends(require_admin)):
+    try:
+        return profiler.configure(**config.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.delete("/admin/profiling")
+async def reset_profiling(_admin: None = Depends(require_admin)):
+    profiler.reset()
+    return {"status": "reset"}
+
+
+@app.get("/admin/profiling/flamegraph")
+async def download_flamegraph(_admin: None = Depends(require_admin)):
+    return Response(content=profiler.collapsed_stacks(), media_type="text/plain",
+                    headers={"Content-Disposition": f"attachment; filename=stacks-{os.getpid()}.folded"})
+
+
+@app.get("/admin/profiling/cprofile")
+async def download_cprofile(text: bool = False, _admin: None = Depends(require_admin)):
+    if text:
+        return Response(content=profiler.cprofile_text(), media_type="text/plain")
+    content = profiler.cprofile_dump()
+    if content is None:
+        raise HTTPException(status_code=404, detail="No cProfile data, set mode to 'cprofile' first")
+    return Response(content=content, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f"attachment; filename=search-{os.getpid()}.prof"})
+
+
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    status = state.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -15,6 +15,23 @@ class Product(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     click_count = Column(Integer, default=0)
     relevance_score = Column(Float, default=0.0)
+    tag_bits = Column(Integer)
+    content_hash = Column(String)
+    phash = Column(String, index=True)
+    file_size = Column(Integer)
+    file_mtime = Column(Float)
+class ProductImage(Base):
+    # Additional views of a product (side, on-model, ...); Product.image_path stays the primary image
+    __tablename__ = "product_images"
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, index=True)
+    image_path = Column(String, unique=True, index=True)
+    view = Column(String)
+    phash = Column(String, index=True)
+    content_hash = Column(String)
+    file_size = Column(Integer)
+    file_mtime = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow)
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(Integer, primary_key=True, index=True)
@@ -22,12 +39,41 @@ class Feedback(Base):
     product_id = Column(Integer, index=True)
     is_relevant = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
+class FeedbackStats(Base):
+    # Running totals per product, maintained incrementally by app.feedback.FeedbackPipeline
+    __tablename__ = "feedback_stats"
+    product_id = Column(Integer, primary_key=True)
+    relevant = Column(Integer, default=0)
+    not_relevant = Column(Integer, default=0)
+    impressions = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+class FeedbackBucket(Base):
+    # Hourly counters per product; rolling windows sum a fixed number of these
+    __tablename__ = "feedback_buckets"
+    product_id = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True, index=True)
+    relevant = Column(Integer, default=0)
+    not_relevant = Column(Integer, default=0)
+    impressions = Column(Integer, default=0)
 DATABASE_URL = "sqlite:///./data/db.sqlite"
 os.makedirs("data", exist_ok=True)
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+def _add_missing_columns():
+    # create_all() does not alter existing tables, so columns added to a model later are added here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
 def get_db():
     db = SessionLocal()
     try:
@@ -1,68 +1,194 @@
 import logging
-from typing import List, Tuple, Dict
+import os
+import re
+from typing import Callable, List, Tuple, Dict, Iterable, Optional
+import numpy as np
 from sqlalchemy.orm import Session
-from app.models import Product
+from app.models import Product, SessionLocal
 logger = logging.getLogger(__name__)
+# Bit positions are persisted in Product.tag_bits, so only ever append to this list
+TAG_VOCABULARY = [
+    ("color", "Black"), ("color", "Blue"), ("color", "Brown"), ("color", "Gold"), ("color", "Silver"),
+    ("color", "Gray"), ("color", "Red"), ("color", "Green"), ("color", "Yellow"), ("color", "Tortoise"),
+    ("color", "Transparent"), ("color", "Pink"), ("color", "Colorful"),
+    ("material", "Metal"), ("material", "Plastic"), ("material", "Acetate"), ("material", "Titanium"),
+    ("material", "Polycarbonate"),
+    ("style", "Aviator"), ("style", "Wayfarer"), ("style", "Round"), ("style", "Cat Eye"), ("style", "Square"),
+    ("style", "Rimless"), ("style", "Rectangle"), ("style", "Oval"), ("style", "Retro"), ("style", "Browline")
+]
+SYNONYMS = {
+    "Blue": ["navy"],
+    "Gold": ["golden"],
+    "Gray": ["grey", "gunmetal"],
+    "Tortoise": ["tortoiseshell", "tortoise shell", "havana"],
+    "Transparent": ["clear", "crystal"],
+    "Colorful": ["colourful", "multicolor", "multicolour"],
+    "Metal": ["metallic"],
+    "Aviator": ["pilot"],
+    "Round": ["circle", "circular"],
+    "Cat Eye": ["cateye"],
+    "Rimless": ["frameless"],
+    "Rectangle": ["rectangular"],
+    "Retro": ["vintage"],
+    "Browline": ["clubmaster"]
+}
+# The taggers only tell these apart as their nearest tagged attribute, so a modifier for one
+# is matched as that attribute instead of a tag no product can carry
+TAG_ALIASES = {
+    "Gold": "Metal", "Silver": "Metal", "Gray": "Metal",
+    "Blue": "Colorful", "Red": "Colorful", "Green": "Colorful", "Yellow": "Colorful", "Pink": "Colorful"
+}
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+class TagMatcher:
+    def __init__(self, vocabulary: List[Tuple[str, str]] = TAG_VOCABULARY, synonyms: Dict[str, List[str]] = SYNONYMS,
+                 aliases: Dict[str, str] = TAG_ALIASES):
+        self.bits = {canonical: 1 << position for position, (_, canonical) in enumerate(vocabulary)}
+        categories = {canonical: category for category, canonical in vocabulary}
+        self.phrases: Dict[Tuple[str, ...], Tuple[str, str]] = {}
+        for _, canonical in vocabulary:
+            target = aliases.get(canonical, canonical)
+            for surface in [canonical] + synonyms.get(canonical, []):
+                self.phrases[tuple(TOKEN_PATTERN.findall(surface.lower()))] = (categories[target], target)
+        self.max_phrase_length = max(len(phrase) for phrase in self.phrases)
+    def _lookup(self, tokens: Tuple[str, ...]) -> Optional[Tuple[str, str]]:
+        match = self.phrases.get(tokens)
+        if match is None and tokens[-1].endswith("s"):
+            match = self.phrases.get(tokens[:-1] + (tokens[-1][:-1],))
+        return match
+    def match(self, text: str) -> List[Tuple[str, str]]:
+        # Greedy longest match over whole tokens, left to right, so "cat-eye" is one term
+        # and "red" never matches inside "tortoise-framed"
+        tokens = TOKEN_PATTERN.findall((text or "").lower())
+        matches = []
+        i = 0
+        while i < len(tokens):
+            for length in range(min(self.max_phrase_length, len(tokens) - i), 0, -1):
+                match = self._lookup(tuple(tokens[i:i + length]))
+                if match:
+                    matches.append(match)
+                    i += length
+                    break
+            else:
+                i += 1
+        return matches
+    def to_bits(self, canonicals: Iterable[str]) -> int:
+        bits = 0
+        for canonical in canonicals:
+            bits |= self.bits.get(canonical, 0)
+        return bits
+TAG_MATCHER = TagMatcher()
+def compute_tag_bits(style_tags: Optional[str], material: Optional[str]) -> int:
+    return TAG_MATCHER.to_bits(canonical for _, canonical in TAG_MATCHER.match(f"{style_tags or ''} {material or ''}"))
 class MultiModalSearch:
-    def __init__(self):
-        self.colors = {
-            'black', 'blue', 'brown', 'gold', 'silver', 'gray', 'grey', 
-            'red', 'green', 'yellow', 'tortoise', 'transparent', 'clear', 'pink'
-        }
-        self.materials = {'metal', 'plastic', 'acetate', 'titanium', 'polycarbonate'}
-        self.styles = {'aviator', 'wayfarer', 'round', 'cat eye', 'square', 'rimless', 'rectangle', 'oval', 'retro'}
+    def __init__(self, modifier_strength: float = 0.5, directions_path: str = "data/embeddings/modifier_directions.npz"):
+        self.modifier_strength = modifier_strength
+        self.directions_path = directions_path
+        self.matcher = TAG_MATCHER
+        self.tag_bits = np.zeros(0, dtype=np.int64)
+        self.directions: Dict[str, np.ndarray] = {}
+        self.load_directions()
     def parse_modifier(self, text: str) -> Dict[str, str]:
         if not text:
             return {}
-        text = text.lower().strip()
         modifiers = {}
-        for color in self.colors:
-            if color in text:
-                modifiers['color'] = color.capitalize()
-                if color == 'tortoise': modifiers['color'] = 'Tortoise'
-                break
-        for material in self.materials:
-            if material in text:
-                modifiers['material'] = material.capitalize()
-                break
-        for style in self.styles:
-            if style in text:
-                modifiers['style'] = style.title()
-                break
+        for category, canonical in self.matcher.match(text):
+            modifiers.setdefault(category, canonical)
         logger.info(f"Parsed modifiers from '{text}': {modifiers}")
         return modifiers
-    def apply_modifier_filter(self, 
-                            search_results: List[Tuple[int, float]], 
-                            modifiers: Dict[str, str], 
-                            db: Session) -> List[Tuple[int, float]]:
-        if not modifiers:
-            return search_results
-        filtered_results = []
-        product_ids = [pid for pid, _ in search_results]
-        if not product_ids:
-            return []
-        products = db.query(Product).filter(Product.id.in_(product_ids)).all()
-        product_map = {p.id: p for p in products}
-        for pid, score in search_results:
-            product = product_map.get(pid)
-            if not product:
+    def modifier_mask(self, modifiers: Dict[str, str]) -> int:
+        return self.matcher.to_bits(modifiers.values())
+    def backfill_tag_bits(self, db: Session) -> int:
+        # Rows written before tag bits existed; only run from the loader and the offline jobs, never per request
+        rows = db.query(Product.id, Product.style_tags, Product.material).filter(Product.tag_bits.is_(None)).all()
+        for product_id, style_tags, material in rows:
+            db.query(Product).filter(Product.id == product_id).update(
+                {Product.tag_bits: compute_tag_bits(style_tags, material)}, synchronize_session=False
+            )
+        if rows:
+            db.commit()
+            logger.info(f"Backfilled tag bits for {len(rows)} products")
+        return len(rows)
+    def load_tag_bits(self, db: Session):
+        rows = db.query(Product.id, Product.tag_bits).all()
+        tag_bits = np.zeros(max((row[0] for row in rows), default=0) + 1, dtype=np.int64)
+        for product_id, bits in rows:
+            tag_bits[product_id] = bits or 0
+        self.tag_bits = tag_bits
+        logger.info(f"Loaded tag bits for {len(rows)} products")
+    def build_directions(self, vector_db, db: Session, min_count: int = 3, block_size: int = 4096):
+        total = vector_db.index.ntotal
+        if total == 0:
+            return
+        self.backfill_tag_bits(db)
+        self.load_tag_bits(db)
+        id_array = np.asarray(vector_db.id_mapping, dtype=np.int64)
+        vocabulary_bits = np.array([1 << position for position in range(len(TAG_VOCABULARY))], dtype=np.int64)
+        sums = np.zeros((len(TAG_VOCABULARY), vector_db.dimension), dtype=np.float64)
+        counts = np.zeros(len(TAG_VOCABULARY), dtype=np.int64)
+        global_sum = np.zeros(vector_db.dimension, dtype=np.float64)
+        for start in range(0, total, block_size):
+            vectors = vector_db.get_vectors_range(start, min(block_size, total - start))
+            ids = id_array[start:start + len(vectors)]
+            bits = np.where(ids < len(self.tag_bits), self.tag_bits[np.minimum(ids, len(self.tag_bits) - 1)], 0)
+            membership = ((bits[:, None] & vocabulary_bits[None, :]) != 0).astype(np.float32)
+            sums += membership.T @ vectors
+            counts += membership.sum(axis=0).astype(np.int64)
+            global_sum += vectors.sum(axis=0)
+        global_mean = global_sum / total
+        terms, directions = [], []
+        for position, (_, canonical) in enumerate(TAG_VOCABULARY):
+            if counts[position] < min_count:
                 continue
-            is_match = True
-            tags = (product.style_tags or "").lower()
-            material = (product.material or "").lower()
-            if 'color' in modifiers:
-                target_color = modifiers['color'].lower()
-                if target_color not in tags and target_color not in material:
-                    is_match = False
-            if is_match and 'material' in modifiers:
-                target_mat = modifiers['material'].lower()
-                if target_mat not in material and target_mat not in tags:
-                    is_match = False
-            if is_match and 'style' in modifiers:
-                target_style = modifiers['style'].lower()
-                if target_style not in tags:
-                    is_match = False
-            if is_match:
-                filtered_results.append((pid, score * 1.05))
-        logger.info(f"Filtered results from {len(search_results)} to {len(filtered_results)}")
-        return filtered_results
\ No newline at end of file
+            direction = sums[position] / counts[position] - global_mean
+            norm = np.linalg.norm(direction)
+            if norm > 1e-8:
+                terms.append(canonical)
+                directions.append((direction / norm).astype(np.float32))
+        self.directions = dict(zip(terms, directions))
+        np.savez(self.directions_path, terms=np.array(terms), directions=np.array(directions, dtype=np.float32).reshape(-1, vector_db.dimension))
+        logger.info(f"Computed {len(terms)} modifier directions from {total} catalog vectors")
+    def load_directions(self):
+        try:
+            if os.path.exists(self.directions_path):
+                data = np.load(self.directions_path)
+                self.directions = dict(zip(data["terms"].tolist(), data["directions"]))
+                logger.info(f"Loaded {len(self.directions)} modifier directions")
+        except Exception as e:
+            logger.warning(f"Could not load modifier directions: {str(e)}")
+    def apply_modifier_vector(self, query_vector: np.ndarray, modifiers: Dict[str, str],
+                              strength: Optional[float] = None) -> Optional[np.ndarray]:
+        # Moves the query towards the mean embedding of products with each attribute, so a
+        # single search returns a full result set instead of post-filtering a few matches.
+        # Modifiers without a direction are left to the modifier_match ranking signal.
+        available = [canonical for canonical in modifiers.values() if canonical in self.directions]
+        if not available:
+            return None
+        strength = self.modifier_strength if strength is None else strength
+        query = query_vector.astype(np.float32).reshape(-1)
+        shifted = query / (np.linalg.norm(query) + 1e-8)
+        for canonical in available:
+            shifted = shifted + strength * self.directions[canonical]
+        return (shifted / (np.linalg.norm(shifted) + 1e-8)).astype(np.float32)
+    def match_score(self, product_ids: np.ndarray, modifiers: Dict[str, str]) -> np.ndarray:
+        # Share of the requested attributes each product is tagged with. Read-only: products newer than
+        # this snapshot count as untagged until the next snapshot loads their bits.
+        known = product_ids < len(self.tag_bits)
+        bits = np.zeros_like(product_ids)
+        bits[known] = self.tag_bits[product_ids[known]]
+        masks = np.array([self.matcher.bits[canonical] for canonical in modifiers.values()], dtype=np.int64)
+        return ((bits[:, None] & masks[None, :]) != 0).mean(axis=1).astype(np.float32)
+def load_multimodal_search(session_factory: Callable[[], Session] = SessionLocal, **kwargs) -> MultiModalSearch:
+    # Snapshot loader: the tag bits are read once here, so requests never write to the catalog
+    multimodal_search = MultiModalSearch(**kwargs)
+    db = session_factory()
+    try:
+        try:
+            multimodal_search.backfill_tag_bits(db)
+        except Exception as e:
+            # Another worker may be backfilling at the same time; its result is the same
+            db.rollback()
+            logger.warning(f"Could not backfill tag bits: {str(e)}")
+        multimodal_search.load_tag_bits(db)
+    finally:
+        db.close()
+    return multimodal_search
\ No newline at end of file
@@ -0,0 +1,59 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+import logging
+import numpy as np
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 600))
+class ResultCache:
+    # Bounded LRU of ranked result lists, each with the query vector needed to extend it
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.lock = threading.Lock()
+    @staticmethod
+    def make_key(query_vector: np.ndarray, **params) -> str:
+        digest = hashlib.sha1(np.ascontiguousarray(query_vector, dtype=np.float32).tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()[:24]
+    def get(self, key: str) -> Optional[dict]:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] < now:
+                del self.entries[key]
+                return None
+            # Paging through results keeps the entry alive
+            entry["expires_at"] = now + self.ttl
+            self.entries.move_to_end(key)
+            return entry
+    def put(self, key: str, entry: dict):
+        with self.lock:
+            entry["expires_at"] = time.monotonic() + self.ttl
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    def get_stats(self) -> dict:
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl_seconds": self.ttl}
+def encode_cursor(key: str, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{key}:{offset}".encode()).decode().rstrip("=")
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        key, offset = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        return key, int(offset)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed cursor: {cursor}") from e
\ No newline at end of file
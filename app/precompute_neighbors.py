@@ -0,0 +1,24 @@
+import argparse
+import logging
+from app.vector_db import VectorDB
+from app.knn_graph import KNNGraph
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+def precompute_neighbors(k: int = 50, update: bool = False, block_size: int = 1024, workers: int = None):
+    vector_db = VectorDB()
+    if vector_db.index.ntotal == 0:
+        logger.warning("Index is empty, run app.ingest_images first")
+        return
+    graph = KNNGraph(k=k)
+    if update:
+        graph.update(vector_db, block_size=block_size, workers=workers)
+    else:
+        graph.build(vector_db, block_size=block_size, workers=workers)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline top-K neighbor graph for the catalog")
+    parser.add_argument("k", type=int, nargs="?", default=50)
+    parser.add_argument("--update", action="store_true", help="Only add rows for vectors appended since the last build")
+    parser.add_argument("--block-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    precompute_neighbors(args.k, update=args.update, block_size=args.block_size, workers=args.workers)
\ No newline at end of file
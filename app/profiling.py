@@ -0,0 +1,214 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+MODES = ("sampler", "cprofile")
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+class StackSampler:
+    # Samples one thread's Python stack from a side thread; the output is collapsed stacks
+    # ("outer;inner;leaf count"), the input format of flamegraph.pl, speedscope and inferno
+    def __init__(self, thread_id: int, stacks: Counter, lock: threading.Lock, interval: float = 0.002,
+                 max_depth: int = 128):
+        self.thread_id = thread_id
+        self.stacks = stacks
+        # The profiler's lock, also held while the stacks are read or reset
+        self.lock = lock
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+    def start(self):
+        self._thread.start()
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                stack = ";".join(reversed(labels))
+                with self.lock:
+                    self.stacks[stack] += 1
+class ProfileSession:
+    def __init__(self, endpoint: str, mode: str, torch_ops: bool, allocations: bool, stacks: Counter,
+                 lock: threading.Lock):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.mode = mode
+        self.torch_ops = torch_ops
+        self.allocations = allocations
+        self.sampler: Optional[StackSampler] = None
+        self.cprofile: Optional[cProfile.Profile] = None
+        self.started_tracemalloc = False
+        self.op_times: Dict[str, List[float]] = {}
+        if allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(1)
+                self.started_tracemalloc = True
+            tracemalloc.reset_peak()
+            self.base_memory = tracemalloc.get_traced_memory()[0]
+        if mode == "cprofile":
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        else:
+            self.sampler = StackSampler(threading.get_ident(), stacks, lock)
+            self.sampler.start()
+    def stop(self) -> dict:
+        duration = time.perf_counter() - self.started
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        record = {"endpoint": self.endpoint, "at": time.time(), "duration_ms": round(duration * 1000, 3)}
+        if self.allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            record["peak_alloc_bytes"] = max(0, peak - self.base_memory)
+            record["retained_bytes"] = current - self.base_memory
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+        return record
+class RequestProfiler:
+    # Disabled by default; then start() is one attribute check and nothing else runs per request
+    def __init__(self, sample_rate: float = 0.0, mode: str = "sampler", torch_ops: bool = True,
+                 allocations: bool = True, history: int = 200):
+        self.sample_rate = 0.0
+        self.mode = "sampler"
+        self.torch_ops = torch_ops
+        self.allocations = allocations
+        self.configure(sample_rate=sample_rate, mode=mode)
+        self.stacks: Counter = Counter()
+        self.cprofile_stats: Optional[pstats.Stats] = None
+        self.op_totals: Dict[str, List[float]] = {}
+        self.requests = deque(maxlen=history)
+        self.profiled = 0
+        # One session at a time: tracemalloc peaks and cProfile are process-wide
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+    def configure(self, sample_rate: Optional[float] = None, mode: Optional[str] = None,
+                  torch_ops: Optional[bool] = None, allocations: Optional[bool] = None) -> dict:
+        if mode is not None:
+            if mode not in MODES:
+                raise ValueError(f"Unknown profiling mode {mode}, expected one of {', '.join(MODES)}")
+            self.mode = mode
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if torch_ops is not None:
+            self.torch_ops = torch_ops
+        if allocations is not None:
+            self.allocations = allocations
+        return self.config()
+    def config(self) -> dict:
+        return {"sample_rate": self.sample_rate, "mode": self.mode, "torch_ops": self.torch_ops,
+                "allocations": self.allocations}
+    def start(self, endpoint: str) -> Optional[ProfileSession]:
+        if self.sample_rate <= 0.0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            return ProfileSession(endpoint, self.mode, self.torch_ops, self.allocations, self.stacks, self._lock)
+        except Exception as e:
+            self._busy.release()
+            logger.error(f"Could not start profiling: {str(e)}")
+            return None
+    def torch_profile(self, session: Optional[ProfileSession]):
+        # Op-level timings for the forward pass only
+        if session is None or not session.torch_ops:
+            return nullcontext()
+        return self._torch_profile(session)
+    @contextmanager
+    def _torch_profile(self, session: ProfileSession):
+        from torch.profiler import profile, ProfilerActivity
+        with profile(activities=[ProfilerActivity.CPU]) as prof:
+            yield
+        for event in prof.key_averages():
+            times = session.op_times.setdefault(event.key, [0.0, 0])
+            times[0] += event.self_cpu_time_total / 1000.0
+            times[1] += event.count
+    def finish(self, session: Optional[ProfileSession], stages: Optional[Dict[str, float]] = None):
+        if session is None:
+            return
+        try:
+            record = session.stop()
+            if stages:
+                record["stages_ms"] = stages
+            with self._lock:
+                self.profiled += 1
+                self.requests.append(record)
+                for name, (ms, count) in session.op_times.items():
+                    totals = self.op_totals.setdefault(name, [0.0, 0])
+                    totals[0] += ms
+                    totals[1] += count
+                if session.cprofile is not None:
+                    if self.cprofile_stats is None:
+                        self.cprofile_stats = pstats.Stats(session.cprofile)
+                    else:
+                        self.cprofile_stats.add(session.cprofile)
+        finally:
+            self._busy.release()
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.cprofile_stats = None
+            self.op_totals = {}
+            self.requests.clear()
+            self.profiled = 0
+    def collapsed_stacks(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+    def cprofile_dump(self) -> Optional[bytes]:
+        # Same format as cProfile's .prof files (snakeviz, flameprof, gprof2dot)
+        with self._lock:
+            if self.cprofile_stats is None:
+                return None
+            return marshal.dumps(self.cprofile_stats.stats)
+    def cprofile_text(self, limit: int = 40) -> str:
+        with self._lock:
+            if self.cprofile_stats is None:
+                return ""
+            out = io.StringIO()
+            self.cprofile_stats.stream = out
+            self.cprofile_stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+    def summary(self, top: int = 20) -> dict:
+        with self._lock:
+            requests = list(self.requests)
+            ops = sorted(self.op_totals.items(), key=lambda item: item[1][0], reverse=True)[:top]
+            summary = {
+                "config": self.config(),
+                "profiled_requests": self.profiled,
+                "stack_samples": sum(self.stacks.values()),
+                "torch_ops": [{"op": name, "self_cpu_ms": round(ms, 3), "calls": count,
+                               "ms_per_request": round(ms / max(1, self.profiled), 3)} for name, (ms, count) in ops],
+                "recent_requests": requests[-top:]
+            }
+        peaks = sorted(record["peak_alloc_bytes"] for record in requests if "peak_alloc_bytes" in record)
+        if peaks:
+            summary["peak_alloc_bytes"] = {
+                "p50": peaks[len(peaks) // 2],
+                "p99": peaks[min(len(peaks) - 1, int(len(peaks) * 0.99))],
+                "max": peaks[-1]
+            }
+        return summary
+profiler = RequestProfiler(
+    sample_rate=float(os.environ.get("EYEWEAR_PROFILE_RATE", 0)),
+    mode=os.environ.get("EYEWEAR_PROFILE_MODE", "sampler")
+)
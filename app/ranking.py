@@ -0,0 +1,119 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+import logging
+import numpy as np
+from sqlalchemy.orm import Session
+from app.models import Product
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# Column order of the signal matrix
+SIGNALS = ("similarity", "relevance", "click_through", "modifier_match", "price_proximity")
+DEFAULT_WEIGHTS = {
+    "similarity": 1.0,
+    "relevance": 0.1,
+    "click_through": 0.05,
+    "modifier_match": 0.05,
+    "price_proximity": 0.05
+}
+# e.g. RANKING_WEIGHTS='{"relevance": 0.2, "price_proximity": 0}'
+RANKING_WEIGHTS = json.loads(os.environ.get("RANKING_WEIGHTS", "{}"))
+MIN_SIMILARITY = float(os.environ.get("RANKING_MIN_SIMILARITY", 0.3))
+class RankingEngine:
+    def __init__(self, weights: Optional[Dict[str, float]] = None, min_similarity: float = MIN_SIMILARITY,
+                 click_scale: float = 20.0):
+        weights = dict(DEFAULT_WEIGHTS, **(RANKING_WEIGHTS if weights is None else weights))
+        unknown = set(weights) - set(SIGNALS)
+        if unknown:
+            raise ValueError(f"Unknown ranking signals: {', '.join(sorted(unknown))}")
+        self.weights = weights
+        self.weight_vector = np.array([weights[name] for name in SIGNALS], dtype=np.float32)
+        self.min_similarity = min_similarity
+        self.click_scale = click_scale
+    def _product_signals(self, product_ids: np.ndarray, db: Session) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # One IN query for every candidate instead of a lookup per product
+        rows = db.query(Product.id, Product.relevance_score, Product.click_count, Product.price).filter(
+            Product.id.in_(product_ids.tolist())
+        ).all()
+        by_id = {row[0]: row[1:] for row in rows}
+        relevance = np.zeros(len(product_ids), dtype=np.float32)
+        clicks = np.zeros(len(product_ids), dtype=np.float32)
+        prices = np.zeros(len(product_ids), dtype=np.float32)
+        found = np.zeros(len(product_ids), dtype=bool)
+        for i, product_id in enumerate(product_ids.tolist()):
+            row = by_id.get(product_id)
+            if row is not None:
+                relevance[i], clicks[i], prices[i] = row[0] or 0.0, row[1] or 0, row[2] or 0.0
+                found[i] = True
+        return relevance, clicks, prices, found
+    def rank(self, product_ids: np.ndarray, similarities: np.ndarray, db: Session, k: int = 10,
+             modifiers: Optional[Dict[str, str]] = None, multimodal_search=None,
+             reference_price: Optional[float] = None, diversity: float = 0.0, vector_db=None,
+             debug: bool = False) -> Tuple[List[Tuple[int, float]], int, Optional[List[dict]]]:
+        # Returns the top-k (product_id, similarity) pairs, how many candidates qualified,
+        # and per-signal breakdowns for those k when debug is set
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        similarities = np.asarray(similarities, dtype=np.float32)
+        if len(product_ids) == 0:
+            return [], 0, [] if debug else None
+        relevance, clicks, prices, found = self._product_signals(product_ids, db)
+        signals = np.zeros((len(product_ids), len(SIGNALS)), dtype=np.float32)
+        signals[:, 0] = similarities
+        signals[:, 1] = relevance
+        signals[:, 2] = 1.0 - np.exp(-clicks / self.click_scale)
+        if modifiers and multimodal_search is not None:
+            signals[:, 3] = multimodal_search.match_score(product_ids, modifiers)
+        if reference_price:
+            # Ratio of the smaller to the larger price: 1.0 at the reference, falling off symmetrically
+            signals[:, 4] = np.minimum(prices, reference_price) / np.maximum(np.maximum(prices, reference_price), 1e-6)
+        scores = signals @ self.weight_vector
+        valid = found & (similarities >= self.min_similarity)
+        total = int(valid.sum())
+        k = min(k, total)
+        if k == 0:
+            return [], total, [] if debug else None
+        scores = np.where(valid, scores, -np.inf)
+        redundancy = None
+        if diversity > 0 and vector_db is not None and k > 1:
+            top, redundancy = self.diversify(product_ids, scores, valid, k, diversity, vector_db)
+        else:
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            # Score descending, ties broken by the original (similarity) order
+            top = top[np.lexsort((top, -scores[top]))][:k]
+        results = [(int(product_ids[i]), float(similarities[i])) for i in top]
+        if not debug:
+            return results, total, None
+        contributions = signals[top] * self.weight_vector
+        breakdown = [{
+            "score": round(float(scores[i]), 6),
+            "signals": {name: round(float(value), 6) for name, value in zip(SIGNALS, signals[i])},
+            "contributions": {name: round(float(value), 6) for name, value in zip(SIGNALS, row)}
+        } for i, row in zip(top, contributions)]
+        if redundancy is not None:
+            for entry, value in zip(breakdown, redundancy):
+                entry["redundancy"] = round(float(value), 6)
+        return results, total, breakdown
+    def diversify(self, product_ids: np.ndarray, scores: np.ndarray, valid: np.ndarray, k: int, diversity: float,
+                  vector_db) -> Tuple[np.ndarray, np.ndarray]:
+        # Greedy maximal marginal relevance: each pick maximizes
+        # (1 - diversity) * score - diversity * (max cosine similarity to the results already picked)
+        pool = np.flatnonzero(valid)
+        vectors = np.zeros((len(pool), vector_db.dimension), dtype=np.float32)
+        positions = [vector_db.position_by_id.get(int(pid)) for pid in product_ids[pool]]
+        known = np.array([position is not None for position in positions])
+        if known.any():
+            # Candidates' stored (normalized) vectors, no re-embedding; unknown ones are never penalized
+            vectors[known] = vector_db.get_vectors_at([position for position in positions if position is not None])
+        similarity = vectors @ vectors.T
+        relevance = (1.0 - diversity) * scores[pool]
+        redundancy = np.zeros(len(pool), dtype=np.float32)
+        available = np.ones(len(pool), dtype=bool)
+        picks = np.empty(min(k, len(pool)), dtype=np.int64)
+        picked_redundancy = np.empty(len(picks), dtype=np.float32)
+        for i in range(len(picks)):
+            best = int(np.argmax(np.where(available, relevance - diversity * redundancy, -np.inf)))
+            picks[i] = best
+            picked_redundancy[i] = redundancy[best]
+            available[best] = False
+            np.maximum(redundancy, similarity[best], out=redundancy)
+        return pool[picks], picked_redundancy
\ No newline at end of file
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import logging
+import numpy as np
+import torch
+from PIL import Image
+from sqlalchemy.orm import Session
+from app.models import init_db, get_db, Product, ProductImage
+from app.feature_extractor import FeatureExtractor, DEFAULT_MODEL_SPEC, model_version
+from app.vector_db import VectorDB, INDEX_PATH, read_index_meta
+from app.knn_graph import KNNGraph
+from app.multimodal_search import MultiModalSearch
+from app.sync_catalog import rebuild_index
+from app.compact_index import rebuild_as
+from app.runtime import publish_snapshot
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+ACTIVE_DIR = os.path.dirname(INDEX_PATH)
+SHADOW_DIR = os.path.join(ACTIVE_DIR, "shadow")
+VERSIONS_DIR = os.path.join(ACTIVE_DIR, "versions")
+# Everything derived from the vectors; a version is only consistent with its own copies of these
+ARTIFACTS = ("faiss.index", "faiss_ids.pkl", "faiss_meta.json", "faiss_vectors.npy", "knn_rows.npy", "knn_ids.npy",
+             "knn_scores.npy", "modifier_directions.npz")
+HASHES_FILE = "embedded_hashes.json"
+def shadow_dir(version: str) -> str:
+    return os.path.join(SHADOW_DIR, version)
+def open_shadow(version: str) -> VectorDB:
+    # Built as Flat: vectors arrive batch by batch, before there are enough to train a quantizer.
+    # switch() converts it to the active index type once it is complete.
+    return VectorDB(index_path=os.path.join(shadow_dir(version), "faiss.index"))
+def save_hashes(hashes_path: str, hashes: Dict[int, Optional[str]]):
+    with open(hashes_path + ".tmp", "w") as f:
+        json.dump(hashes, f)
+    os.replace(hashes_path + ".tmp", hashes_path)
+def catalog_images(db: Session) -> Dict[int, Tuple[str, List[str]]]:
+    # Product id -> (primary image, extra views), in the order they are indexed
+    views = defaultdict(list)
+    for product_id, image_path in db.query(ProductImage.product_id, ProductImage.image_path).order_by(ProductImage.id):
+        views[product_id].append(image_path)
+    return {pid: (image_path, views.get(pid, [])) for pid, image_path in
+            db.query(Product.id, Product.image_path).order_by(Product.id)}
+class Throttle:
+    # Sleeps after each batch so the job averages at most max_cpu of the cores it was given
+    def __init__(self, max_cpu: float):
+        self.max_cpu = min(max(max_cpu, 0.05), 1.0)
+    def run(self, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        if self.max_cpu < 1.0:
+            time.sleep((time.perf_counter() - start) * (1.0 - self.max_cpu) / self.max_cpu)
+        return result
+def embed_products(feature_extractor: FeatureExtractor, image_dir: str, products: List[Tuple[int, List[str]]],
+                   batch_size: int) -> Tuple[List[int], np.ndarray]:
+    ids, images = [], []
+    for product_id, names in products:
+        for name in names:
+            try:
+                images.append(Image.open(os.path.join(image_dir, name)).convert('RGB'))
+                ids.append(product_id)
+            except Exception as e:
+                logger.error(f"Error reading {name}: {str(e)}")
+    vectors = [feature_extractor.extract_batch(images[start:start + batch_size])
+               for start in range(0, len(images), batch_size)]
+    return ids, np.vstack(vectors) if vectors else np.empty((0, feature_extractor.feature_dim), dtype=np.float32)
+def build_shadow(model_spec: Optional[dict] = None, version: Optional[str] = None, image_dir: str = "data/images",
+                 batch_size: int = 32, threads: int = 1, max_cpu: float = 0.5, checkpoint_every: int = 20,
+                 db: Session = None) -> VectorDB:
+    init_db()
+    if db is None:
+        db_gen = get_db()
+        db = next(db_gen)
+    model_spec = {**DEFAULT_MODEL_SPEC, **(model_spec or {})}
+    version = version or model_version(model_spec)
+    # Leaves the serving processes most of the CPU
+    torch.set_num_threads(threads)
+    try:
+        os.nice(10)
+    except (AttributeError, OSError):
+        pass
+    shadow = open_shadow(version)
+    feature_extractor = FeatureExtractor(allow_download=True, model_spec=shadow.meta.get("model", model_spec))
+    shadow.set_model(feature_extractor.model_spec, feature_extractor.version)
+    shadow.meta.update(index_version=version, complete=False)
+    hashes_path = os.path.join(shadow_dir(version), HASHES_FILE)
+    hashes = {}
+    if os.path.exists(hashes_path):
+        with open(hashes_path) as f:
+            hashes = {int(pid): digest for pid, digest in json.load(f).items()}
+    catalog = catalog_images(db)
+    content_hashes = dict(db.query(Product.id, Product.content_hash))
+    # Resumable: products already in the shadow index are skipped
+    todo = [(pid, [primary] + views) for pid, (primary, views) in catalog.items() if pid not in shadow.position_by_id]
+    logger.info(f"Re-embedding {len(todo)} of {len(catalog)} products into shadow index {version} "
+                f"({feature_extractor.version}, {threads} threads, max {max_cpu:.0%} CPU)")
+    throttle = Throttle(max_cpu)
+    def save():
+        shadow.save_index()
+        save_hashes(hashes_path, hashes)
+    batches = 0
+    start = 0
+    while start < len(todo):
+        # Whole products per batch, so a product's views never straddle a checkpoint
+        end, images = start, 0
+        while end < len(todo) and (images == 0 or images + len(todo[end][1]) <= batch_size):
+            images += len(todo[end][1])
+            end += 1
+        ids, vectors = throttle.run(embed_products, feature_extractor, image_dir, todo[start:end], batch_size)
+        if ids:
+            shadow.add_vectors(vectors, ids)
+            hashes.update({pid: content_hashes.get(pid) for pid in set(ids)})
+        start = end
+        batches += 1
+        if batches % checkpoint_every == 0:
+            save()
+            logger.info(f"Shadow index {version}: {shadow.product_count}/{len(catalog)} products")
+    shadow.meta["complete"] = True
+    save()
+    logger.info(f"Shadow index {version} has {shadow.index.ntotal} vectors for {shadow.product_count} products")
+    return shadow
+def catch_up(shadow: VectorDB, version: str, image_dir: str, db: Session, batch_size: int = 32):
+    # Applies catalog changes made while the shadow was being built: removed products are dropped,
+    # products whose primary image changed are re-embedded (their extra views are kept)
+    hashes_path = os.path.join(shadow_dir(version), HASHES_FILE)
+    with open(hashes_path) as f:
+        hashes = {int(pid): digest for pid, digest in json.load(f).items()}
+    catalog = catalog_images(db)
+    content_hashes = dict(db.query(Product.id, Product.content_hash))
+    removed = {pid for pid in shadow.position_by_id if pid not in catalog}
+    changed = [pid for pid in shadow.position_by_id
+               if pid in catalog and content_hashes.get(pid) and hashes.get(pid) not in (None, content_hashes[pid])]
+    if not removed and not changed:
+        return
+    feature_extractor = FeatureExtractor(allow_download=True, model_spec=shadow.meta.get("model"))
+    ids, vectors = embed_products(feature_extractor, image_dir, [(pid, [catalog[pid][0]]) for pid in changed], batch_size)
+    rebuild_index(shadow, removed, dict(zip(ids, vectors)))
+    for pid in removed:
+        hashes.pop(pid, None)
+    hashes.update({pid: content_hashes.get(pid) for pid in ids})
+    shadow.save_index()
+    save_hashes(hashes_path, hashes)
+    logger.info(f"Caught up shadow index {version}: {len(removed)} removed, {len(ids)} re-embedded")
+def install(source_dir: str, retire: bool = True) -> dict:
+    # The active version is copied aside first, then each artifact is atomically replaced; servers
+    # pick the new files up together once the snapshot is published
+    active_meta_path = os.path.join(ACTIVE_DIR, "faiss_meta.json")
+    active = {}
+    if os.path.exists(active_meta_path):
+        with open(active_meta_path) as f:
+            active = json.load(f)
+    active_version = active.get("index_version") or f"legacy-{time.strftime('%Y%m%d-%H%M%S')}"
+    if retire and os.path.exists(os.path.join(ACTIVE_DIR, "faiss.index")):
+        retired = os.path.join(VERSIONS_DIR, active_version)
+        os.makedirs(retired, exist_ok=True)
+        for name in ARTIFACTS:
+            if os.path.exists(os.path.join(ACTIVE_DIR, name)):
+                shutil.copy2(os.path.join(ACTIVE_DIR, name), os.path.join(retired, name))
+        if not active.get("index_version"):
+            # Record the version the legacy files were retired under, so rollback can find them
+            active.update(index_version=active_version, model_version=active.get("model_version") or model_version())
+            with open(os.path.join(retired, "faiss_meta.json"), "w") as f:
+                json.dump(active, f, indent=2)
+    for name in ARTIFACTS:
+        source, target = os.path.join(source_dir, name), os.path.join(ACTIVE_DIR, name)
+        if os.path.exists(source):
+            shutil.copy2(source, target + ".tmp")
+            os.replace(target + ".tmp", target)
+        elif os.path.exists(target):
+            os.remove(target)
+    with open(active_meta_path) as f:
+        meta = json.load(f)
+    snapshot = publish_snapshot({"vectors": meta.get("vectors"), "index_version": meta.get("index_version"),
+                                 "model_version": meta.get("model_version"), "previous_version": active_version})
+    logger.info(f"Switched to index {meta.get('index_version')} ({meta.get('model_version')}), "
+                f"catalog snapshot {snapshot['generation']}; previous version kept as {active_version}")
+    return meta
+def switch(version: str, image_dir: str = "data/images", db: Session = None, force: bool = False) -> dict:
+    init_db()
+    if db is None:
+        db_gen = get_db()
+        db = next(db_gen)
+    if not os.path.exists(os.path.join(shadow_dir(version), "faiss.index")):
+        raise ValueError(f"No shadow index {version}, build it with `python -m app.reembed build` first")
+    shadow = open_shadow(version)
+    if not shadow.meta.get("complete") and not force:
+        raise ValueError(f"Shadow index {version} is incomplete, finish it with `python -m app.reembed build` first")
+    # Products added since the build finished are embedded now, then removals and changes applied
+    shadow = build_shadow(shadow.meta.get("model"), version, image_dir, db=db)
+    catch_up(shadow, version, image_dir, db)
+    # A compacted catalog stays compacted: the shadow takes the active index type, trained on the new vectors
+    index_factory = read_index_meta().get("index_factory", "Flat")
+    if index_factory != shadow.index_factory and shadow.index.ntotal:
+        logger.info(f"Rebuilding shadow index {version} as {index_factory}")
+        rebuild_as(shadow, index_factory)
+    directory = shadow_dir(version)
+    # The neighbor graph and modifier directions are rebuilt from the new vectors before the swap
+    if KNNGraph().exists():
+        KNNGraph(graph_dir=directory).build(shadow)
+    MultiModalSearch(directions_path=os.path.join(directory, "modifier_directions.npz")).build_directions(shadow, db)
+    meta = install(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    return meta
+def rollback(version: Optional[str] = None) -> dict:
+    versions = list_versions()
+    if not versions:
+        raise ValueError("No previous index version to roll back to")
+    target = version or versions[0]["index_version"]
+    directory = os.path.join(VERSIONS_DIR, target)
+    if not os.path.exists(os.path.join(directory, "faiss.index")):
+        raise ValueError(f"Unknown index version {target}")
+    meta = install(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    return meta
+def list_versions() -> List[dict]:
+    # Retired versions, most recently retired first
+    versions = []
+    if os.path.isdir(VERSIONS_DIR):
+        for name in os.listdir(VERSIONS_DIR):
+            path = os.path.join(VERSIONS_DIR, name, "faiss_meta.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    meta = json.load(f)
+                versions.append({"index_version": name, "model_version": meta.get("model_version"),
+                                 "vectors": meta.get("vectors"), "retired_at": os.path.getmtime(path)})
+    return sorted(versions, key=lambda v: v["retired_at"], reverse=True)
+def status() -> dict:
+    active = read_index_meta()
+    shadows = []
+    if os.path.isdir(SHADOW_DIR):
+        for name in sorted(os.listdir(SHADOW_DIR)):
+            meta = read_index_meta(os.path.join(shadow_dir(name), "faiss.index"))
+            shadows.append({"index_version": name, "model_version": meta.get("model_version"),
+                            "products": meta.get("products"), "complete": meta.get("complete", False)})
+    return {
+        "active": {"index_version": active.get("index_version"),
+                   "model_version": active.get("model_version") or model_version(), "products": active.get("products")},
+        "shadow": shadows,
+        "retired": list_versions()
+    }
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a shadow index with a new embedding model and switch to it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Re-embed the catalog into a shadow index (resumable)")
+    build.add_argument("--backbone", default=DEFAULT_MODEL_SPEC["backbone"])
+    build.add_argument("--input-size", type=int, default=DEFAULT_MODEL_SPEC["input_size"])
+    build.add_argument("--version", default=None, help="Shadow index name (defaults to the model version)")
+    build.add_argument("--image-dir", default="data/images")
+    build.add_argument("--batch-size", type=int, default=32)
+    build.add_argument("--threads", type=int, default=1)
+    build.add_argument("--max-cpu", type=float, default=0.5, help="Fraction of the given threads' time to use")
+    switch_parser = commands.add_parser("switch", help="Make a finished shadow index the active one")
+    switch_parser.add_argument("version")
+    switch_parser.add_argument("--image-dir", default="data/images")
+    switch_parser.add_argument("--force", action="store_true", help="Finish an interrupted build as part of the switch")
+    rollback_parser = commands.add_parser("rollback", help="Switch back to a retired version")
+    rollback_parser.add_argument("version", nargs="?", default=None)
+    commands.add_parser("status")
+    args = parser.parse_args()
+    if args.command == "build":
+        build_shadow({"backbone": args.backbone, "input_size": args.input_size}, args.version, args.image_dir,
+                     args.batch_size, args.threads, args.max_cpu)
+    elif args.command == "switch":
+        switch(args.version, args.image_dir, force=args.force)
+    elif args.command == "rollback":
+        rollback(args.version)
+    else:
+        print(json.dumps(status(), indent=2))
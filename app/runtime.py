@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, NamedTuple, Optional
+import logging
+from app.instrumentation import record_load_time
+from app.pagination import ResultCache
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+if TYPE_CHECKING:
+    from app.feature_extractor import FeatureExtractor
+    from app.attribute_recognizer import AttributeRecognizer
+    from app.color_analyzer import ColorAnalyzer
+    from app.vector_db import VectorDB
+    from app.knn_graph import KNNGraph
+    from app.multimodal_search import MultiModalSearch
+    from app.thumbnails import ThumbnailStore
+    from app.ranking import RankingEngine
+SNAPSHOT_PATH = "data/embeddings/snapshot.json"
+# Rebuilt together by a catalog sync and swapped in when the snapshot generation changes
+SNAPSHOT_COMPONENTS = ("vector_db", "knn_graph", "multimodal_search", "attribute_recognizer")
+class CatalogSnapshot(NamedTuple):
+    # Swapped with one assignment; a request reads state.snapshot once, so it never embeds
+    # with one model and searches another model's index
+    generation: int
+    feature_extractor: "FeatureExtractor"
+    attribute_recognizer: "AttributeRecognizer"
+    vector_db: "VectorDB"
+    knn_graph: "KNNGraph"
+    multimodal_search: "MultiModalSearch"
+def read_snapshot(path: str = SNAPSHOT_PATH) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+def publish_snapshot(info: dict, path: str = SNAPSHOT_PATH) -> dict:
+    # Written last, after every snapshot file is in place: servers only reload when this changes
+    snapshot = dict(info, generation=read_snapshot(path).get("generation", 0) + 1, published_at=time.time())
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+    return snapshot
+class AppState:
+    def __init__(self):
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.color_analyzer: Optional["ColorAnalyzer"] = None
+        self.thumbnails: Optional["ThumbnailStore"] = None
+        self.ranking: Optional["RankingEngine"] = None
+        self.result_cache = ResultCache()
+        self.load_times: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.ready = threading.Event()
+        self.loading = False
+        self.snapshot_generation = 0
+        self.reloading = False
+        self.next_snapshot_check = 0.0
+        self._lock = threading.Lock()
+    @property
+    def feature_extractor(self) -> Optional["FeatureExtractor"]:
+        return self.snapshot.feature_extractor if self.snapshot else None
+    @property
+    def attribute_recognizer(self) -> Optional["AttributeRecognizer"]:
+        return self.snapshot.attribute_recognizer if self.snapshot else None
+    @property
+    def vector_db(self) -> Optional["VectorDB"]:
+        return self.snapshot.vector_db if self.snapshot else None
+    @property
+    def knn_graph(self) -> Optional["KNNGraph"]:
+        return self.snapshot.knn_graph if self.snapshot else None
+    @property
+    def multimodal_search(self) -> Optional["MultiModalSearch"]:
+        return self.snapshot.multimodal_search if self.snapshot else None
+    def _loaders(self) -> Dict[str, Callable]:
+        # torch and FAISS are imported here rather than at module level so importing
+        # app.main (and binding the port) does not wait for them
+        from app.feature_extractor import FeatureExtractor, model_version
+        from app.vector_db import read_index_meta
+        from app.attribute_recognizer import AttributeRecognizer
+        from app.color_analyzer import ColorAnalyzer
+        from app.vector_db import VectorDB
+        from app.knn_graph import KNNGraph
+        from app.multimodal_search import load_multimodal_search
+        from app.thumbnails import ThumbnailStore
+        from app.ranking import RankingEngine
+        pretrained = os.environ.get("EYEWEAR_PRETRAINED", "1") != "0"
+        return {
+            # Queries are embedded with whichever model built the active index
+            "feature_extractor": lambda: FeatureExtractor(pretrained=pretrained,
+                                                          tta=os.environ.get("EYEWEAR_QUERY_TTA") == "1",
+                                                          model_spec=read_index_meta().get("model")),
+            # Attribute heads only load if they were trained on the active index's embeddings
+            "attribute_recognizer": lambda: AttributeRecognizer(model_version=model_version(read_index_meta().get("model"))),
+            "color_analyzer": ColorAnalyzer,
+            "vector_db": lambda: VectorDB(dimension=2048, mmap=os.environ.get("EYEWEAR_INDEX_MMAP") == "1",
+                                          aggregation=os.environ.get("EYEWEAR_VIEW_AGGREGATION", "max"),
+                                          rerank_factor=int(os.environ.get("EYEWEAR_RERANK_FACTOR", 4))),
+            "knn_graph": KNNGraph,
+            "multimodal_search": load_multimodal_search,
+            "thumbnails": ThumbnailStore,
+            "ranking": RankingEngine
+        }
+    def load(self):
+        with self._lock:
+            if self.ready.is_set() or self.loading:
+                return
+            self.loading = True
+        start = time.perf_counter()
+        self.snapshot_generation = read_snapshot().get("generation", 0)
+        loaders = self._loaders()
+        components = {}
+        # torch, FAISS and file reads release the GIL, so the components load concurrently
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="loader") as pool:
+            for name, future in [(name, pool.submit(self._load_component, name, loader))
+                                 for name, loader in loaders.items()]:
+                try:
+                    components[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to load {name}: {str(e)}", exc_info=True)
+                    self.errors[name] = str(e)
+        self.load_times["total"] = time.perf_counter() - start
+        self.loading = False
+        if self.errors:
+            logger.error(f"Startup failed for: {', '.join(self.errors)}")
+            return
+        snapshot_fields = set(CatalogSnapshot._fields)
+        for name, component in components.items():
+            if name not in snapshot_fields:
+                setattr(self, name, component)
+        self.snapshot = CatalogSnapshot(generation=self.snapshot_generation,
+                                        **{name: components[name] for name in CatalogSnapshot._fields[1:]})
+        self.ready.set()
+        logger.info(f"All components ready in {self.load_times['total']:.2f}s")
+    def _load_component(self, name: str, loader: Callable):
+        start = time.perf_counter()
+        component = loader()
+        elapsed = time.perf_counter() - start
+        self.load_times[name] = elapsed
+        record_load_time(name, elapsed)
+        return component
+    def check_snapshot(self, interval: float = 2.0):
+        # Called per request; at most one small file read every `interval` seconds
+        now = time.monotonic()
+        if now < self.next_snapshot_check:
+            return
+        with self._lock:
+            if self.reloading or not self.ready.is_set():
+                return
+            self.next_snapshot_check = now + interval
+            generation = read_snapshot().get("generation", 0)
+            if generation == self.snapshot_generation:
+                return
+            self.reloading = True
+        threading.Thread(target=self.reload_snapshot, args=(generation,), name="snapshot-loader", daemon=True).start()
+    def reload_snapshot(self, generation: int):
+        try:
+            loaders = self._loaders()
+            components = {name: self._load_component(name, loaders[name]) for name in SNAPSHOT_COMPONENTS}
+            from app.feature_extractor import model_version
+            index_model = components["vector_db"].model_version or model_version()
+            current = self.snapshot
+            if current is None or current.feature_extractor.version != index_model:
+                # A new embedding model was switched in; it is swapped together with its index
+                components["feature_extractor"] = self._load_component("feature_extractor", loaders["feature_extractor"])
+            else:
+                components["feature_extractor"] = current.feature_extractor
+            # Requests keep serving the old snapshot until the new one is fully loaded
+            self.snapshot = CatalogSnapshot(generation=generation, **components)
+            # Cached pages may point at products the new snapshot no longer has
+            self.result_cache.clear()
+            self.snapshot_generation = generation
+            logger.info(f"Switched to catalog snapshot {generation}")
+        except Exception as e:
+            logger.error(f"Failed to load catalog snapshot {generation}: {str(e)}", exc_info=True)
+        finally:
+            self.reloading = False
+    def status(self) -> dict:
+        return {
+            "ready": self.ready.is_set(),
+            "loading": self.loading,
+            "snapshot_generation": self.snapshot_generation,
+            "model_version": self.feature_extractor.version if self.feature_extractor else None,
+            "load_times": {name: round(seconds, 3) for name, seconds in self.load_times.items()},
+            "errors": self.errors
+        }
\ No newline at end of file
@@ -0,0 +1,135 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from typing import Optional
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+# Shared array of worker PIDs, filled in by the parent after each fork
+worker_pids = None
+def process_memory(pid: int) -> Optional[dict]:
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            values = {}
+            for line in f:
+                parts = line.split()
+                if parts and parts[0].rstrip(":") in SMAPS_FIELDS:
+                    values[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    except OSError:
+        return None
+    return {
+        "pid": pid,
+        "rss_mb": round(values.get("Rss", 0.0), 1),
+        "pss_mb": round(values.get("Pss", 0.0), 1),
+        "shared_mb": round(values.get("Shared_Clean", 0.0) + values.get("Shared_Dirty", 0.0), 1),
+        "private_mb": round(values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0), 1)
+    }
+def memory_report() -> dict:
+    if worker_pids is None:
+        return {"mode": "single", "current": process_memory(os.getpid())}
+    workers = [process_memory(pid) for pid in worker_pids if pid]
+    workers = [w for w in workers if w]
+    return {
+        "mode": "prefork",
+        "current_pid": os.getpid(),
+        "parent": process_memory(os.getppid()),
+        "workers": workers,
+        "total_rss_mb": round(sum(w["rss_mb"] for w in workers), 1),
+        "total_pss_mb": round(sum(w["pss_mb"] for w in workers), 1)
+    }
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+def _run_worker(sock: socket.socket, threads: int, log_level: str):
+    import torch
+    import faiss
+    import uvicorn
+    from app.models import engine
+    from app.main import app
+    # Pooled SQLite connections must not be shared with the parent
+    engine.dispose(close=False)
+    torch.set_num_threads(threads)
+    faiss.omp_set_num_threads(threads)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+def _fork_worker(slot: int, sock: socket.socket, threads: int, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _run_worker(sock, threads, log_level)
+        finally:
+            os._exit(0)
+    worker_pids[slot] = pid
+    logger.info(f"Started worker {slot} (pid {pid}) with {threads} torch threads")
+    return pid
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = 2, threads_per_worker: Optional[int] = None,
+          log_level: str = "info"):
+    global worker_pids
+    import torch
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    # Keep the parent single-threaded: OpenMP thread pools do not survive fork()
+    torch.set_num_threads(1)
+    os.environ["EYEWEAR_INDEX_MMAP"] = "1"
+    from app.models import init_db
+    from app.main import state
+    init_db()
+    state.load()
+    if not state.ready.is_set():
+        raise RuntimeError(f"Could not load components: {state.errors}")
+    sock = _bind_socket(host, port)
+    worker_pids = multiprocessing.Array('i', workers, lock=False)
+    # Objects allocated so far are never collected, so GC passes in the workers
+    # do not write to (and un-share) the parent's pages
+    gc.freeze()
+    slots = {}
+    for slot in range(workers):
+        slots[_fork_worker(slot, sock, threads_per_worker, log_level)] = slot
+    logger.info(f"Serving on http://{host}:{port} with {workers} workers")
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(slots):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while slots:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = slots.pop(pid, None)
+        if slot is None:
+            continue
+        if not stopping:
+            logger.warning(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+            time.sleep(1)
+            slots[_fork_worker(slot, sock, threads_per_worker, log_level)] = slot
+    sock.close()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-fork server: load the model and index once, then fork workers that share them")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    # Run through the imported module so app.main sees the same worker_pids global
+    from app import serving
+    serving.serve(args.host, args.port, args.workers, args.threads_per_worker, args.log_level)
\ No newline at end of file
@@ -0,0 +1,272 @@
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+import numpy as np
+from PIL import Image
+from sqlalchemy.orm import Session
+from app.models import init_db, get_db, Product, ProductImage
+from app.ingest_images import file_fingerprint, generate_sample_metadata, split_view, find_primary
+from app.vector_db import VectorDB
+from app.knn_graph import KNNGraph
+from app.multimodal_search import MultiModalSearch, compute_tag_bits
+from app.thumbnails import ThumbnailStore
+from app.runtime import publish_snapshot
+from app.dedup import perceptual_hash
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+def image_files(image_dir: Path, views: bool = False) -> Dict[str, Path]:
+    # Extra product views (name__view.jpg) are synced against product_images, not as products
+    return {f.name: f for f in image_dir.iterdir()
+            if f.is_file() and f.suffix.lower() in IMAGE_EXTENSIONS and (split_view(f.name)[1] is not None) == views}
+def scan_catalog(image_dir: Path, products: Dict[str, Product], indexed_ids: set) -> dict:
+    files = image_files(image_dir)
+    plan = {"added": [], "changed": [], "touched": [], "renamed": [], "removed": [], "fingerprints": {}}
+    for name, path in sorted(files.items()):
+        product = products.get(name)
+        stat = path.stat()
+        # Size and mtime are a cheap pre-check; only files that differ get hashed
+        if (product is not None and product.id in indexed_ids and product.content_hash is not None
+                and product.file_size == stat.st_size and product.file_mtime == stat.st_mtime):
+            continue
+        fingerprint = file_fingerprint(path)
+        plan["fingerprints"][name] = fingerprint
+        if product is None:
+            plan["added"].append(name)
+        elif product.id not in indexed_ids:
+            plan["changed"].append(name)
+        elif product.content_hash in (None, fingerprint["content_hash"]):
+            # Rows from before hashes were tracked are trusted and just backfilled
+            plan["touched"].append(name)
+        else:
+            plan["changed"].append(name)
+    removed = [product for name, product in products.items() if name not in files]
+    removed_by_hash = {product.content_hash: product for product in removed if product.content_hash}
+    for name in list(plan["added"]):
+        product = removed_by_hash.pop(plan["fingerprints"][name]["content_hash"], None)
+        if product is not None:
+            plan["added"].remove(name)
+            removed.remove(product)
+            plan["renamed"].append((product, name))
+    plan["removed"] = removed
+    return plan
+def scan_views(image_dir: Path, views: Dict[str, ProductImage], indexed_ids: set) -> dict:
+    files = image_files(image_dir, views=True)
+    plan = {"added": [], "changed": [], "touched": [], "removed": [], "fingerprints": {}}
+    for name, path in sorted(files.items()):
+        view = views.get(name)
+        stat = path.stat()
+        if (view is not None and view.product_id in indexed_ids and view.content_hash is not None
+                and view.file_size == stat.st_size and view.file_mtime == stat.st_mtime):
+            continue
+        fingerprint = file_fingerprint(path)
+        plan["fingerprints"][name] = fingerprint
+        if view is None:
+            plan["added"].append(name)
+        elif view.content_hash in (None, fingerprint["content_hash"]) and view.product_id in indexed_ids:
+            plan["touched"].append(name)
+        else:
+            plan["changed"].append(name)
+    plan["removed"] = [view for name, view in views.items() if name not in files]
+    return plan
+def embed_images(image_dir: Path, names: List[str], batch_size: int = 32, model_spec: Optional[dict] = None) -> Dict[str, dict]:
+    from app.feature_extractor import FeatureExtractor
+    from app.attribute_recognizer import AttributeRecognizer
+    from app.color_analyzer import ColorAnalyzer
+    feature_extractor = FeatureExtractor(allow_download=True, model_spec=model_spec)
+    attribute_recognizer = AttributeRecognizer(model_version=feature_extractor.version)
+    color_analyzer = ColorAnalyzer()
+    embedded = {}
+    for start in range(0, len(names), batch_size):
+        batch = {}
+        for i, name in enumerate(names[start:start + batch_size], start=start):
+            try:
+                logger.info(f"Embedding {i+1}/{len(names)}: {name}")
+                image = Image.open(image_dir / name).convert('RGB')
+                batch[name] = (feature_extractor.extract_features_from_image(image), color_analyzer.prepare(image),
+                               perceptual_hash(image))
+            except Exception as e:
+                logger.error(f"Error processing {name}: {str(e)}", exc_info=True)
+        # Colors for the whole batch come from one vectorized pass over the downsampled pixels
+        colors = color_analyzer.analyze_batch([thumb for _, thumb, _ in batch.values()])
+        for (name, (features, _, phash)), color in zip(batch.items(), colors):
+            attributes = attribute_recognizer.extract_attributes(features, color=color)
+            embedded[name] = {"features": features, "style_tags": ",".join(attribute_recognizer.get_tags(attributes)),
+                              "phash": phash}
+    return embedded
+def rebuild_index(vector_db: VectorDB, dropped_ids: set, new_vectors: Dict[int, np.ndarray],
+                  new_views: Optional[Dict[int, List[np.ndarray]]] = None):
+    # Unchanged vectors are reconstructed from the current index instead of re-embedded;
+    # they keep their order, so an append-only sync lets the neighbor graph update incrementally.
+    # new_vectors replaces primary vectors; new_views replaces a product's whole list of extra views.
+    new_views = new_views or {}
+    kept_positions, primary_positions, view_positions = [], {}, {}
+    for position, pid in enumerate(vector_db.id_mapping):
+        if pid in dropped_ids:
+            continue
+        if pid in new_vectors or pid in new_views:
+            if position == vector_db.position_by_id[pid]:
+                primary_positions[pid] = position
+            else:
+                view_positions.setdefault(pid, []).append(position)
+            continue
+        kept_positions.append(position)
+    kept_ids = [vector_db.id_mapping[position] for position in kept_positions]
+    kept_vectors = vector_db.get_vectors_at(kept_positions)
+    added_ids, added_vectors = [], []
+    for pid in list(new_vectors) + [pid for pid in new_views if pid not in new_vectors]:
+        if pid in new_vectors:
+            primary = np.asarray(new_vectors[pid], dtype=np.float32).reshape(1, -1)
+        elif pid in primary_positions:
+            primary = vector_db.get_vectors_at([primary_positions[pid]])
+        else:
+            logger.warning(f"Product {pid} has no primary vector, skipping its views")
+            continue
+        added_vectors.append(primary)
+        if pid in new_views:
+            views = [np.asarray(vector, dtype=np.float32).reshape(1, -1) for vector in new_views[pid]]
+        else:
+            # Other views of a product whose primary image changed keep their vectors
+            views = [vector_db.get_vectors_at(view_positions[pid])] if pid in view_positions else []
+        added_vectors.extend(views)
+        added_ids.extend([pid] * sum(len(view) for view in [primary] + views))
+    added_vectors = np.vstack(added_vectors) if added_vectors else np.empty((0, vector_db.dimension), dtype=np.float32)
+    vector_db.reset()
+    vector_db.train(np.vstack([kept_vectors, added_vectors]))
+    if kept_ids:
+        vector_db.add_vectors(kept_vectors, kept_ids)
+    if added_ids:
+        vector_db.add_vectors(added_vectors, added_ids)
+def sync_views(db: Session, image_dir: Path, plan: dict, removed_ids: set,
+               model_spec: Optional[dict] = None) -> Tuple[Dict[int, List[np.ndarray]], List[str]]:
+    # A product whose views changed gets all of its view vectors re-embedded, in product_images order,
+    # so the index keeps the primary-then-views layout of app.ingest_images
+    fingerprints = plan["fingerprints"]
+    views = {view.image_path: view for view in db.query(ProductImage).filter(
+        ProductImage.image_path.in_(plan["touched"] + plan["changed"]))}
+    affected = set()
+    for name in plan["touched"]:
+        for key, value in fingerprints[name].items():
+            setattr(views[name], key, value)
+    for name in plan["changed"]:
+        for key, value in fingerprints[name].items():
+            setattr(views[name], key, value)
+        affected.add(views[name].product_id)
+    for name in plan["added"]:
+        base, view = split_view(name)
+        primary = find_primary(db, base)
+        if primary is None or primary.id in removed_ids:
+            logger.warning(f"No product image {base}.* for view {name}, skipping")
+            continue
+        db.add(ProductImage(product_id=primary.id, image_path=name, view=view, **fingerprints[name]))
+        affected.add(primary.id)
+    removed_names = {view.image_path for view in plan["removed"]}
+    affected.update(view.product_id for view in plan["removed"])
+    affected -= removed_ids
+    db.flush()
+    rows = [view for view in db.query(ProductImage).filter(ProductImage.product_id.in_(list(affected)))
+            .order_by(ProductImage.id) if view.image_path not in removed_names]
+    embedded = embed_images(image_dir, [view.image_path for view in rows], model_spec=model_spec)
+    new_views = {pid: [] for pid in affected}
+    for view in rows:
+        if view.image_path in embedded:
+            view.phash = embedded[view.image_path]["phash"]
+            new_views[view.product_id].append(embedded[view.image_path]["features"])
+    return new_views, list(embedded)
+def sync_catalog(image_dir: str = "data/images", db: Session = None, dry_run: bool = False) -> dict:
+    init_db()
+    if db is None:
+        db_gen = get_db()
+        db = next(db_gen)
+    image_dir_path = Path(image_dir)
+    if not image_dir_path.exists():
+        logger.warning(f"Image directory {image_dir} does not exist")
+        return {}
+    vector_db = VectorDB()
+    products = {product.image_path: product for product in db.query(Product).all()}
+    plan = scan_catalog(image_dir_path, products, set(vector_db.position_by_id))
+    view_plan = scan_views(image_dir_path, {view.image_path: view for view in db.query(ProductImage).all()},
+                           set(vector_db.position_by_id))
+    summary = {key: len(plan[key]) for key in ("added", "changed", "touched", "renamed", "removed")}
+    summary.update({f"views_{key}": len(view_plan[key]) for key in ("added", "changed", "touched", "removed")})
+    logger.info(f"Catalog changes: {summary}")
+    if dry_run or not any(summary.values()):
+        return summary
+    stale_names = [product.image_path for product in plan["removed"] + [product for product, _ in plan["renamed"]]]
+    stale_names += [view.image_path for view in view_plan["removed"]]
+    # Embedded with the model recorded in the index manifest, so new vectors match the existing ones
+    embedded = embed_images(image_dir_path, plan["added"] + plan["changed"], model_spec=vector_db.meta.get("model"))
+    fingerprints = plan["fingerprints"]
+    new_vectors = {}
+    for name in plan["touched"]:
+        for key, value in fingerprints[name].items():
+            setattr(products[name], key, value)
+    for product, name in plan["renamed"]:
+        product.image_path = name
+        for key, value in fingerprints[name].items():
+            setattr(product, key, value)
+    for name in plan["changed"]:
+        if name not in embedded:
+            continue
+        product = products[name]
+        product.style_tags = embedded[name]["style_tags"]
+        product.tag_bits = compute_tag_bits(product.style_tags, product.material)
+        product.phash = embedded[name]["phash"]
+        for key, value in fingerprints[name].items():
+            setattr(product, key, value)
+        new_vectors[product.id] = embedded[name]["features"]
+    for name in plan["added"]:
+        if name not in embedded:
+            continue
+        metadata = generate_sample_metadata(name)
+        product = Product(
+            image_path=name,
+            brand=metadata["brand"],
+            price=metadata["price"],
+            material=metadata["material"],
+            style_tags=embedded[name]["style_tags"],
+            tag_bits=compute_tag_bits(embedded[name]["style_tags"], metadata["material"]),
+            phash=embedded[name]["phash"],
+            **fingerprints[name]
+        )
+        db.add(product)
+        db.flush()
+        new_vectors[product.id] = embedded[name]["features"]
+    removed_ids = {product.id for product in plan["removed"]}
+    new_views, embedded_views = sync_views(db, image_dir_path, view_plan, removed_ids,
+                                           model_spec=vector_db.meta.get("model"))
+    # New and updated rows are committed first: until the snapshot is published they are
+    # simply not in the served index. Removed rows are deleted only after it is published.
+    db.commit()
+    if new_vectors or removed_ids or new_views:
+        rebuild_index(vector_db, removed_ids, new_vectors, new_views)
+        vector_db.save_index()
+        knn_graph = KNNGraph()
+        if knn_graph.exists():
+            knn_graph.update(vector_db)
+        MultiModalSearch().build_directions(vector_db, db)
+    thumbnails = ThumbnailStore(image_dir=image_dir)
+    thumbnails.generate_many([name for name in plan["added"] + plan["changed"] if name in embedded]
+                             + [name for _, name in plan["renamed"]] + embedded_views)
+    if new_vectors or removed_ids or new_views:
+        snapshot = publish_snapshot({"vectors": vector_db.index.ntotal, "changes": summary})
+        logger.info(f"Published catalog snapshot {snapshot['generation']} with {vector_db.index.ntotal} vectors")
+    for product in plan["removed"]:
+        db.query(ProductImage).filter(ProductImage.product_id == product.id).delete(synchronize_session=False)
+        db.delete(product)
+    for view in view_plan["removed"]:
+        if view.product_id not in removed_ids:
+            db.delete(view)
+    db.commit()
+    for name in stale_names:
+        thumbnails.manifest.pop(name, None)
+    thumbnails.save_manifest()
+    thumbnails.prune()
+    return summary
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the product database and vector index with an image directory")
+    parser.add_argument("image_dir", nargs="?", default="data/images")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+    sync_catalog(args.image_dir, dry_run=args.dry_run)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+import logging
+from PIL import Image, features
+from fastapi.staticfiles import StaticFiles
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+THUMBNAIL_SIZES = (128, 256, 512)
+class ImmutableStaticFiles(StaticFiles):
+    # Thumbnail filenames contain a content hash, so a URL never changes meaning and can be cached forever
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+class ThumbnailStore:
+    def __init__(self, image_dir: str = "data/images", thumb_dir: str = "data/thumbnails",
+                 sizes: Iterable[int] = THUMBNAIL_SIZES, quality: int = 80, url_prefix: str = "/thumbs"):
+        self.image_dir = image_dir
+        self.thumb_dir = thumb_dir
+        self.sizes = sorted(sizes, reverse=True)
+        self.quality = quality
+        self.url_prefix = url_prefix
+        self.format, self.extension = ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+        self.manifest_path = os.path.join(thumb_dir, "manifest.json")
+        self.manifest: Dict[str, dict] = {}
+        self.manifest_mtime = 0.0
+        os.makedirs(thumb_dir, exist_ok=True)
+        self.load_manifest()
+    @staticmethod
+    def content_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()[:20]
+    def _filename(self, digest: str, size: int) -> str:
+        return f"{digest}_{size}.{self.extension}"
+    def generate(self, image_name: str) -> Optional[dict]:
+        path = os.path.join(self.image_dir, image_name)
+        try:
+            digest = self.content_hash(path)
+            files = {str(size): self._filename(digest, size) for size in self.sizes}
+            if all(os.path.exists(os.path.join(self.thumb_dir, name)) for name in files.values()):
+                return {"hash": digest, "files": files}
+            with Image.open(path) as image:
+                image.draft("RGB", (self.sizes[0], self.sizes[0]))
+                image = image.convert("RGB")
+                # Largest first, each size is downscaled from the previous one
+                for size in self.sizes:
+                    image.thumbnail((size, size), Image.LANCZOS)
+                    target = os.path.join(self.thumb_dir, files[str(size)])
+                    tmp_path = target + ".tmp"
+                    image.save(tmp_path, format=self.format, quality=self.quality)
+                    os.replace(tmp_path, target)
+            return {"hash": digest, "files": files}
+        except Exception as e:
+            logger.warning(f"Could not create thumbnails for {image_name}: {str(e)}")
+            return None
+    def generate_many(self, image_names: List[str], workers: Optional[int] = None) -> int:
+        # PIL releases the GIL while decoding, resizing and encoding, so threads scale across cores
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail") as pool:
+            results = list(pool.map(self.generate, image_names))
+        created = 0
+        for image_name, entry in zip(image_names, results):
+            if entry:
+                self.manifest[image_name] = entry
+                created += 1
+        self.save_manifest()
+        logger.info(f"Thumbnails ready for {created}/{len(image_names)} images in {self.thumb_dir}")
+        return created
+    def prune(self) -> int:
+        # Drops files no manifest entry points at, e.g. thumbnails of images whose content changed
+        referenced = {name for entry in self.manifest.values() for name in entry["files"].values()}
+        pruned = 0
+        for name in os.listdir(self.thumb_dir):
+            if name.endswith(f".{self.extension}") and name not in referenced:
+                os.remove(os.path.join(self.thumb_dir, name))
+                pruned += 1
+        return pruned
+    def save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest_mtime = os.path.getmtime(self.manifest_path)
+    def load_manifest(self):
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    self.manifest = json.load(f)
+                self.manifest_mtime = os.path.getmtime(self.manifest_path)
+        except Exception as e:
+            logger.warning(f"Could not load thumbnail manifest: {str(e)}")
+    def refresh(self):
+        try:
+            if os.path.getmtime(self.manifest_path) != self.manifest_mtime:
+                self.load_manifest()
+        except OSError:
+            pass
+    def urls(self, image_name: str) -> Optional[Dict[str, str]]:
+        entry = self.manifest.get(image_name)
+        if entry is None:
+            return None
+        return {size: f"{self.url_prefix}/{name}" for size, name in entry["files"].items()}
+if __name__ == "__main__":
+    image_dir = sys.argv[1] if len(sys.argv) > 1 else "data/images"
+    store = ThumbnailStore(image_dir=image_dir)
+    names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    store.generate_many(names)
\ No newline at end of file
@@ -0,0 +1,201 @@
+import argparse
+import csv
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import logging
+import numpy as np
+import torch
+import torch.nn as nn
+from sqlalchemy.orm import Session
+from app.models import init_db, get_db, Product
+from app.vector_db import VectorDB
+from app.attribute_recognizer import AttributeRecognizer, ATTRIBUTE_MODEL_DIR, build_style_head, build_color_head
+from app.multimodal_search import MultiModalSearch, compute_tag_bits
+from app.runtime import publish_snapshot
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+def read_labels(labels_csv: str) -> Dict[str, Dict[str, str]]:
+    # image_path,style,color; either label may be blank
+    canonical = {
+        "style": {label.lower(): label for label in AttributeRecognizer.STYLE_LABELS},
+        "color": {label.lower(): label for label in AttributeRecognizer.COLOR_LABELS}
+    }
+    labels, unknown = {}, 0
+    with open(labels_csv, newline="") as f:
+        for row in csv.DictReader(f):
+            entry = {}
+            for attribute in ("style", "color"):
+                value = (row.get(attribute) or "").strip().lower()
+                if not value:
+                    continue
+                if value in canonical[attribute]:
+                    entry[attribute] = canonical[attribute][value]
+                else:
+                    unknown += 1
+            if entry:
+                labels[row["image_path"].strip()] = entry
+    if unknown:
+        logger.warning(f"Skipped {unknown} labels that are not in the label vocabulary")
+    return labels
+def load_training_set(labels: Dict[str, Dict[str, str]], vector_db: VectorDB, db: Session) -> Tuple[np.ndarray, List[Dict[str, str]]]:
+    # Embeddings come straight from the index, no image is decoded again
+    rows = db.query(Product.id, Product.image_path).filter(Product.image_path.in_(list(labels))).all()
+    matched = [(product_id, image_path) for product_id, image_path in rows if product_id in vector_db.position_by_id]
+    if len(matched) < len(labels):
+        logger.warning(f"{len(labels) - len(matched)} labeled images are not in the catalog index")
+    features = vector_db.get_vectors([product_id for product_id, _ in matched])
+    return features, [labels[image_path] for _, image_path in matched]
+def train_head(head: nn.Module, features: np.ndarray, targets: np.ndarray, num_labels: int, epochs: int = 200,
+               batch_size: int = 256, lr: float = 1e-3, weight_decay: float = 1e-4, patience: int = 10,
+               val_fraction: float = 0.2, seed: int = 0) -> Optional[dict]:
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(targets))
+    n_val = max(1, int(len(order) * val_fraction))
+    val_idx, train_idx = order[:n_val], order[n_val:]
+    x_train, y_train = torch.from_numpy(features[train_idx]), torch.from_numpy(targets[train_idx])
+    x_val, y_val = torch.from_numpy(features[val_idx]), torch.from_numpy(targets[val_idx])
+    # Inverse-frequency class weights so rare styles are not drowned out
+    counts = np.bincount(targets[train_idx], minlength=num_labels).astype(np.float32)
+    class_weights = torch.from_numpy(np.where(counts > 0, len(train_idx) / (num_labels * np.maximum(counts, 1)), 0.0).astype(np.float32))
+    criterion = nn.CrossEntropyLoss(weight=class_weights)
+    optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=weight_decay)
+    generator = torch.Generator().manual_seed(seed)
+    best = {"val_loss": float("inf"), "epoch": 0, "state": None, "val_accuracy": 0.0}
+    epoch = 0
+    for epoch in range(1, epochs + 1):
+        head.train()
+        permutation = torch.randperm(len(x_train), generator=generator)
+        for start in range(0, len(x_train), batch_size):
+            batch = permutation[start:start + batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(x_train[batch]), y_train[batch])
+            loss.backward()
+            optimizer.step()
+        head.eval()
+        with torch.no_grad():
+            logits = head(x_val)
+            val_loss = float(nn.functional.cross_entropy(logits, y_val))
+            val_accuracy = float((logits.argmax(dim=1) == y_val).float().mean())
+        if val_loss < best["val_loss"] - 1e-4:
+            best = {"val_loss": val_loss, "epoch": epoch, "val_accuracy": val_accuracy,
+                    "state": {name: tensor.detach().clone() for name, tensor in head.state_dict().items()}}
+        elif epoch - best["epoch"] >= patience:
+            break
+    if best["state"] is None:
+        # No epoch produced a finite validation loss (e.g. it was NaN throughout)
+        return None
+    head.load_state_dict(best["state"])
+    head.eval()
+    return {
+        "epochs": epoch,
+        "best_epoch": best["epoch"],
+        "val_loss": round(best["val_loss"], 4),
+        "val_accuracy": round(best["val_accuracy"], 4),
+        "train_samples": len(train_idx),
+        "val_samples": n_val
+    }
+def fit_attribute(name: str, features: np.ndarray, values: List[Optional[str]], build_head, min_samples: int,
+                  **options) -> Tuple[Optional[List[str]], Optional[dict], Optional[dict]]:
+    labeled = [i for i, value in enumerate(values) if value]
+    # Only classes that actually occur become outputs of the head
+    label_names = sorted({values[i] for i in labeled})
+    if len(label_names) < 2 or len(labeled) < min_samples:
+        logger.warning(f"Skipping {name} head: {len(labeled)} samples over {len(label_names)} classes")
+        return None, None, None
+    index = {label: i for i, label in enumerate(label_names)}
+    targets = np.array([index[values[i]] for i in labeled], dtype=np.int64)
+    head = build_head(features.shape[1], len(label_names))
+    start = time.perf_counter()
+    metrics = train_head(head, features[labeled], targets, len(label_names), **options)
+    if metrics is None:
+        logger.warning(f"Skipping {name} head: validation loss never improved on its initial value")
+        return None, None, None
+    metrics["seconds"] = round(time.perf_counter() - start, 2)
+    logger.info(f"Trained {name} head on {len(labeled)} samples: {metrics}")
+    return label_names, head.state_dict(), metrics
+def save_weights(model_dir: str, feature_dim: int, model_version: Optional[str], style: tuple, color: tuple) -> dict:
+    os.makedirs(model_dir, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S")
+    filename = f"attributes_{version}.pt"
+    path = os.path.join(model_dir, filename)
+    torch.save({
+        "feature_dim": feature_dim,
+        "model_version": model_version,
+        "style_labels": style[0],
+        "style_state": style[1],
+        "color_labels": color[0],
+        "color_state": color[1]
+    }, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    # Older versions stay on disk, rolling back is pointing current.json at one of them
+    pointer = {"version": version, "file": filename, "model_version": model_version,
+               "metrics": {"style": style[2], "color": color[2]}}
+    pointer_path = os.path.join(model_dir, "current.json")
+    with open(pointer_path + ".tmp", "w") as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(pointer_path + ".tmp", pointer_path)
+    logger.info(f"Saved attribute weights {version} to {path}")
+    return pointer
+def retag_catalog(vector_db: VectorDB, db: Session, model_dir: str = ATTRIBUTE_MODEL_DIR, block_size: int = 4096):
+    attribute_recognizer = AttributeRecognizer(feature_dim=vector_db.dimension, model_dir=model_dir,
+                                               model_version=vector_db.model_version)
+    products = {product.id: product for product in db.query(Product).all()}
+    # Tags come from each product's primary image
+    ids = [pid for pid in vector_db.position_by_id if pid in products]
+    for start in range(0, len(ids), block_size):
+        block = ids[start:start + block_size]
+        for product_id, attributes in zip(block, attribute_recognizer.predict_batch(vector_db.get_vectors(block))):
+            product = products[product_id]
+            if "color" not in attributes:
+                # Keep the color ColorAnalyzer assigned from the pixels at ingest
+                stored = [tag for tag in (product.style_tags or "").split(",") if tag in AttributeRecognizer.COLOR_LABELS]
+                if stored:
+                    attributes["color"] = stored[0]
+            product.style_tags = ",".join(attribute_recognizer.get_tags(attributes))
+            product.tag_bits = compute_tag_bits(product.style_tags, product.material)
+    db.commit()
+    MultiModalSearch().build_directions(vector_db, db)
+    snapshot = publish_snapshot({"vectors": vector_db.index.ntotal, "attributes": attribute_recognizer.version})
+    logger.info(f"Re-tagged {len(ids)} products, published catalog snapshot {snapshot['generation']}")
+def train_attributes(labels_csv: str, index_path: Optional[str] = None, model_dir: str = ATTRIBUTE_MODEL_DIR,
+                     threads: Optional[int] = None, min_samples: int = 20, retag: bool = False, db: Session = None,
+                     **options) -> Optional[dict]:
+    init_db()
+    if db is None:
+        db_gen = get_db()
+        db = next(db_gen)
+    if threads:
+        torch.set_num_threads(threads)
+    vector_db = VectorDB(index_path=index_path)
+    if vector_db.index.ntotal == 0:
+        logger.warning("Index is empty, run app.ingest_images first")
+        return None
+    features, labels = load_training_set(read_labels(labels_csv), vector_db, db)
+    logger.info(f"Training on {len(labels)} labeled embeddings with {torch.get_num_threads()} threads")
+    style = fit_attribute("style", features, [entry.get("style") for entry in labels], build_style_head, min_samples, **options)
+    color = fit_attribute("color", features, [entry.get("color") for entry in labels], build_color_head, min_samples, **options)
+    if style[1] is None and color[1] is None:
+        logger.error("Not enough labeled data to train either head")
+        return None
+    pointer = save_weights(model_dir, vector_db.dimension, vector_db.model_version, style, color)
+    if retag:
+        retag_catalog(vector_db, db, model_dir)
+    return pointer
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the style and color heads on the stored catalog embeddings")
+    parser.add_argument("labels_csv", help="CSV with image_path,style,color columns")
+    parser.add_argument("--index", default=None, help="Alternate FAISS index path")
+    parser.add_argument("--model-dir", default=ATTRIBUTE_MODEL_DIR)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--patience", type=int, default=10)
+    parser.add_argument("--min-samples", type=int, default=20)
+    parser.add_argument("--retag", action="store_true", help="Re-tag every indexed product with the new weights")
+    args = parser.parse_args()
+    train_attributes(args.labels_csv, index_path=args.index, model_dir=args.model_dir, threads=args.threads,
+                     min_samples=args.min_samples, retag=args.retag, epochs=args.epochs, batch_size=args.batch_size,
+                     lr=args.lr, patience=args.patience)
\ No newline at end of file
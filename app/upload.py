@@ -0,0 +1,83 @@
+import os
+from typing import Optional, Tuple
+import logging
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 40_000_000))
+DECODE_SIZE = int(os.environ.get("UPLOAD_DECODE_SIZE", 512))
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP", "BMP", "GIF", "MPO"}
+# Multipart framing and form fields on top of the image itself
+FORM_OVERHEAD_BYTES = 64 * 1024
+class UploadLimitMiddleware:
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES, methods: Tuple[str, ...] = ("POST",)):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.methods = methods
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            # Rejected from the header alone, before any of the body is read
+            await self._reject(send)
+            return
+        received = 0
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Upload too large")
+            return message
+        await self.app(scope, limited_receive, send)
+    async def _reject(self, send):
+        body = b'{"detail":"Upload too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        })
+        await send({"type": "http.response.body", "body": body})
+def _upload_size(upload: UploadFile) -> int:
+    if upload.size is not None:
+        return upload.size
+    position = upload.file.tell()
+    upload.file.seek(0, os.SEEK_END)
+    size = upload.file.tell()
+    upload.file.seek(position)
+    return size
+def decode_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES, max_pixels: int = MAX_IMAGE_PIXELS,
+                  decode_size: Optional[int] = DECODE_SIZE) -> Image.Image:
+    size = _upload_size(upload)
+    if size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload too large ({size} bytes, limit {max_bytes})")
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    upload.file.seek(0)
+    try:
+        # Image.open only parses the header; pixels are decoded by load()
+        image = Image.open(upload.file)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not read image")
+    if image.format not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format: {image.format}")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise HTTPException(status_code=413, detail=f"Image dimensions too large ({width}x{height})")
+    if decode_size:
+        # JPEG decodes straight to a 1/2, 1/4 or 1/8 scale that still covers decode_size
+        image.draft("RGB", (decode_size, decode_size))
+    try:
+        image.load()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {str(e)}")
+    if decode_size and max(image.size) > decode_size:
+        image.thumbnail((decode_size, decode_size), Image.BILINEAR)
+    logger.info(f"Decoded upload {upload.filename}: {width}x{height} {image.format} -> {image.size[0]}x{image.size[1]}")
+    return image
\ No newline at end of file
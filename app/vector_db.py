@@ -1,47 +1,219 @@
 import faiss
+import json
+import math
 import numpy as np
 import pickle
 import os
-from typing import List, Tuple, Optional
+import time
+from typing import Dict, List, Tuple, Optional
 import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+INDEX_PATH = "data/embeddings/faiss.index"
+def meta_path_for(index_path: str) -> str:
+    return index_path.replace(".index", "_meta.json")
+def read_index_meta(index_path: str = INDEX_PATH) -> dict:
+    # Cheap enough to call before the index itself is loaded, e.g. to pick the matching embedding model
+    try:
+        with open(meta_path_for(index_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 class VectorDB:
-    def __init__(self, dimension: int = 2048, index_path: Optional[str] = None):
+    def __init__(self, dimension: int = 2048, index_path: Optional[str] = None,
+                 index_factory: str = "Flat", nprobe: int = 16, mmap: bool = False, aggregation: str = "max",
+                 rerank_factor: int = 4):
+        if aggregation not in ("max", "mean"):
+            raise ValueError(f"Unknown aggregation {aggregation}, expected 'max' or 'mean'")
         self.dimension = dimension
-        self.index_path = index_path or "data/embeddings/faiss.index"
-        self.ids_path = index_path.replace(".index", "_ids.pkl") if index_path else "data/embeddings/faiss_ids.pkl"
+        self.aggregation = aggregation
+        self.mmap = mmap
+        self.index_factory = index_factory
+        self.nprobe = nprobe
+        # Candidates fetched per result from an approximate index before exact re-ranking; 0 disables it
+        self.rerank_factor = rerank_factor
+        self.index_path = index_path or INDEX_PATH
+        self.ids_path = self.index_path.replace(".index", "_ids.pkl")
+        self.meta_path = meta_path_for(self.index_path)
+        self.vectors_path = self.index_path.replace(".index", "_vectors.npy")
+        # Manifest written next to the index: which embedding model produced the vectors, and the index version
+        self.meta: dict = {}
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-        self.index = faiss.IndexFlatIP(dimension)
+        self.index = self._create_index()
+        # One entry per vector; a product with several images appears once per image.
+        # position_by_id points at its first (primary) vector.
         self.id_mapping: List[int] = []
+        self.position_by_id: Dict[int, int] = {}
+        self._id_array: Optional[np.ndarray] = None
+        # Normalized vectors as float16, row i is FAISS position i. Memory-mapped once saved, so a compressed
+        # index plus this store costs about half the resident memory of IndexFlatIP's float32 copy.
+        self.vectors: Optional[np.ndarray] = np.empty((0, dimension), dtype=np.float16)
+        self._vector_blocks: List[np.ndarray] = []
         self.load_index()
+    def _create_index(self):
+        if self.index_factory == "Flat":
+            return faiss.IndexFlatIP(self.dimension)
+        index = faiss.index_factory(self.dimension, self.index_factory, faiss.METRIC_INNER_PRODUCT)
+        self._configure_index(index)
+        return index
+    def _configure_index(self, index):
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            return
+        ivf.nprobe = self.nprobe
+        # IVF lists do not support reconstruct() without a direct map
+        ivf.make_direct_map()
+    def train(self, vectors: np.ndarray):
+        if self.index.is_trained:
+            return
+        vectors = vectors.astype('float32')
+        faiss.normalize_L2(vectors)
+        self.index.train(vectors)
+        logger.info(f"Trained {self.index_factory} index on {vectors.shape[0]} vectors")
+    def reset(self):
+        if self.mmap:
+            raise ValueError("Index is memory-mapped read-only, load it with mmap=False to rebuild it")
+        self.index = self._create_index()
+        self.id_mapping = []
+        self.position_by_id = {}
+        self._id_array = None
+        self.vectors = np.empty((0, self.dimension), dtype=np.float16)
+        self._vector_blocks = []
+    @property
+    def id_array(self) -> np.ndarray:
+        if self._id_array is None or len(self._id_array) != len(self.id_mapping):
+            self._id_array = np.asarray(self.id_mapping, dtype=np.int64)
+        return self._id_array
+    @property
+    def model_version(self) -> Optional[str]:
+        # None for indexes built before versions were recorded (always the default model)
+        return self.meta.get("model_version")
+    def set_model(self, model_spec: dict, model_version: str):
+        if self.index.ntotal and self.model_version not in (None, model_version):
+            raise ValueError(f"Index holds {self.model_version} vectors, cannot add {model_version} vectors")
+        self.meta["model"] = dict(model_spec)
+        self.meta["model_version"] = model_version
+    @property
+    def product_count(self) -> int:
+        return len(self.position_by_id)
+    @property
+    def exact(self) -> bool:
+        # Flat indexes store the float32 vectors themselves; anything else reconstructs approximations
+        return isinstance(self.index, faiss.IndexFlat)
+    @property
+    def compact_vectors(self) -> Optional[np.ndarray]:
+        # None when the store does not cover the index, e.g. an index saved before the store existed
+        if self._vector_blocks:
+            self.vectors = np.concatenate([self.vectors] + self._vector_blocks)
+            self._vector_blocks = []
+        if self.vectors is None or len(self.vectors) != self.index.ntotal:
+            return None
+        return self.vectors
+    @property
+    def reranking(self) -> bool:
+        return self.rerank_factor > 0 and not self.exact and self.compact_vectors is not None
+    def get_vectors(self, product_ids: List[int], block_size: int = 4096) -> np.ndarray:
+        return self.get_vectors_at([self.position_by_id[pid] for pid in product_ids], block_size)
+    def get_vectors_range(self, start: int, count: int) -> np.ndarray:
+        if not self.exact and self.compact_vectors is not None:
+            return self.compact_vectors[start:start + count].astype(np.float32)
+        return self.index.reconstruct_n(start, count)
+    def get_vectors_at(self, positions: List[int], block_size: int = 4096) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        if not self.exact and self.compact_vectors is not None:
+            return self.compact_vectors[positions].astype(np.float32)
+        vectors = np.empty((len(positions), self.dimension), dtype=np.float32)
+        for start in range(0, len(positions), block_size):
+            block = positions[start:start + block_size]
+            vectors[start:start + len(block)] = self.index.reconstruct_batch(block)
+        return vectors
     def add_vectors(self, vectors: np.ndarray, product_ids: List[int]):
         if vectors.shape[0] != len(product_ids):
             raise ValueError("Number of vectors must match number of product IDs")
+        if not self.index.is_trained:
+            raise ValueError(f"Index {self.index_factory} must be trained before adding vectors")
+        if self.mmap:
+            raise ValueError("Index is memory-mapped read-only, load it with mmap=False to add vectors")
         vectors = vectors.astype('float32')
         faiss.normalize_L2(vectors)
         self.index.add(vectors)
+        if self.vectors is not None:
+            self._vector_blocks.append(vectors.astype(np.float16))
+        start = len(self.id_mapping)
         self.id_mapping.extend(product_ids)
+        for offset, product_id in enumerate(product_ids):
+            self.position_by_id.setdefault(product_id, start + offset)
         logger.info(f"Added {len(product_ids)} vectors to index. Total: {self.index.ntotal}")
     def search(self, query_vector: np.ndarray, k: int = 10, 
                filters: Optional[dict] = None, product_db=None) -> List[Tuple[int, float]]:
-        if self.index.ntotal == 0:
+        results = self.ann_search(query_vector, k * 3)
+        if filters and product_db:
+            results = self.filter_results(results, filters, product_db)
+        return results[:k]
+    def ann_search(self, query_vector: np.ndarray, n: int) -> List[Tuple[int, float]]:
+        # Up to n distinct products, each scored by the max (or mean) similarity of its hit vectors
+        total = self.index.ntotal
+        if total == 0:
             logger.warning("Index is empty")
             return []
         query_vector = query_vector.astype('float32').reshape(1, -1)
         faiss.normalize_L2(query_vector)
-        distances, indices = self.index.search(query_vector, min(k * 3, self.index.ntotal))
-        results = []
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx < len(self.id_mapping):
-                product_id = self.id_mapping[idx]
-                similarity = max(0.0, min(1.0, float(dist)))
-                if filters and product_db:
-                    if not self._apply_filters(product_id, filters, product_db):
-                        continue
-                results.append((product_id, similarity))
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results[:k]
+        n = min(n, self.product_count or total)
+        reranking = self.reranking
+        # Start from the average number of vectors per product and double until n products are covered
+        fetch = min(total, math.ceil(n * total / max(1, self.product_count)))
+        if reranking:
+            fetch = min(total, fetch * self.rerank_factor)
+        while True:
+            distances, indices = self.index.search(query_vector, fetch)
+            distances, indices = distances[0], indices[0]
+            if reranking:
+                distances, indices = self._rerank(query_vector[0], indices)
+            product_ids, scores = self._group_by_product(indices, distances)
+            if len(product_ids) >= n or fetch >= total:
+                break
+            fetch = min(total, fetch * 2)
+        scores = np.clip(scores, 0.0, 1.0)
+        return [(int(pid), float(score)) for pid, score in zip(product_ids[:n], scores[:n])]
+    def _rerank(self, query_vector: np.ndarray, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Exact inner products against the float16 copies replace the approximate index scores
+        positions = indices[indices >= 0]
+        scores = self.compact_vectors[positions].astype(np.float32) @ query_vector
+        order = np.argsort(-scores, kind='stable')
+        return scores[order], positions[order]
+    def _group_by_product(self, indices: np.ndarray, distances: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        valid = (indices >= 0) & (indices < len(self.id_mapping))
+        ids = self.id_array[indices[valid]]
+        distances = distances[valid]
+        if self.product_count == len(self.id_mapping) or len(ids) == 0:
+            # One vector per product, nothing to group
+            return ids, distances
+        # FAISS returns hits best-first, so each product's first hit is also its max
+        unique_ids, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        if self.aggregation == "mean":
+            scores = np.bincount(inverse, weights=distances) / np.bincount(inverse)
+        else:
+            scores = distances[first]
+        # Ties keep the order of each product's best hit
+        order = np.lexsort((first, -scores))
+        return unique_ids[order], scores[order].astype(np.float32)
+    def nearest_batch(self, vectors: np.ndarray) -> List[Optional[Tuple[int, float]]]:
+        # Top-1 neighbor per row in one index call
+        if self.index.ntotal == 0:
+            return [None] * len(vectors)
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        faiss.normalize_L2(vectors)
+        distances, indices = self.index.search(vectors, 1)
+        return [(self.id_mapping[idx], float(dist)) if 0 <= idx < len(self.id_mapping) else None
+                for idx, dist in zip(indices[:, 0], distances[:, 0])]
+    def filter_results(self, results: List[Tuple[int, float]], filters: dict, product_db) -> List[Tuple[int, float]]:
+        return [(pid, score) for pid, score in results if self._apply_filters(pid, filters, product_db)]
+    def get_vector(self, product_id: int) -> Optional[np.ndarray]:
+        position = self.position_by_id.get(product_id)
+        if position is None:
+            return None
+        return self.get_vectors_at([position])[0]
     def _apply_filters(self, product_id: int, filters: dict, product_db) -> bool:
         from app.models import Product
         product = product_db.query(Product).filter(Product.id == product_id).first()
@@ -55,29 +227,72 @@ class VectorDB:
             return False
         if 'material' in filters and product.material.lower() != filters['material'].lower():
             return False
+        # Color and frame style are tags in style_tags ("<style>,<color>")
+        tags = {tag.strip().lower() for tag in (product.style_tags or "").split(",")}
+        if 'color' in filters and filters['color'].lower() not in tags:
+            return False
+        if 'frame_style' in filters and filters['frame_style'].lower() not in tags:
+            return False
         return True
     def update_vector(self, product_id: int, new_vector: np.ndarray):
         logger.warning("Direct vector updates not supported. Use feedback boosting in metadata.")
     def save_index(self):
         try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.ids_path, 'wb') as f:
+            # Write both files aside and rename, so a concurrent reader never sees a partial file
+            faiss.write_index(self.index, self.index_path + ".tmp")
+            with open(self.ids_path + ".tmp", 'wb') as f:
                 pickle.dump(self.id_mapping, f)
+            vectors = self.compact_vectors
+            if vectors is None:
+                # Older index without a store: rebuild it once from the index itself
+                vectors = self.index.reconstruct_n(0, self.index.ntotal).astype(np.float16)
+            with open(self.vectors_path + ".tmp", 'wb') as f:
+                np.save(f, vectors)
+            self.meta.update(vectors=self.index.ntotal, products=self.product_count, index_factory=self.index_factory,
+                             vector_store="float16", saved_at=time.time())
+            with open(self.meta_path + ".tmp", 'w') as f:
+                json.dump(self.meta, f, indent=2)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            os.replace(self.ids_path + ".tmp", self.ids_path)
+            os.replace(self.vectors_path + ".tmp", self.vectors_path)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
             logger.info(f"Saved index with {self.index.ntotal} vectors to {self.index_path}")
         except Exception as e:
             logger.error(f"Error saving index: {str(e)}")
     def load_index(self):
         try:
             if os.path.exists(self.index_path) and os.path.exists(self.ids_path):
-                self.index = faiss.read_index(self.index_path)
+                # Memory-mapped indexes share page-cache pages across processes instead of copying them
+                io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if self.mmap else 0
+                self.index = faiss.read_index(self.index_path, io_flags)
+                self._configure_index(self.index)
                 with open(self.ids_path, 'rb') as f:
                     self.id_mapping = pickle.load(f)
+                self.position_by_id = {}
+                for pos, pid in enumerate(self.id_mapping):
+                    self.position_by_id.setdefault(pid, pos)
+                self.meta = read_index_meta(self.index_path)
+                # A rebuild (catalog sync) recreates the kind of index that was saved, not the constructor default
+                self.index_factory = self.meta.get("index_factory", self.index_factory)
+                self.vectors = None
+                self._vector_blocks = []
+                if os.path.exists(self.vectors_path):
+                    self.vectors = np.load(self.vectors_path, mmap_mode='r')
+                if self.compact_vectors is None:
+                    self.vectors = None
+                    if not self.exact:
+                        logger.warning(f"No float16 vectors for {self.index_path}, serving approximate scores")
                 logger.info(f"Loaded index with {self.index.ntotal} vectors from {self.index_path}")
         except Exception as e:
             logger.warning(f"Could not load index: {str(e)}. Starting with empty index.")
     def get_stats(self) -> dict:
         return {
             "total_vectors": self.index.ntotal,
+            "total_products": self.product_count,
+            "model_version": self.model_version,
+            "index_version": self.meta.get("index_version"),
             "dimension": self.dimension,
-            "index_type": "IndexFlatIP (Cosine Similarity)"
+            "reranking": self.reranking,
+            "index_type": "IndexFlatIP (Cosine Similarity)" if self.index_factory == "Flat"
+                          else f"{self.index_factory} (Inner Product)"
         }
\ No newline at end of file
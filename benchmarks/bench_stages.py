@@ -0,0 +1,144 @@
+import argparse
+import io
+import os
+import random
+import time
+from collections import defaultdict
+import numpy as np
+from benchmarks.common import enter_workdir, summarize, synthetic_query_image, write_results
+from benchmarks.synthetic_catalog import build_catalog
+# total is the default /search path (diversity=0); mmr only runs when a request sets diversity, so it is
+# timed on its own after the total. filtered_requests is the filtering stage over requests with filters only.
+STAGES = ["decode", "preprocess", "inference", "color", "attributes", "ann_search",
+          "filtering", "ranking", "hydration", "total", "mmr", "filtered_requests"]
+TEXT_MODIFIERS = [None, "but in gold", "in black metal", "round tortoise"]
+def random_filters(rng: random.Random) -> dict:
+    filters = {}
+    if rng.random() < 0.5:
+        filters["price_max"] = rng.choice([150.0, 300.0, 450.0])
+    if rng.random() < 0.3:
+        filters["material"] = rng.choice(["Acetate", "Metal", "Plastic", "Titanium"])
+    return filters
+def run(workdir: str, size: int, iterations: int, warmup: int, pretrained: bool, rebuild: bool, diversity: float = 0.3,
+        seed: int = 0, tta: bool = False) -> dict:
+    if rebuild or not os.path.exists(os.path.join(workdir, "data", "embeddings", "faiss.index")):
+        build_catalog(workdir, size=size, seed=seed)
+    enter_workdir(workdir)
+    import torch
+    from PIL import Image
+    from app.models import SessionLocal, Product
+    from app.feature_extractor import FeatureExtractor
+    from app.attribute_recognizer import AttributeRecognizer
+    from app.color_analyzer import ColorAnalyzer
+    from app.vector_db import VectorDB
+    from app.multimodal_search import load_multimodal_search
+    from app.ranking import RankingEngine
+    # Same fetch sizes as the /search handler
+    from app.main import CANDIDATE_FETCH, CANDIDATE_POOL
+    feature_extractor = FeatureExtractor(pretrained=pretrained, tta=tta)
+    attribute_recognizer = AttributeRecognizer(model_version=feature_extractor.version)
+    color_analyzer = ColorAnalyzer()
+    vector_db = VectorDB(dimension=2048)
+    multimodal_search = load_multimodal_search()
+    ranking = RankingEngine()
+    db = SessionLocal()
+    rng = random.Random(seed)
+    queries = [synthetic_query_image(seed + i) for i in range(8)]
+    timings = defaultdict(list)
+    filtered_candidates, filtered_share = [], []
+    try:
+        for iteration in range(warmup + iterations):
+            stage_times = {}
+            content = queries[iteration % len(queries)]
+            filters = random_filters(rng)
+            text_modifier = rng.choice(TEXT_MODIFIERS)
+            start = last = time.perf_counter()
+            def mark(stage: str):
+                nonlocal last
+                now = time.perf_counter()
+                stage_times[stage] = (now - last) * 1000.0
+                last = now
+            image = Image.open(io.BytesIO(content)).convert("RGB")
+            mark("decode")
+            if tta:
+                # Building the views (including the smart crop) counts as preprocessing
+                tensor = feature_extractor.tta_batch(image).to(feature_extractor.device)
+            else:
+                tensor = feature_extractor.preprocess_image(image).to(feature_extractor.device)
+            mark("preprocess")
+            with torch.no_grad():
+                features = feature_extractor.model(tensor)
+            query_features = feature_extractor.pool_views(features)
+            mark("inference")
+            color = color_analyzer.analyze(image)
+            mark("color")
+            attribute_recognizer.extract_attributes(query_features, color=color)
+            mark("attributes")
+            candidates = vector_db.ann_search(query_features, CANDIDATE_FETCH)
+            mark("ann_search")
+            checked = len(candidates)
+            if filters:
+                candidates = vector_db.filter_results(candidates, filters, db)
+            results = candidates[:CANDIDATE_POOL]
+            mark("filtering")
+            modifiers = multimodal_search.parse_modifier(text_modifier) if text_modifier else {}
+            ranked, _, _ = ranking.rank([pid for pid, _ in results], [score for _, score in results], db, k=10,
+                                        modifiers=modifiers, multimodal_search=multimodal_search)
+            mark("ranking")
+            for product_id, _ in ranked:
+                db.query(Product).filter(Product.id == product_id).first()
+            mark("hydration")
+            stage_times["total"] = (last - start) * 1000.0
+            # MMR alone, over the same candidates, outside the total
+            ids = np.array([pid for pid, _ in results], dtype=np.int64)
+            scores = np.array([score for _, score in results], dtype=np.float32)
+            ranking.diversify(ids, scores, np.ones(len(ids), dtype=bool), 10, diversity, vector_db)
+            mark("mmr")
+            if filters:
+                stage_times["filtered_requests"] = stage_times["filtering"]
+            if iteration >= warmup:
+                for stage, elapsed in stage_times.items():
+                    timings[stage].append(elapsed)
+                if filters:
+                    filtered_candidates.append(checked)
+                    filtered_share.append(stage_times["filtering"] / stage_times["total"])
+    finally:
+        db.close()
+    return {
+        "config": {
+            "catalog_size": vector_db.index.ntotal,
+            "iterations": iterations,
+            "warmup": warmup,
+            "pretrained": pretrained,
+            "diversity": diversity,
+            "tta": tta,
+            "device": feature_extractor.device
+        },
+        "stages": {stage: summarize(timings[stage]) for stage in STAGES},
+        # VectorDB.filter_results loads each candidate's row with its own query, so filtering costs
+        # one query per candidate and grows with the catalog rather than with k
+        "filtering": {
+            "queries_per_filtered_request": round(float(np.mean(filtered_candidates)), 1) if filtered_candidates else 0,
+            "share_of_filtered_request_total": round(float(np.median(filtered_share)), 3) if filtered_share else 0
+        }
+    }
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency of the /search pipeline on a synthetic catalog")
+    parser.add_argument("--workdir", default="/tmp/eyewear-bench")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--pretrained", action="store_true", help="Load ImageNet weights (timings are the same with random weights)")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate the synthetic catalog")
+    parser.add_argument("--diversity", type=float, default=0.3, help="MMR diversity for the mmr stage (not in total)")
+    parser.add_argument("--tta", action="store_true", help="Embed queries with test-time augmentation")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    results = run(os.path.abspath(args.workdir), args.size, args.iterations, args.warmup, args.pretrained, args.rebuild,
+                  args.diversity, tta=args.tta)
+    for stage, summary in results["stages"].items():
+        print(f"{stage:>17}: p50={summary.get('p50_ms', 0):8.3f} ms  p95={summary.get('p95_ms', 0):8.3f} ms")
+    filtering = results["filtering"]
+    print(f"filtering runs one DB query per candidate: {filtering['queries_per_filtered_request']} queries per "
+          f"filtered request, {filtering['share_of_filtered_request_total']:.0%} of their median total")
+    write_results("stages", results, args.output)
@@ -0,0 +1,73 @@
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List
+import numpy as np
+from PIL import Image
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+def enter_workdir(workdir: str):
+    # app.* modules use paths relative to the working directory (data/, uploads/),
+    # so the synthetic catalog lives in its own directory and we chdir before importing them
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+        "max_ms": round(float(values.max()), 4)
+    }
+def synthetic_query_image(seed: int, size: int = 600) -> bytes:
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size // 8, size // 8, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).resize((size, size), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+def environment_info() -> dict:
+    import torch
+    import faiss
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "faiss": faiss.__version__
+    }
+def write_results(name: str, payload: dict, output: str = None) -> str:
+    revision = git_revision()
+    payload = {
+        "benchmark": name,
+        "git_revision": revision,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "environment": environment_info(),
+        **payload
+    }
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}_{revision}_{int(time.time())}.json")
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"[OK] Results written to {output}")
+    return output
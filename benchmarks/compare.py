@@ -0,0 +1,38 @@
+import argparse
+import json
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+def delta(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+def compare_stages(before: dict, after: dict):
+    print(f"{'stage':>12} {'p50 before':>11} {'p50 after':>10} {'change':>8} {'p95 before':>11} {'p95 after':>10} {'change':>8}")
+    for stage, summary in after["stages"].items():
+        old = before["stages"].get(stage, {})
+        print(f"{stage:>12} {old.get('p50_ms', 0):11.3f} {summary.get('p50_ms', 0):10.3f} "
+              f"{delta(old.get('p50_ms'), summary.get('p50_ms', 0)):>8} {old.get('p95_ms', 0):11.3f} "
+              f"{summary.get('p95_ms', 0):10.3f} {delta(old.get('p95_ms'), summary.get('p95_ms', 0)):>8}")
+def compare_load(before: dict, after: dict):
+    old_runs = {run["concurrency"]: run for run in before["runs"]}
+    print(f"{'clients':>7} {'qps before':>10} {'qps after':>9} {'change':>8} {'p99 before':>10} {'p99 after':>9} {'change':>8}")
+    for run in after["runs"]:
+        old = old_runs.get(run["concurrency"], {})
+        old_p99 = old.get("latency", {}).get("p99_ms", 0)
+        new_p99 = run["latency"].get("p99_ms", 0)
+        print(f"{run['concurrency']:>7} {old.get('qps', 0):10.2f} {run['qps']:9.2f} {delta(old.get('qps'), run['qps']):>8} "
+              f"{old_p99:10.1f} {new_p99:9.1f} {delta(old_p99, new_p99):>8}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files (e.g. from two commits)")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    before, after = load(args.before), load(args.after)
+    if before["benchmark"] != after["benchmark"]:
+        raise SystemExit(f"Cannot compare a '{before['benchmark']}' result with a '{after['benchmark']}' result")
+    print(f"{before['git_revision']} -> {after['git_revision']}")
+    if after["benchmark"] == "stages":
+        compare_stages(before, after)
+    else:
+        compare_load(before, after)
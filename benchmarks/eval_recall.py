@@ -0,0 +1,172 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.common import enter_workdir, summarize, write_results
+from benchmarks.synthetic_catalog import build_catalog
+def default_configs(size: int) -> list:
+    nlist = max(16, int(4 * np.sqrt(size)))
+    configs = [{"index_factory": "Flat", "nprobe": 1}]
+    for nprobe in (1, 4, 16, 64):
+        configs.append({"index_factory": f"IVF{nlist},Flat", "nprobe": nprobe})
+    for nprobe in (16, 64):
+        configs.append({"index_factory": f"IVF{nlist},SQ8", "nprobe": nprobe})
+        configs.append({"index_factory": f"IVF{nlist},PQ64", "nprobe": nprobe})
+        # Compressed coarse index, top candidates re-scored against the float16 vector store
+        configs.append({"index_factory": f"IVF{nlist},PQ64", "nprobe": nprobe, "rerank_factor": 4})
+    configs.append({"index_factory": "SQfp16", "nprobe": 1})
+    # No PCA configs: the PCA transform centers the vectors, so inner products after it no longer rank by
+    # the cosine similarity the ground truth uses, and recall measured that way says nothing about PCA itself
+    return configs
+def perturbed_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    # Queries are noisy copies of catalog vectors, like a new photo of a known product
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=count, replace=False)
+    queries = vectors[picks] + noise * np.abs(rng.standard_normal((count, vectors.shape[1]))).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8
+    return queries.astype(np.float32)
+def evaluate_config(config: dict, vectors: np.ndarray, product_ids: list, queries: np.ndarray,
+                    ground_truth: np.ndarray, train_size: int) -> dict:
+    from app.vector_db import VectorDB
+    import faiss
+    with tempfile.TemporaryDirectory() as tmp:
+        vector_db = VectorDB(dimension=vectors.shape[1], index_path=os.path.join(tmp, "faiss.index"),
+                             index_factory=config["index_factory"], nprobe=config["nprobe"],
+                             rerank_factor=config.get("rerank_factor", 0))
+        start = time.perf_counter()
+        vector_db.train(vectors[:train_size].copy())
+        vector_db.add_vectors(vectors.copy(), product_ids)
+        build_seconds = time.perf_counter() - start
+        latencies = []
+        recall_10 = []
+        recall_50 = []
+        score_errors = []
+        for query, truth in zip(queries, ground_truth):
+            start = time.perf_counter()
+            results = vector_db.ann_search(query, 50)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+            found = [pid for pid, _ in results]
+            if vector_db.reranking and results:
+                # Final scores against exact float32 inner products for the same products
+                exact_scores = vectors[[vector_db.position_by_id[pid] for pid, _ in results]] @ query
+                score_errors.append(float(np.max(np.abs(np.array([score for _, score in results]) -
+                                                        np.clip(exact_scores, 0.0, 1.0)))))
+            recall_10.append(len(set(found[:10]) & set(truth[:10])) / 10.0)
+            recall_50.append(len(set(found[:50]) & set(truth[:50])) / 50.0)
+        memory_bytes = faiss.serialize_index(vector_db.index).nbytes
+        if vector_db.reranking:
+            memory_bytes += vector_db.compact_vectors.nbytes
+    result = {
+        **config,
+        "recall@10": round(float(np.mean(recall_10)), 4),
+        "recall@50": round(float(np.mean(recall_50)), 4),
+        "latency": summarize(latencies),
+        "index_bytes": int(memory_bytes),
+        "bytes_per_vector": round(memory_bytes / len(vectors), 1),
+        "build_seconds": round(build_seconds, 3)
+    }
+    if score_errors:
+        result["max_score_error"] = round(max(score_errors), 6)
+    return result
+def rank_overlap(a: list, b: list, k: int = 10) -> float:
+    if not a[:k]:
+        return 1.0
+    return len(set(a[:k]) & set(b[:k])) / len(a[:k])
+def evaluate_ranking(vectors: np.ndarray, product_ids: list, queries: np.ndarray, ground_truth_scores: np.ndarray,
+                     ground_truth: np.ndarray, modifiers: list) -> dict:
+    from app.models import SessionLocal
+    from app.multimodal_search import load_multimodal_search
+    from app.ranking import RankingEngine, SIGNALS
+    db = SessionLocal()
+    boosted_overlap = []
+    boosted_similarity_loss = []
+    modifier_overlap = []
+    try:
+        multimodal_search = load_multimodal_search()
+        fused = RankingEngine()
+        similarity_only = RankingEngine(weights={name: 1.0 if name == "similarity" else 0.0 for name in SIGNALS})
+        without_modifier = RankingEngine(weights=dict(fused.weights, modifier_match=0.0))
+        for i, (truth, scores) in enumerate(zip(ground_truth, ground_truth_scores)):
+            plain, _, _ = similarity_only.rank(truth, scores, db, k=10)
+            boosted, _, _ = fused.rank(truth, scores, db, k=10)
+            similarity_order = [pid for pid, _ in plain]
+            boosted_order = [pid for pid, _ in boosted]
+            boosted_overlap.append(rank_overlap(similarity_order, boosted_order))
+            top_similarity = np.mean([score for _, score in plain]) if plain else 0.0
+            boosted_similarity = np.mean([score for _, score in boosted]) if boosted else 0.0
+            boosted_similarity_loss.append(top_similarity - boosted_similarity)
+            modifier = multimodal_search.parse_modifier(modifiers[i % len(modifiers)])
+            unmatched, _, _ = without_modifier.rank(truth, scores, db, k=10, modifiers=modifier,
+                                                    multimodal_search=multimodal_search)
+            matched, _, _ = fused.rank(truth, scores, db, k=10, modifiers=modifier, multimodal_search=multimodal_search)
+            modifier_overlap.append(rank_overlap([pid for pid, _ in unmatched], [pid for pid, _ in matched]))
+    finally:
+        db.close()
+    return {
+        "weights": fused.weights,
+        "fused_ranking": {
+            "overlap@10_vs_similarity": round(float(np.mean(boosted_overlap)), 4),
+            "mean_top10_similarity_loss": round(float(np.mean(boosted_similarity_loss)), 5)
+        },
+        "modifier_match": {
+            "overlap@10_vs_no_modifier_weight": round(float(np.mean(modifier_overlap)), 4)
+        }
+    }
+def run(workdir: str, size: int, query_count: int, noise: float, train_size: int, index_path: str = None,
+        seed: int = 0) -> dict:
+    import faiss
+    if index_path:
+        index_path = os.path.abspath(index_path)
+        enter_workdir(workdir)
+        from app.vector_db import VectorDB
+        source = VectorDB(index_path=index_path)
+        # Exact vectors even when the source index is compressed (from its float16 store)
+        vectors = source.get_vectors_range(0, source.index.ntotal)
+        product_ids = list(source.id_mapping)
+    else:
+        vectors = build_catalog(workdir, size=size, seed=seed)
+        product_ids = list(range(1, len(vectors) + 1))
+    queries = perturbed_queries(vectors, min(query_count, len(vectors)), noise, seed)
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    scores, positions = exact.search(queries, 50)
+    id_array = np.asarray(product_ids)
+    ground_truth = id_array[positions]
+    results = []
+    for config in default_configs(len(vectors)):
+        result = evaluate_config(config, vectors, product_ids, queries, ground_truth, min(train_size, len(vectors)))
+        print(f"{config['index_factory']:>24} nprobe={config['nprobe']:<3} rerank={config.get('rerank_factor', 0)} "
+              f"recall@10={result['recall@10']:.3f} "
+              f"recall@50={result['recall@50']:.3f} p50={result['latency']['p50_ms']:.3f} ms "
+              f"{result['bytes_per_vector']:>8.1f} B/vector")
+        results.append(result)
+    ranking = None
+    if not index_path:
+        ranking = evaluate_ranking(vectors, product_ids, queries, scores, ground_truth,
+                                   ["but in gold", "black metal", "round tortoise", "in titanium"])
+        print(f"fused ranking: {ranking['fused_ranking']}")
+        print(f"modifier match: {ranking['modifier_match']}")
+    return {
+        "config": {
+            "catalog_size": len(vectors),
+            "queries": len(queries),
+            "query_noise": noise,
+            "train_size": min(train_size, len(vectors)),
+            "source": index_path or "synthetic"
+        },
+        "index_configs": results,
+        "ranking": ranking
+    }
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall/latency/memory sweep of VectorDB index configurations against exact search")
+    parser.add_argument("--workdir", default="/tmp/eyewear-eval")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.3)
+    parser.add_argument("--train-size", type=int, default=20000)
+    parser.add_argument("--index", default=None, help="Evaluate on the vectors of an existing index instead of a synthetic catalog")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    results = run(os.path.abspath(args.workdir), args.size, args.queries, args.noise, args.train_size, args.index)
+    write_results("recall", results, args.output)
@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from benchmarks.common import REPO_ROOT, summarize, synthetic_query_image, write_results
+from benchmarks.synthetic_catalog import build_catalog
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+def start_server(workdir: str, port: int, pretrained: bool, extra_args=None, timeout: float = 300.0) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["EYEWEAR_PRETRAINED"] = "1" if pretrained else "0"
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+               "--port", str(port), "--log-level", "warning"] + (extra_args or [])
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=2).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not become ready in time")
+def run_load(base_url: str, concurrency: int, duration: float, warmup: int = 3, seed: int = 0) -> dict:
+    queries = [synthetic_query_image(seed + i) for i in range(16)]
+    with requests.Session() as session:
+        for i in range(warmup):
+            session.post(f"{base_url}/search", files={"image": ("warmup.jpg", queries[i % len(queries)], "image/jpeg")})
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    def client(worker_id: int):
+        rng = random.Random(seed + worker_id)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                data = {}
+                if rng.random() < 0.5:
+                    data["price_max"] = str(rng.choice([150, 300, 450]))
+                if rng.random() < 0.3:
+                    data["text_modifier"] = rng.choice(["but in gold", "in black metal", "round tortoise"])
+                files = {"image": ("query.jpg", rng.choice(queries), "image/jpeg")}
+                start = time.perf_counter()
+                try:
+                    response = session.post(f"{base_url}/search", files=files, data=data, timeout=60)
+                    elapsed = (time.perf_counter() - start) * 1000.0
+                    with lock:
+                        if response.status_code == 200:
+                            latencies.append(elapsed)
+                        else:
+                            errors.append(response.status_code)
+                except requests.RequestException as e:
+                    with lock:
+                        errors.append(type(e).__name__)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "qps": round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency": summarize(latencies)
+    }
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive /search with concurrent clients and report QPS and latency percentiles")
+    parser.add_argument("--workdir", default="/tmp/eyewear-bench")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--url", default=None, help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--pretrained", action="store_true")
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    workdir = os.path.abspath(args.workdir)
+    process = None
+    base_url = args.url
+    if base_url is None:
+        if args.rebuild or not os.path.exists(os.path.join(workdir, "data", "embeddings", "faiss.index")):
+            build_catalog(workdir, size=args.size)
+            os.chdir(REPO_ROOT)
+        port = free_port()
+        process = start_server(workdir, port, args.pretrained)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        catalog_size = requests.get(f"{base_url}/stats", timeout=10).json()["vector_db"]["total_vectors"]
+        runs = []
+        for concurrency in args.concurrency:
+            result = run_load(base_url, concurrency, args.duration)
+            latency = result["latency"]
+            print(f"concurrency={concurrency:>3}: {result['qps']:8.2f} qps  "
+                  f"p50={latency.get('p50_ms', 0):.1f} ms  p95={latency.get('p95_ms', 0):.1f} ms  "
+                  f"p99={latency.get('p99_ms', 0):.1f} ms  errors={result['errors']}")
+            runs.append(result)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+    write_results("load", {"config": {"catalog_size": catalog_size, "url": args.url}, "runs": runs}, args.output)
@@ -0,0 +1,67 @@
+import argparse
+import os
+import random
+import shutil
+import numpy as np
+from benchmarks.common import enter_workdir
+def synthetic_vectors(size: int, dimension: int = 2048, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    # ResNet50 pooled features are post-ReLU, so catalog vectors are non-negative
+    # and clustered around a few "styles", like real embeddings
+    rng = np.random.default_rng(seed)
+    centers = np.abs(rng.standard_normal((clusters, dimension))).astype(np.float32)
+    assignments = rng.integers(0, clusters, size=size)
+    vectors = centers[assignments] + np.abs(rng.standard_normal((size, dimension))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8
+    return vectors.astype(np.float32)
+def build_catalog(workdir: str, size: int = 10000, dimension: int = 2048, seed: int = 0, batch_size: int = 5000):
+    enter_workdir(workdir)
+    from app.models import init_db, SessionLocal, Product
+    from app.vector_db import VectorDB
+    from app.attribute_recognizer import AttributeRecognizer
+    from app.ingest_images import generate_sample_metadata
+    from app.multimodal_search import compute_tag_bits
+    # Everything derived from an earlier catalog (index manifest, float16 store, neighbor graph,
+    # modifier directions, snapshot) goes with it, so no benchmark reads a mismatched file
+    if os.path.exists("data/db.sqlite"):
+        os.remove("data/db.sqlite")
+    shutil.rmtree("data/embeddings", ignore_errors=True)
+    random.seed(seed)
+    init_db()
+    db = SessionLocal()
+    vector_db = VectorDB(dimension=dimension)
+    vectors = synthetic_vectors(size, dimension=dimension, seed=seed)
+    try:
+        for start in range(0, size, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, size)):
+                metadata = generate_sample_metadata(f"synthetic_{i}.jpg")
+                style_tags = ",".join([
+                    random.choice(AttributeRecognizer.STYLE_LABELS),
+                    random.choice(AttributeRecognizer.COLOR_LABELS)
+                ])
+                rows.append({
+                    "id": i + 1,
+                    "image_path": f"synthetic_{i}.jpg",
+                    "brand": metadata["brand"],
+                    "price": metadata["price"],
+                    "material": metadata["material"],
+                    "style_tags": style_tags,
+                    "tag_bits": compute_tag_bits(style_tags, metadata["material"]),
+                    "click_count": random.randint(0, 50),
+                    "relevance_score": random.random()
+                })
+            db.bulk_insert_mappings(Product, rows)
+            db.commit()
+            vector_db.add_vectors(vectors[start:start + len(rows)].copy(), [row["id"] for row in rows])
+        vector_db.save_index()
+    finally:
+        db.close()
+    print(f"[OK] Synthetic catalog with {size} products written to {workdir}")
+    return vectors
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic catalog (random vectors + metadata, no network)")
+    parser.add_argument("--workdir", default="/tmp/eyewear-bench")
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    build_catalog(os.path.abspath(args.workdir), size=args.size, seed=args.seed)
@@ -1,8 +1,20 @@
+import argparse
+import csv
+import hashlib
+import json
 import os
-import requests
+import queue
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
 SAVE_DIR = "data/images"
-os.makedirs(SAVE_DIR, exist_ok=True)
+STATE_FILE = ".download_state.jsonl"
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
 WORKING_URLS = [
     "https://images.unsplash.com/photo-1572635196237-14b3f281503f?w=600&q=80",
     "https://images.unsplash.com/photo-1577803645773-f96470509666?w=600&q=80",
@@ -15,35 +27,202 @@ WORKING_URLS = [
     "https://images.unsplash.com/photo-1509941323117-9c7881d29d97?w=600&q=80",
     "https://images.unsplash.com/photo-1625591348650-3a382c730414?w=600&q=80"
 ]
-def download_images():
-    print(f"--- Phase 1: Downloading {len(WORKING_URLS)} curated images ---")
-    for i, url in enumerate(WORKING_URLS):
-        filename = f"glasses_{i+1}.jpg"
-        save_image(url, filename)
-    print(f"\n--- Phase 2: Fetching more via LoremFlickr ---")
-    current_count = len(WORKING_URLS)
-    target_count = 50
-    for i in range(current_count, target_count):
-        url = f"https://loremflickr.com/600/600/glasses,sunglasses/all?lock={i}"
-        filename = f"glasses_{i+1}.jpg"
-        save_image(url, filename)
-        time.sleep(0.5)
-    print("\n[SUCCESS] Download complete! Images saved to 'data/images/'")
-def save_image(url, filename):
-    file_path = os.path.join(SAVE_DIR, filename)
-    if os.path.exists(file_path):
-        print(f"[SKIP] {filename} already exists")
-        return
-    try:
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
-        if response.status_code == 200:
-            with open(file_path, "wb") as f:
-                f.write(response.content)
-            print(f"[OK] Saved: {filename}")
-        else:
-            print(f"[FAIL] {filename} (Status: {response.status_code})")
-    except Exception as e:
-        print(f"[ERROR] {filename}: {e}")
+def default_manifest(target_count=50):
+    entries = [{"url": url, "filename": f"glasses_{i+1}.jpg"} for i, url in enumerate(WORKING_URLS)]
+    for i in range(len(WORKING_URLS), target_count):
+        entries.append({
+            "url": f"https://loremflickr.com/600/600/glasses,sunglasses/all?lock={i}",
+            "filename": f"glasses_{i+1}.jpg"
+        })
+    return entries
+def read_manifest(path):
+    # CSV with a `url` column and optional `filename` column
+    with open(path, newline="") as f:
+        entries = []
+        for row in csv.DictReader(f):
+            url = (row.get("url") or "").strip()
+            if not url:
+                continue
+            filename = (row.get("filename") or "").strip()
+            if not filename:
+                filename = hashlib.sha1(url.encode()).hexdigest()[:16] + ".jpg"
+            entries.append({"url": url, "filename": os.path.basename(filename)})
+    return entries
+class HostRateLimiter:
+    # At most `per_host` requests in flight and `rate` request starts per second for each host
+    def __init__(self, rate=2.0, per_host=4):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.next_slot = {}
+        self.semaphores = {}
+    def _semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+    def acquire(self, host):
+        self._semaphore(host).acquire()
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+    def release(self, host):
+        self._semaphore(host).release()
+    def backoff(self, host, seconds):
+        # Server pushed back (429/Retry-After): delay every request to that host, not just this one
+        with self.lock:
+            self.next_slot[host] = max(self.next_slot.get(host, 0.0), time.monotonic() + seconds)
+class Downloader:
+    def __init__(self, save_dir=SAVE_DIR, workers=16, rate=2.0, per_host=4, retries=4, timeout=15):
+        self.save_dir = save_dir
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.limiter = HostRateLimiter(rate=rate, per_host=per_host)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "Mozilla/5.0"
+        self.state_path = os.path.join(save_dir, STATE_FILE)
+        self.state_lock = threading.Lock()
+        os.makedirs(save_dir, exist_ok=True)
+        self.completed = self.load_state()
+    def load_state(self):
+        completed = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                content = f.read()
+            for line in content.splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from an interrupted run
+                completed[record["filename"]] = record
+            if content and not content.endswith("\n"):
+                # Terminate the torn line, so the next record starts on a line of its own
+                with open(self.state_path, "a") as f:
+                    f.write("\n")
+        return completed
+    def record(self, entry, size, digest):
+        record = {"url": entry["url"], "filename": entry["filename"], "size": size, "sha256": digest}
+        with self.state_lock:
+            with open(self.state_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self.completed[entry["filename"]] = record
+    def is_done(self, entry):
+        # Resume by URL + size, not just filename: a truncated or replaced file is fetched again
+        record = self.completed.get(entry["filename"])
+        if record is None or record["url"] != entry["url"]:
+            return False
+        path = os.path.join(self.save_dir, entry["filename"])
+        return os.path.exists(path) and os.path.getsize(path) == record["size"]
+    def fetch(self, entry):
+        host = urlparse(entry["url"]).netloc
+        path = os.path.join(self.save_dir, entry["filename"])
+        tmp_path = f"{path}.part"
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+            self.limiter.acquire(host)
+            try:
+                with self.session.get(entry["url"], timeout=self.timeout, stream=True, allow_redirects=True) as response:
+                    if response.status_code in RETRY_STATUSES:
+                        retry_after = response.headers.get("Retry-After", "")
+                        if retry_after.isdigit():
+                            self.limiter.backoff(host, float(retry_after))
+                        last_error = f"Status: {response.status_code}"
+                        continue
+                    if response.status_code != 200:
+                        return False, f"Status: {response.status_code}"
+                    digest = hashlib.sha256()
+                    size = 0
+                    with open(tmp_path, "wb") as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    expected = response.headers.get("Content-Length", "")
+                    if expected.isdigit() and int(expected) != size and not response.headers.get("Content-Encoding"):
+                        last_error = f"Truncated download: {size} of {expected} bytes"
+                        continue
+                try:
+                    with Image.open(tmp_path) as img:
+                        img.verify()
+                except Exception as e:
+                    # verify() raises more than OSError (e.g. SyntaxError) for damaged files
+                    last_error = f"Invalid image: {str(e)}"
+                    continue
+                os.replace(tmp_path, path)
+                self.record(entry, size, digest.hexdigest())
+                return True, None
+            except (requests.RequestException, OSError) as e:
+                last_error = str(e)
+            finally:
+                self.limiter.release(host)
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return False, last_error
+    def run(self, entries, on_complete=None):
+        pending = [e for e in entries if not self.is_done(e)]
+        skipped = len(entries) - len(pending)
+        if skipped:
+            print(f"[SKIP] {skipped} images already downloaded")
+        ok = failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch, entry): entry for entry in pending}
+            for future in as_completed(futures):
+                entry = futures[future]
+                success, error = future.result()
+                if success:
+                    ok += 1
+                    print(f"[OK] Saved: {entry['filename']}")
+                    if on_complete is not None:
+                        on_complete(os.path.join(self.save_dir, entry["filename"]))
+                else:
+                    failed += 1
+                    print(f"[FAIL] {entry['filename']} ({error})")
+        return {"downloaded": ok, "skipped": skipped, "failed": failed}
+def download_images(manifest=None, ingest=False, **options):
+    entries = read_manifest(manifest) if manifest else default_manifest()
+    downloader = Downloader(**options)
+    print(f"--- Downloading {len(entries)} images with {downloader.workers} workers ---")
+    if not ingest:
+        summary = downloader.run(entries)
+    else:
+        # Feed each finished file straight into ingestion while the rest are still downloading
+        from pathlib import Path
+        from app.ingest_images import ingest_files
+        arrivals = queue.Queue()
+        result = {}
+        def produce():
+            try:
+                result.update(downloader.run(entries, on_complete=lambda p: arrivals.put(Path(p))))
+            finally:
+                arrivals.put(None)
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        ingest_files(iter(arrivals.get, None), image_dir=downloader.save_dir)
+        producer.join()
+        summary = result
+    print(f"\n[SUCCESS] Download complete! {summary['downloaded']} new, {summary['skipped']} skipped, "
+          f"{summary['failed']} failed. Images saved to '{downloader.save_dir}/'")
+    return summary
 if __name__ == "__main__":
-    download_images()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download catalog images from a manifest")
+    parser.add_argument("--manifest", help="CSV with url[,filename] columns (default: built-in sample catalog)")
+    parser.add_argument("--save-dir", default=SAVE_DIR)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=2.0, help="Request starts per second per host")
+    parser.add_argument("--per-host", type=int, default=4, help="Concurrent requests per host")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--ingest", action="store_true", help="Ingest images as they arrive")
+    args = parser.parse_args()
+    download_images(args.manifest, ingest=args.ingest, save_dir=args.save_dir, workers=args.workers,
+                    rate=args.rate, per_host=args.per_host, retries=args.retries)
\ No newline at end of file
@@ -0,0 +1,6 @@
+import os
+import sys
+# download_images.py and app/ live at the repository root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from PIL import Image
+import download_images
+from download_images import Downloader, STATE_FILE
+def png_bytes(color=(0, 0, 0)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+class StandIn:
+    # Local HTTP stand-in: each path serves a script of responses, one per request, the last one repeating.
+    # A response is (status, body) or ("truncate", body) to drop the connection halfway through the body.
+    def __init__(self):
+        self.routes = {}
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    script = stand_in.routes.get(self.path, [(404, b"")])
+                    status, body = script[min(stand_in.hits[self.path], len(script) - 1)]
+                    stand_in.hits[self.path] += 1
+                if status == "truncate":
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Retries would otherwise sleep for seconds between attempts
+    monkeypatch.setattr(download_images.time, "sleep", lambda seconds: None)
+def make_downloader(save_dir, retries=3) -> Downloader:
+    return Downloader(save_dir=str(save_dir), workers=4, rate=0, per_host=4, retries=retries, timeout=5)
+def state_records(save_dir) -> dict:
+    with open(os.path.join(save_dir, STATE_FILE)) as f:
+        return {record["filename"]: record for record in map(json.loads, f)}
+def test_downloads_and_records_checksums(stand_in, tmp_path):
+    bodies = {f"/{i}.png": png_bytes((i * 40, 0, 0)) for i in range(3)}
+    for path, body in bodies.items():
+        stand_in.routes[path] = [(200, body)]
+    entries = [{"url": stand_in.url(path), "filename": f"glasses_{i}.png"} for i, path in enumerate(bodies)]
+    summary = make_downloader(tmp_path).run(entries)
+    assert summary == {"downloaded": 3, "skipped": 0, "failed": 0}
+    records = state_records(tmp_path)
+    for entry, body in zip(entries, bodies.values()):
+        with open(tmp_path / entry["filename"], "rb") as f:
+            assert f.read() == body
+        assert records[entry["filename"]]["sha256"] == hashlib.sha256(body).hexdigest()
+        assert records[entry["filename"]]["size"] == len(body)
+def test_retries_transient_statuses(stand_in, tmp_path):
+    body = png_bytes()
+    stand_in.routes["/flaky.png"] = [(503, b""), (429, b""), (200, body)]
+    summary = make_downloader(tmp_path).run([{"url": stand_in.url("/flaky.png"), "filename": "flaky.png"}])
+    assert summary["downloaded"] == 1
+    assert stand_in.hits["/flaky.png"] == 3
+def test_gives_up_after_retries_without_leaving_files(stand_in, tmp_path):
+    stand_in.routes["/down.png"] = [(500, b"")]
+    summary = make_downloader(tmp_path, retries=2).run([{"url": stand_in.url("/down.png"), "filename": "down.png"}])
+    assert summary["failed"] == 1
+    assert stand_in.hits["/down.png"] == 3
+    assert not os.path.exists(tmp_path / "down.png")
+    assert not os.path.exists(tmp_path / "down.png.part")
+def test_client_errors_are_not_retried(stand_in, tmp_path):
+    summary = make_downloader(tmp_path).run([{"url": stand_in.url("/missing.png"), "filename": "missing.png"}])
+    assert summary["failed"] == 1
+    assert stand_in.hits["/missing.png"] == 1
+def test_truncated_response_is_retried_and_never_published(stand_in, tmp_path):
+    body = png_bytes((0, 200, 0))
+    stand_in.routes["/cut.png"] = [("truncate", body), (200, body)]
+    summary = make_downloader(tmp_path).run([{"url": stand_in.url("/cut.png"), "filename": "cut.png"}])
+    assert summary["downloaded"] == 1
+    with open(tmp_path / "cut.png", "rb") as f:
+        assert f.read() == body
+    assert not os.path.exists(tmp_path / "cut.png.part")
+def test_invalid_image_is_rejected(stand_in, tmp_path):
+    stand_in.routes["/html.png"] = [(200, b"<html>not an image</html>")]
+    summary = make_downloader(tmp_path, retries=1).run([{"url": stand_in.url("/html.png"), "filename": "html.png"}])
+    assert summary["failed"] == 1
+    assert not os.path.exists(tmp_path / "html.png")
+    assert not os.path.exists(tmp_path / "html.png.part")
+def test_resume_skips_completed_and_refetches_damaged_files(stand_in, tmp_path):
+    bodies = {"/a.png": png_bytes((10, 10, 10)), "/b.png": png_bytes((20, 20, 20))}
+    for path, body in bodies.items():
+        stand_in.routes[path] = [(200, body)]
+    entries = [{"url": stand_in.url(path), "filename": path.lstrip("/")} for path in bodies]
+    assert make_downloader(tmp_path).run(entries)["downloaded"] == 2
+    # A fresh run (new process) trusts the state file and the files on disk
+    assert make_downloader(tmp_path).run(entries) == {"downloaded": 0, "skipped": 2, "failed": 0}
+    assert stand_in.hits == Counter({"/a.png": 1, "/b.png": 1})
+    # A truncated file and a torn last state line (interrupted run) are handled on the next resume
+    with open(tmp_path / "a.png", "r+b") as f:
+        f.truncate(10)
+    with open(tmp_path / STATE_FILE, "a") as f:
+        f.write('{"url": "http://')
+    assert make_downloader(tmp_path).run(entries) == {"downloaded": 1, "skipped": 1, "failed": 0}
+    with open(tmp_path / "a.png", "rb") as f:
+        assert f.read() == bodies["/a.png"]
+def test_changed_url_is_downloaded_again(stand_in, tmp_path):
+    stand_in.routes["/old.png"] = [(200, png_bytes((1, 1, 1)))]
+    stand_in.routes["/new.png"] = [(200, png_bytes((2, 2, 2)))]
+    make_downloader(tmp_path).run([{"url": stand_in.url("/old.png"), "filename": "frame.png"}])
+    summary = make_downloader(tmp_path).run([{"url": stand_in.url("/new.png"), "filename": "frame.png"}])
+    assert summary["downloaded"] == 1
+    assert state_records(tmp_path)["frame.png"]["url"] == stand_in.url("/new.png")